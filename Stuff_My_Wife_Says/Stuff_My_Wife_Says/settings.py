@@ -54,6 +54,8 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # attaches the customers shopping cart to the request as request.cart. Needs the session.
+    'shop.middleware.CartMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -77,6 +79,9 @@ TEMPLATES = [
 
                 # context processor for dynamic navbar content i.e. Products dropdown menu
                 'shop.context_processors.navbar_context',
+
+                # the customers shopping cart loaded for the request
+                'shop.context_processors.cart_context',
             ],
         },
     },
@@ -88,13 +93,66 @@ WSGI_APPLICATION = 'Stuff_My_Wife_Says.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite tuning, every setting can be changed from the environment.
+# WAL lets pages keep reading while a cart or order is being written. synchronous=NORMAL is safe in WAL mode,
+# a power cut can lose the last few commits but can't corrupt the database.
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')
+# milliseconds to wait for another connection to finish writing before giving up with "database is locked".
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+# bytes of the database file read through memory mapping instead of read() calls, 0 turns it off.
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024))
+# page cache for each connection, negative numbers are in KiB.
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -20000))
+# IMMEDIATE takes the write lock when a transaction starts, see Stuff_My_Wife_Says/sqlite/base.py.
+# An empty value uses SQLite's default (DEFERRED).
+# This applies to every atomic() block, so a read-only one also waits for and blocks writers. The shops own atomic()
+# blocks all write (cart, checkout, stock, imports and the cleanup commands) and page views read in autocommit mode,
+# which IMMEDIATE doesn't touch. Django's admin doesn't: its add, change and delete views run in atomic() even for
+# GET, so opening one of those pages holds the write lock until the page is rendered and checkouts wait behind it.
+# That's accepted, only staff use the admin and a product change page takes about 30 ms with 100k products, so
+# IMMEDIATE is still the default.
+# Only wrap writes in atomic() in the shop to keep it so.
+SQLITE_TRANSACTION_MODE = os.environ.get('SQLITE_TRANSACTION_MODE', 'IMMEDIATE') or None
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # Django's SQLite backend plus the init_command and transaction_mode OPTIONS from Django 5.1.
+        'ENGINE': 'Stuff_My_Wife_Says.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # busy_timeout goes first so changing the journal mode waits for other connections.
+            'init_command': (f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}; '
+                             f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}; '
+                             f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}; '
+                             f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}; '
+                             f'PRAGMA cache_size={SQLITE_CACHE_SIZE}'),
+            'transaction_mode': SQLITE_TRANSACTION_MODE,
+        },
+        # tests use a database file rather than SQLite's in memory database so tests with several threads
+        # get proper database locking, i.e. parallel checkouts of the same cart.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# cached data is versioned through this cache so it must be shared by every worker process, otherwise a
+# version bump in one worker is never seen by the others. The default file based cache is shared by the workers
+# on one server, point CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached when running on several servers.
+# The tests use a local memory cache (see TEST_RUNNER below).
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', str(BASE_DIR / 'cache')),
     }
 }
 
+# runs the tests with their own cache, so they don't see or change the cache of the running site.
+TEST_RUNNER = 'Stuff_My_Wife_Says.test_runner.TestRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -156,7 +214,40 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # 60secs x 60secs x 24hrs x 30days
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 30
 
+# where shopping carts are kept. 'database' stores every cart in the ShoppingCartSession and ShoppingCartItem models.
+# 'cookie' keeps anonymous carts in a signed cookie (expiring with SESSION_COOKIE_AGE) and only writes them to the
+# database at checkout, or once they have more than CART_COOKIE_MAX_ITEMS items.
+# Changing the storage starts customers off with a new cart.
+CART_STORAGE = os.environ.get('CART_STORAGE', 'database')
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_MAX_ITEMS = 20
+
+# days without any change before the reap_carts command marks an open cart as abandoned,
+# and days an abandoned cart is kept after that before it is deleted along with its items.
+CART_ABANDONED_AFTER_DAYS = 30
+CART_PURGE_AFTER_DAYS = 30
+
 # email backend for sending contact form data during development
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = 'stuffmywifesays@email.com'    # dedicated email for sending the customers message.
-CONTACT_EMAIL = 'terminal@email.com'    # placeholder. Real email would go here for receiving customer emails.
\ No newline at end of file
+CONTACT_EMAIL = 'terminal@email.com'    # placeholder. Real email would go here for receiving customer emails.
+
+# emails are queued in the OutboxEmail table and sent by 'manage.py run_outbox'.
+OUTBOX_BATCH_SIZE = 50  # emails sent over each connection to the email server
+OUTBOX_MAX_ATTEMPTS = 5  # attempts before an email is marked as failed
+OUTBOX_RETRY_DELAY = 60  # seconds before the first retry, doubled after each failed attempt
+
+# number of product cards shown on each products page.
+PRODUCTS_PER_PAGE = 8
+
+# seconds the approximate product count shown on the products page is cached for.
+PRODUCTS_COUNT_CACHE_TIMEOUT = 60 * 5
+
+# seconds a rendered catalog page is cached for. Pages are expired as soon as a Product or Category
+# changes, this only limits how long unused pages take up space in the cache. 0 turns the page cache off,
+# benchmark_asgi does that so every request renders its page.
+CATALOG_PAGE_CACHE_TIMEOUT = int(os.environ.get('CATALOG_PAGE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# widths (in pixels) of the resized product image copies used in srcset. Product cards are up to
+# about 210px wide and cart images 170px, the larger widths cover high density screens.
+PRODUCT_IMAGE_WIDTHS = [180, 360, 540]
@@ -0,0 +1,38 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ['DEFERRED', 'IMMEDIATE', 'EXCLUSIVE']
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """Django's SQLite backend with two extra OPTIONS. They are named after the ones Django 5.1 adds, so after
+    upgrading the ENGINE can go back to django.db.backends.sqlite3 without changing the OPTIONS.
+    init_command: SQL statements separated by ; that are run on every new connection, i.e. the PRAGMAs.
+    transaction_mode: DEFERRED, IMMEDIATE or EXCLUSIVE, how transactions (atomic blocks) are started."""
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # these options are for the backend, they aren't sqlite3.connect() arguments.
+        kwargs.pop('init_command', None)
+        transaction_mode = kwargs.pop('transaction_mode', None)
+        if transaction_mode is not None and transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"settings.DATABASES transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        init_command = self.settings_dict['OPTIONS'].get('init_command', '')
+        for statement in init_command.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        """a plain BEGIN only takes the write lock at the first write. A transaction that reads first then fails
+        straight away with "database is locked" if another connection is writing, without waiting for the busy
+        timeout. BEGIN IMMEDIATE takes the write lock up front so it waits its turn instead."""
+        transaction_mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f'BEGIN {transaction_mode.upper()}')
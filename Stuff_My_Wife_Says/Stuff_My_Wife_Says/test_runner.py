@@ -0,0 +1,17 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """test runner giving the tests a local memory cache.
+    The site's file based cache is shared between runs, pages and versions left by one run would be served to the next."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_cache = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}})
+        self.test_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_cache.disable()
+        super().teardown_test_environment(**kwargs)
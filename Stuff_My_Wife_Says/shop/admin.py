@@ -1,13 +1,92 @@
-from django.contrib import admin
-from .models import Category, Product, ShoppingCartSession, ShoppingCartItem, Order, OrderItem
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from datetime import date, timedelta
+from .bulk import ORDER_STATUS_TRANSITIONS, new_price, reprice_products, transition_orders
+from .export import order_export_items, export_lines
+from .forms import RepriceForm
+from .pagination import CappedCountPaginator
+from .models import (Category, Product, ShoppingCartSession, ShoppingCartItem, Order, OrderItem, OutboxEmail, DailySales,
+                     ProductStock)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """change list settings for tables that grow without limit (carts, orders, emails).
+    Only a capped number of rows is counted and the second unfiltered COUNT(*) for 'x of y results' is skipped."""
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+
+
+def bulk_action_response(modeladmin, request, title, message, form=None, samples=()):
+    """intermediate page asking the admin to confirm a bulk action before it is applied.
+    The selection is posted back as it was sent (the selected ids, or select_across for every matching row) so the
+    whole table is never loaded. Posting back to the same url keeps the change list filters."""
+    opts = modeladmin.model._meta
+    context = {
+        **modeladmin.admin_site.each_context(request),
+        'opts': opts,
+        'title': title,
+        'message': message,
+        'form': form,
+        'samples': samples,
+        'action': request.POST['action'],
+        'select_across': request.POST.get('select_across', '0'),
+        'selected': request.POST.getlist(ACTION_CHECKBOX_NAME),
+        'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        'changelist_url': f"{request.path}?{request.GET.urlencode()}",
+    }
+    return TemplateResponse(request, 'admin/bulk_action_confirmation.html', context)
+
+
+def reprice_action(modeladmin, request, products, description):
+    """shared by the product and category reprice actions. Shows how many products will change and, once an
+    amount is entered, a few of them with their new price. The prices are then changed with a single UPDATE."""
+    form = RepriceForm(request.POST if 'mode' in request.POST else None)
+    if 'apply' in request.POST and form.is_valid():
+        changed = reprice_products(products, form.cleaned_data['mode'], form.cleaned_data['amount'])
+        modeladmin.message_user(request, f'Changed the price of {changed} products.', messages.SUCCESS)
+        return None
+
+    samples = ()
+    if form.is_bound and form.is_valid():
+        # the database works out the new prices exactly as the update will.
+        samples = (products.annotate(new_price=new_price(form.cleaned_data['mode'], form.cleaned_data['amount']))
+                   .order_by('product_name')[:10])
+    return bulk_action_response(modeladmin, request, 'Reprice products',
+                                f'{products.count()} products {description} will be repriced.', form, samples)
+
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['category_name', 'slug']
+    actions = ['reprice']
 
+    @admin.action(description='Reprice every product in the selected categories')
+    def reprice(self, request, queryset):
+        return reprice_action(self, request, Product.objects.filter(category__in=queryset), 'in these categories')
+
+
+class ProductStockInline(admin.TabularInline):
+    model = ProductStock
+    extra = 0
 
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ['category_name', 'product_name', 'price', 'image', 'slug']
 
+class ProductAdmin(LargeTableAdmin):
+    list_display = ['category_name', 'product_name', 'price', 'image', 'slug']
+    # load each product's category in the same query as the products.
+    list_select_related = ['category']
+    list_filter = ['category']
+    # leave the stock empty for products that aren't limited.
+    inlines = [ProductStockInline]
+    actions = ['reprice']
+
+    @admin.action(description='Reprice selected products')
+    def reprice(self, request, queryset):
+        return reprice_action(self, request, queryset, 'selected')
+
+    @admin.display(description='category name', ordering='category__category_name')
     def category_name(self, obj):
         """retrieve category_name from Category object for displaying in the Product model interface"""
         # obj parameter represents an instance of Product model.
@@ -16,29 +95,131 @@ class ProductAdmin(admin.ModelAdmin):
         return obj.category.category_name
 
 
-class ShoppingCartSessionAdmin(admin.ModelAdmin):
+class ShoppingCartSessionAdmin(LargeTableAdmin):
     list_display = ['cart_uuid', 'created_at', 'status', 'modified']
+    # uses the (status, modified) index.
+    list_filter = ['status']
 
 
-class ShoppingCartItemAdmin(admin.ModelAdmin):
+class ShoppingCartItemAdmin(LargeTableAdmin):
     list_display = ['cart_uuid', 'product', 'quantity', 'tshirt_size', 'created_at', 'modified_at']
+    # the product is shown with its category, load both with the items.
+    list_select_related = ['product__category']
 
     def cart_uuid(self, obj):
         """retrieve cart_uuid connected to product item"""
-        return obj.cart.cart_uuid
+        # the uuid is the items cart_id column, no need to load the cart.
+        return obj.cart_id
 
 
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['order_number', 'total_price', 'status', 'date_ordered']
-
-
-class OrderItemAdmin(admin.ModelAdmin):
-    # TODO: Need to add order number and product
-    list_display = ['order_number', 'price', 'quantity']
+    # newest first from the date_ordered index. Filtering by status uses the (status, date_ordered) index.
+    ordering = ['-date_ordered']
+    list_filter = ['status', 'date_ordered']
+    actions = ['export_csv', 'export_jsonl', 'mark_shipped', 'mark_delivered']
+
+    @admin.action(description='Mark selected pending orders as shipped')
+    def mark_shipped(self, request, queryset):
+        return self.transition_action(request, queryset, 'pending', 'shipped')
+
+    @admin.action(description='Mark selected shipped orders as delivered')
+    def mark_delivered(self, request, queryset):
+        return self.transition_action(request, queryset, 'shipped', 'delivered')
+
+    def transition_action(self, request, queryset, from_status, to_status):
+        """change the status of the selected orders in from_status with a single UPDATE, after showing how many
+        will change. Order.save() isn't run, the total price doesn't need working out again."""
+        assert (from_status, to_status) in ORDER_STATUS_TRANSITIONS
+        if 'apply' in request.POST:
+            changed = transition_orders(queryset, from_status, to_status)
+            self.message_user(request, f'Marked {changed} orders as {to_status}.', messages.SUCCESS)
+            return None
+
+        selected = queryset.count()
+        changing = queryset.filter(status=from_status).count()
+        return bulk_action_response(self, request, f'Mark orders as {to_status}',
+                                    f'{changing} of the {selected} selected orders are {from_status} and will be '
+                                    f'marked as {to_status}. The others are left as they are.')
+
+    @admin.action(description='Export selected orders as CSV')
+    def export_csv(self, request, queryset):
+        return self.export_response(queryset, 'csv', 'text/csv')
+
+    @admin.action(description='Export selected orders as JSON lines')
+    def export_jsonl(self, request, queryset):
+        return self.export_response(queryset, 'jsonl', 'application/x-ndjson')
+
+    def export_response(self, queryset, export_format, content_type):
+        """stream the export to the browser as it is read from the database, one line for each item ordered.
+        The selected orders are used as a subquery so selecting every order doesn't load them all first."""
+        items = order_export_items(orders=queryset.order_by().values('pk'))
+        response = StreamingHttpResponse(export_lines(items, export_format), content_type=content_type)
+        filename = f'orders-{timezone.localdate():%Y-%m-%d}.{export_format}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ['order_number', 'product', 'price', 'quantity', 'tshirt_size']
+    list_select_related = ['product__category']
 
     def order_number(self, obj):
         """retrieve order_number connected to order item"""
-        return obj.order.order_number
+        # the order number is the items order_id column, no need to load the order.
+        return obj.order_id
+
+
+class OutboxEmailAdmin(LargeTableAdmin):
+    list_display = ['subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    # uses the (status, next_attempt_at) index.
+    list_filter = ['status']
+
+
+class DailySalesAdmin(admin.ModelAdmin):
+    """sales dashboard in place of the usual change list. Every figure comes from the DailySales rollup
+    so the page stays fast however many orders there are."""
+
+    # number of days shown when no date range is chosen.
+    DEFAULT_DAYS = 30
+
+    def changelist_view(self, request, extra_context=None):
+        date_to = self.get_date(request, 'to') or timezone.localdate()
+        date_from = self.get_date(request, 'from') or date_to - timedelta(days=self.DEFAULT_DAYS - 1)
+        sales = DailySales.objects.filter(date__gte=date_from, date__lte=date_to)
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sales dashboard',
+            'date_from': date_from,
+            'date_to': date_to,
+            'totals': sales.aggregate(units=Sum('units'), revenue=Sum('revenue')),
+            'days': sales.values('date').annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-date'),
+            'categories': (sales.values('category__category_name').annotate(units=Sum('units'), revenue=Sum('revenue'))
+                           .order_by('-revenue')),
+            'products': (sales.values('product__product_name', 'category__category_name', 'tshirt_size')
+                         .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')[:20]),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/sales_dashboard.html', context)
+
+    def get_date(self, request, name):
+        """date from the dashboard's date range form, None if it is missing or not a valid date"""
+        try:
+            return date.fromisoformat(request.GET.get(name, ''))
+        except ValueError:
+            return None
+
+    # the rollup is only changed by checkout and the rebuild_sales_rollup command.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Category, CategoryAdmin)
@@ -47,3 +228,5 @@ admin.site.register(ShoppingCartSession, ShoppingCartSessionAdmin)
 admin.site.register(ShoppingCartItem, ShoppingCartItemAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
+admin.site.register(DailySales, DailySalesAdmin)
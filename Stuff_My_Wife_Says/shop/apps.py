@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        # connect signal receivers for cache invalidation
+        from . import signals
+        # warn about a cache that isn't shared between worker processes
+        from . import checks
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models import DecimalField, F, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+from .caching import invalidate_product_pages
+from .models import Product
+
+# ways the admin can change prices in bulk, used by the reprice form.
+REPRICE_MODES = [('percent', 'Change by percent'), ('amount', 'Change by amount'), ('set', 'Set price to')]
+
+# (from status, to status) for the order status changes the admin can make in bulk.
+ORDER_STATUS_TRANSITIONS = [('pending', 'shipped'), ('shipped', 'delivered')]
+
+
+def new_price(mode, amount):
+    """database expression for a product's price after repricing, rounded to cents and never below zero"""
+    if mode == 'percent':
+        price = F('price') * Value(1 + amount / 100)
+    elif mode == 'amount':
+        price = F('price') + Value(amount)
+    else:
+        price = Value(amount)
+    price_field = Product._meta.get_field('price')
+    return Greatest(Round(price, 2, output_field=price_field), Value(0, output_field=price_field),
+                    output_field=DecimalField(max_digits=price_field.max_digits,
+                                              decimal_places=price_field.decimal_places))
+
+
+def reprice_products(products, mode, amount):
+    """change the price of every product in the products queryset with a single UPDATE, returns the number changed.
+    update() skips Product.save() (and its image and slug handling) and the post_save signal, so modified is set
+    here and the cached pages of the products and their categories are expired in one go.
+    The slugs are read in the same transaction as the UPDATE, so a product added to a selected category in
+    between can't be repriced without its page being expired."""
+    with transaction.atomic():
+        slugs = list(products.order_by().values_list('slug', 'category__slug'))
+        changed = products.update(price=new_price(mode, amount), modified=timezone.now())
+        # inside the transaction so the versions are bumped again once the new prices are committed.
+        invalidate_product_pages(product_slugs={product for product, _ in slugs},
+                                 category_slugs={category for _, category in slugs})
+    return changed
+
+
+def transition_orders(orders, from_status, to_status):
+    """move the orders in from_status to to_status with a single UPDATE, returns the number changed.
+    Orders in any other status are left alone so e.g. delivered orders are never marked shipped again."""
+    return orders.filter(status=from_status).update(status=to_status)
@@ -0,0 +1,266 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag, urlencode
+from functools import wraps
+import datetime
+import hashlib
+import re
+import threading
+import uuid
+from .models import Category
+
+# Version keys live in Django's cache so every worker process sharing the cache backend sees a bump.
+# Each process keeps its own copy of the cached data and only reloads it when the shared version changes.
+NAVBAR_CATEGORIES_VERSION_KEY = 'navbar_categories_version'
+
+# the csrf token is different for every visitor, so it is swapped for a placeholder before a page is cached.
+CSRF_TOKEN_PATTERN = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+CSRF_TOKEN_PLACEHOLDER = b'__csrf_token_placeholder__'
+
+# process-local copy of the navbar categories as a (version, categories) tuple.
+_navbar_categories = (None, None)
+_navbar_lock = threading.Lock()
+
+
+def get_version(key):
+    """get the current version stored under key, creating one if the cache has no version yet"""
+    return get_versions([key])[0]
+
+
+def get_versions(keys):
+    """get the current versions stored under keys with a single cache lookup"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # add() only sets the key if another process hasn't beaten us to it.
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(keys):
+    """get_versions() for async views"""
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, uuid.uuid4().hex, timeout=None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(key):
+    """give key a new version so every process reloads the data it guards.
+    Bumped straight away and again once the transaction commits, so a process that reloads
+    before the commit can't keep the uncommitted (or rolled back) data."""
+    bump_versions([key])
+
+
+def bump_versions(keys):
+    """bump_version() for many keys with one cache call each time they are bumped"""
+    keys = list(keys)
+    if not keys:
+        return
+    cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+    transaction.on_commit(lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None))
+
+
+def get_navbar_categories():
+    """returns the list of categories for the navbar, only querying the database when the version has changed"""
+    global _navbar_categories
+    version = get_version(NAVBAR_CATEGORIES_VERSION_KEY)
+
+    cached_version, categories = _navbar_categories
+    if cached_version == version:
+        return categories
+
+    with _navbar_lock:
+        # another thread may have reloaded the categories while we waited for the lock.
+        cached_version, categories = _navbar_categories
+        if cached_version != version:
+            categories = list(Category.objects.all())
+            _navbar_categories = (version, categories)
+    return categories
+
+
+async def aget_navbar_categories():
+    """get_navbar_categories() for async views, the categories are reloaded with the async ORM"""
+    global _navbar_categories
+    version, = await aget_versions([NAVBAR_CATEGORIES_VERSION_KEY])
+
+    cached_version, categories = _navbar_categories
+    if cached_version != version:
+        # no lock needed, nothing else runs on the event loop while the categories are swapped in.
+        categories = [category async for category in Category.objects.all()]
+        _navbar_categories = (version, categories)
+    return categories
+
+
+def invalidate_navbar_categories():
+    """force every process to reload the navbar categories on their next request"""
+    bump_version(NAVBAR_CATEGORIES_VERSION_KEY)
+
+
+
+def category_page_version_key(category_slug):
+    """version key for the cached products pages of a category"""
+    return f'catalog_page_version:category:{category_slug}'
+
+
+def product_page_version_key(product_slug):
+    """version key for the cached product details page of a product"""
+    return f'catalog_page_version:product:{product_slug}'
+
+
+def invalidate_product_pages(product_slugs=(), category_slugs=()):
+    """force the cached catalog pages of the given products and categories to be re-rendered"""
+    bump_versions([product_page_version_key(product_slug) for product_slug in product_slugs]
+                  + [category_page_version_key(category_slug) for category_slug in category_slugs])
+
+
+def has_pending_messages(request):
+    """checking whether the page will show messages, those pages must not be cached"""
+    return len(get_messages(request)) > 0
+
+
+def catalog_page_digest(request, version_keys, bucket='', query_params=()):
+    """digest identifying a rendered catalog page, it changes whenever the page would render differently.
+    Made from the path, the query_params the view reads, the cart bucket and the versions of the navbar categories
+    and version_keys. Other query parameters (tracking tags and the like) don't change the page so they're left out."""
+    versions = get_versions([NAVBAR_CATEGORIES_VERSION_KEY] + list(version_keys))
+    query = urlencode([(param, value) for param in query_params for value in request.GET.getlist(param)])
+    page_key = '|'.join([request.path, query, bucket] + versions)
+    return hashlib.md5(page_key.encode()).hexdigest()
+
+
+def cache_catalog_page(version_keys=None, cart_bucket=None, query_params=()):
+    """view decorator that caches the rendered page for anonymous catalog traffic.
+    version_keys(**kwargs) returns the version keys of the products/categories shown on the page, every page also
+    depends on the navbar categories. Saving a Product or Category bumps its version, so stale pages are never served.
+    cart_bucket(request, **kwargs) splits the cache for anything on the page that depends on the visitors cart.
+    query_params are the query parameters the view reads, requests with any other parameter aren't cached so
+    random query strings can't fill the cache with copies of the same page."""
+    def page_cache_key(request, kwargs):
+        """cache key for the page, None if the page mustn't be cached"""
+        # only cache plain page loads. Pending messages are shown once so that page can't be shared.
+        if not settings.CATALOG_PAGE_CACHE_TIMEOUT:
+            return None
+        if request.method not in ('GET', 'HEAD') or has_pending_messages(request):
+            return None
+        if not set(request.GET).issubset(query_params):
+            return None
+        keys = version_keys(**kwargs) if version_keys is not None else []
+        bucket = cart_bucket(request, **kwargs) if cart_bucket is not None else ''
+        return 'catalog_page:' + catalog_page_digest(request, keys, bucket, query_params)
+
+    def cached_response(request, cached_page):
+        content, content_type = cached_page
+        return HttpResponse(insert_csrf_token(request, content), content_type=content_type)
+
+    def cacheable(response):
+        return response.status_code == 200 and not response.streaming
+
+    def page_to_cache(response):
+        return remove_csrf_token(response.content), response['Content-Type']
+
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _async_wrapped_view(request, *args, **kwargs):
+                # the messages and the cart bucket may need the users session, which is only loaded synchronously.
+                cache_key = await sync_to_async(page_cache_key)(request, kwargs)
+                if cache_key is None:
+                    return await view_func(request, *args, **kwargs)
+
+                cached_page = await cache.aget(cache_key)
+                if cached_page is not None:
+                    return cached_response(request, cached_page)
+
+                # async views return rendered responses.
+                response = await view_func(request, *args, **kwargs)
+                if cacheable(response):
+                    await cache.aset(cache_key, page_to_cache(response), settings.CATALOG_PAGE_CACHE_TIMEOUT)
+                return response
+            return _async_wrapped_view
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            cache_key = page_cache_key(request, kwargs)
+            if cache_key is None:
+                return view_func(request, *args, **kwargs)
+
+            cached_page = cache.get(cache_key)
+            if cached_page is not None:
+                return cached_response(request, cached_page)
+
+            response = view_func(request, *args, **kwargs)
+            if cacheable(response):
+                def store_page(response):
+                    cache.set(cache_key, page_to_cache(response), settings.CATALOG_PAGE_CACHE_TIMEOUT)
+
+                # TemplateResponse from class based views isn't rendered until after the view returns.
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.add_post_render_callback(store_page)
+                else:
+                    store_page(response)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def async_condition(etag_func=None, last_modified_func=None):
+    """django.views.decorators.http.condition() for async views, Django 4.2's only wraps sync views.
+    etag_func and last_modified_func may use the users session or the database so they are run in a thread."""
+    def validators(request, *args, **kwargs):
+        etag = etag_func(request, *args, **kwargs) if etag_func else None
+        last_modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+        if last_modified and not timezone.is_aware(last_modified):
+            last_modified = timezone.make_aware(last_modified, datetime.timezone.utc)
+        return (quote_etag(etag) if etag is not None else None,
+                int(last_modified.timestamp()) if last_modified else None)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view_func(request, *args, **kwargs)
+
+            if request.method in ('GET', 'HEAD'):
+                if last_modified and not response.has_header('Last-Modified'):
+                    response.headers['Last-Modified'] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+            return response
+        return _wrapped_view
+    return decorator
+
+
+def async_vary_on_cookie(view_func):
+    """django.views.decorators.vary.vary_on_cookie() for async views"""
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        response = await view_func(request, *args, **kwargs)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+    return _wrapped_view
+
+
+def remove_csrf_token(content):
+    """replace the visitors csrf token in a rendered page with a placeholder"""
+    return CSRF_TOKEN_PATTERN.sub(rb'\1' + CSRF_TOKEN_PLACEHOLDER + rb'\2', content)
+
+
+def insert_csrf_token(request, content):
+    """put the current visitors csrf token back into a cached page"""
+    if CSRF_TOKEN_PLACEHOLDER not in content:
+        return content
+    # get_token() also makes sure the csrf cookie is sent with the response.
+    return content.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request).encode())
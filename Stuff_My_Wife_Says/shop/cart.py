@@ -0,0 +1,385 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Sum, Window
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .models import Product, ShoppingCartSession, ShoppingCartItem, cart_item_line_total, to_cents
+import uuid
+
+
+class Cart:
+    """The customers shopping cart for the current request, attached to the request as request.cart by CartMiddleware.
+    Nothing is loaded until the cart is used, then the ShoppingCartSession and all of its items (with their
+    product and category) are loaded once and shared by every view, template and helper in the request."""
+
+    def __init__(self, request, cart_uuid=None):
+        self.request = request
+        # checkout passes the cart_uuid from the url, otherwise use the cart stored in the users session.
+        self._cart_uuid = cart_uuid
+
+    @cached_property
+    def cart_uuid(self):
+        """uuid of the cart, None if the customer hasn't added anything to a cart yet"""
+        if self._cart_uuid is not None:
+            return self._cart_uuid
+        return self.request.session.get('cart_uuid')
+
+    @cached_property
+    def session(self):
+        """the ShoppingCartSession with its items loaded, None if it doesn't exist"""
+        if not self.cart_uuid:
+            return None
+        try:
+            items = list(self.items_query())
+            # an empty cart has no items to bring the cart along with them.
+            cart = items[0].cart if items else ShoppingCartSession.objects.filter(cart_uuid=self.cart_uuid).first()
+        except ValidationError:
+            # the uuid in the session isn't valid
+            return None
+
+        if cart is not None:
+            cart.loaded_items = items
+        return cart
+
+    def items_query(self):
+        """the items, their cart, product and category, line totals and the cart total all come from one query."""
+        return (ShoppingCartItem.objects.filter(cart_id=self.cart_uuid)
+                .select_related('cart', 'product__category')
+                .annotate(line_total=cart_item_line_total())
+                .annotate(cart_total=Window(Sum('line_total')))
+                .order_by('pk'))
+
+    async def aload(self):
+        """load the cart with the async ORM, for async views. Afterwards the cart can be used (and the templates
+        rendered) without querying the database, until it is changed."""
+        if 'session' in self.__dict__:
+            return self.session
+        # the cart uuid is kept in the users session, which is only loaded synchronously.
+        cart_uuid = await sync_to_async(lambda: self.cart_uuid)()
+        cart = None
+        if cart_uuid:
+            try:
+                items = [item async for item in self.items_query()]
+                cart = items[0].cart if items else await ShoppingCartSession.objects.filter(cart_uuid=cart_uuid).afirst()
+            except ValidationError:
+                pass
+            if cart is not None:
+                cart.loaded_items = items
+        self.session = cart
+        if self.checked_out():
+            # the customer never saw purchase_confirmed, which forgets the cart, start them a new one.
+            await sync_to_async(self.create)()
+        return self.session
+
+    @property
+    def items(self):
+        """list of ShoppingCartItem in the cart"""
+        if self.session is None:
+            return []
+        return self.session.loaded_items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def exists(self):
+        return self.session is not None
+
+    def checked_out(self):
+        """whether the customers own cart has already been turned into an order. The cart stays in their session
+        until purchase_confirmed is shown, which it isn't if they close the tab while the order is being placed."""
+        return self._cart_uuid is None and self.session is not None and self.session.status == 'closed'
+
+    def contains(self, product):
+        """checking whether the cart already has the product in it."""
+        return any(item.product_id == product.pk for item in self.items)
+
+    def contains_slug(self, product_slug):
+        """checking whether the cart already has the product with the given slug in it."""
+        return any(item.product.slug == product_slug for item in self.items)
+
+    def order_total_price(self):
+        """total price of every item in the cart, calculated by the database when the items were loaded"""
+        items = self.items
+        if not items:
+            return 0
+        # items added during this request weren't loaded with the cart total.
+        if any(not hasattr(item, 'cart_total') for item in items):
+            return sum(item.calculate_cart_item_price() for item in items)
+        return to_cents(items[0].cart_total)
+
+    def get_item(self, pk):
+        """item in this cart with the given primary key, None if the item isn't in this cart"""
+        for item in self.items:
+            if str(item.pk) == str(pk):
+                return item
+        return None
+
+    def add(self, product, quantity, tshirt_size=''):
+        """add a product to the cart, creating the cart if the customer doesn't have one yet.
+        Adding a product and size that is already in the cart increases its quantity.
+        Returns the id of the cart item."""
+        if self.session is None or self.checked_out():
+            # items added to a checked out cart would be lost, the next checkout only finds the old order.
+            self.create()
+        elif self.session.status == 'abandoned':
+            # the customer came back before reap_carts purged their cart.
+            ShoppingCartSession.objects.filter(pk=self.session.pk).update(status='open', modified=timezone.now())
+
+        item_id, quantity = ShoppingCartItem.add_quantity(self.session, product, quantity, tshirt_size)
+
+        # the loaded items and totals are out of date, load them again if the cart is used after this.
+        del self.session
+        return item_id
+
+    def remove(self, pk):
+        """remove the item with the given primary key from the cart. Returns False if the item isn't in this cart"""
+        if not self.cart_uuid:
+            return False
+        # only items in the customers own cart can be removed.
+        deleted, _ = ShoppingCartItem.objects.filter(pk=pk, cart_id=self.cart_uuid).delete()
+        self.__dict__.pop('session', None)
+        return deleted > 0
+
+    def save_quantities(self, items):
+        """save the new quantity of items from this cart with a single query"""
+        for item in items:
+            # bulk_update() doesn't apply auto_now.
+            item.modified_at = timezone.now()
+        ShoppingCartItem.objects.bulk_update(items, ['quantity', 'modified_at'])
+
+    async def asave_quantities(self, items):
+        """save_quantities() for async views"""
+        for item in items:
+            item.modified_at = timezone.now()
+        await ShoppingCartItem.objects.abulk_update(items, ['quantity', 'modified_at'])
+
+    def save_to_database(self):
+        """the ShoppingCartSession for the cart, used by checkout to record the order. Database carts are saved already."""
+        return self.session
+
+    def undo_save_to_database(self):
+        """called when the checkout transaction that called save_to_database() is rolled back.
+        Database carts were saved before checkout so there is nothing to undo."""
+
+    def clear(self):
+        """forget the customers cart once their order has been placed"""
+        if 'cart_uuid' in self.request.session:
+            del self.request.session['cart_uuid']
+
+    def update_response(self, response):
+        """called by CartMiddleware with the response. Database carts are stored in the users session so there is nothing to do."""
+        return response
+
+    def create(self):
+        """create a new ShoppingCartSession and store its uuid under 'cart_uuid' in the users session"""
+        cart_uuid = uuid.uuid4()
+        self.request.session['cart_uuid'] = str(cart_uuid)
+
+        cart = ShoppingCartSession(cart_uuid=cart_uuid)
+        cart.save()
+        cart.loaded_items = []
+
+        self.cart_uuid = str(cart_uuid)
+        self.session = cart
+        return cart
+
+
+class CookieCart(Cart):
+    """Shopping cart kept in a signed, compressed cookie instead of the database, used when CART_STORAGE = 'cookie'.
+    Most carts are never checked out, keeping them in a cookie means browsing and adding to the cart doesn't write
+    to the database (or the users session) at all. The cart is written to ShoppingCartSession/ShoppingCartItem at
+    checkout, or once it has more than CART_COOKIE_MAX_ITEMS items, after which the cookie only holds its uuid.
+    Items are unsaved ShoppingCartItem objects so views and templates work the same with either cart."""
+
+    # salt keeps cart cookies from being valid signatures anywhere else on the site.
+    cookie_salt = 'shop.cart.cookie'
+
+    def __init__(self, request):
+        super().__init__(request)
+        # set when the cookie needs to be sent again with the response.
+        self.changed = False
+
+    @cached_property
+    def data(self):
+        """contents of the cart cookie, None if the customer has no cart or the cookie isn't valid.
+        Either {'id': cart uuid, 'next': next item id, 'items': [[item id, product id, tshirt size, quantity], ...]}
+        or {'id': cart uuid, 'database': True} once the cart has been written to the database."""
+        cookie = self.request.COOKIES.get(settings.CART_COOKIE_NAME)
+        if not cookie:
+            return None
+        try:
+            data = signing.loads(cookie, salt=self.cookie_salt, max_age=settings.SESSION_COOKIE_AGE)
+            uuid.UUID(data['id'])
+            if not data.get('database'):
+                data['items'] = [[int(item_id), int(product_id), str(size), int(quantity)]
+                                 for item_id, product_id, size, quantity in data['items']]
+                data['next'] = int(data['next'])
+            return data
+        except (signing.BadSignature, KeyError, ValueError, TypeError, AttributeError):
+            return None
+
+    @property
+    def in_database(self):
+        """whether the cart has been moved from the cookie to the database"""
+        return bool(self.data and self.data.get('database'))
+
+    @cached_property
+    def cart_uuid(self):
+        if self.data is None:
+            return None
+        return self.data['id']
+
+    @cached_property
+    def session(self):
+        """an unsaved ShoppingCartSession with the items from the cookie, None if the customer has no cart"""
+        if self.data is None:
+            return None
+        if self.in_database:
+            return super().session
+
+        # the only query is for the products in the cart, with their category.
+        products = Product.objects.select_related('category').in_bulk(self.product_ids())
+        return self.cookie_session(products)
+
+    async def aload(self):
+        if 'session' in self.__dict__:
+            return self.session
+        if self.data is None or self.in_database:
+            # no cart yet, or the cart has been moved to the database.
+            return await super().aload()
+        self.session = self.cookie_session(
+            await Product.objects.select_related('category').ain_bulk(self.product_ids()))
+        return self.session
+
+    def product_ids(self):
+        return [entry[1] for entry in self.data['items']]
+
+    def cookie_session(self, products):
+        """unsaved ShoppingCartSession holding the items in the cookie, products is a dict of the products by id"""
+        entries = self.data['items']
+        cart = ShoppingCartSession(cart_uuid=self.cart_uuid)
+        # products deleted since they were added to the cart are left out.
+        cart.loaded_items = [ShoppingCartItem(pk=item_id, cart=cart, product=products[product_id],
+                                              tshirt_size=tshirt_size, quantity=quantity)
+                             for item_id, product_id, tshirt_size, quantity in entries if product_id in products]
+        return cart
+
+    def add(self, product, quantity, tshirt_size=''):
+        if self.session is None or self.checked_out():
+            self.create()
+        if self.in_database:
+            return super().add(product, quantity, tshirt_size)
+
+        entries = self.data['items']
+        for entry in entries:
+            if entry[1] == product.pk and entry[2] == tshirt_size:
+                entry[3] += quantity
+                item_id = entry[0]
+                break
+        else:
+            # larger carts go in the database so the cookie stays well under the browsers size limit.
+            if len(entries) >= settings.CART_COOKIE_MAX_ITEMS:
+                self.save_to_database()
+                return super().add(product, quantity, tshirt_size)
+            item_id = self.data['next']
+            self.data['next'] += 1
+            entries.append([item_id, product.pk, tshirt_size, quantity])
+
+        self.changed = True
+        self.__dict__.pop('session', None)
+        return item_id
+
+    def remove(self, pk):
+        if self.in_database:
+            return super().remove(pk)
+        if self.data is None:
+            return False
+
+        entries = [entry for entry in self.data['items'] if str(entry[0]) != str(pk)]
+        if len(entries) == len(self.data['items']):
+            return False
+        self.data['items'] = entries
+        self.changed = True
+        self.__dict__.pop('session', None)
+        return True
+
+    def save_quantities(self, items):
+        if self.in_database:
+            return super().save_quantities(items)
+
+        quantities = {item.pk: item.quantity for item in items}
+        for entry in self.data['items']:
+            if entry[0] in quantities:
+                entry[3] = quantities[entry[0]]
+        self.changed = True
+
+    async def asave_quantities(self, items):
+        if self.in_database:
+            return await super().asave_quantities(items)
+        # only the cookie changes.
+        self.save_quantities(items)
+
+    def save_to_database(self):
+        """write the cart and its items to the database, only the cart uuid is kept in the cookie after this"""
+        if self.in_database:
+            return super().save_to_database()
+
+        with transaction.atomic():
+            cart, created = ShoppingCartSession.objects.get_or_create(cart_uuid=self.cart_uuid)
+            if created:
+                items = [ShoppingCartItem(cart=cart, product=item.product, quantity=item.quantity,
+                                          tshirt_size=item.tshirt_size)
+                         for item in self.items]
+                ShoppingCartItem.objects.bulk_create(items)
+                cart.loaded_items = items
+
+        # kept in case checkout is rolled back after the cart was written, see undo_save_to_database().
+        self.cookie_data = self.data if created else None
+        self.data = {'id': self.cart_uuid, 'database': True}
+        self.changed = True
+        if created:
+            self.session = cart
+        else:
+            # saved by an earlier request i.e. the customer submitted checkout twice before the cookie was updated.
+            self.__dict__.pop('session', None)
+        return self.session
+
+    def undo_save_to_database(self):
+        if getattr(self, 'cookie_data', None) is None:
+            return
+        self.data = self.cookie_data
+        self.cookie_data = None
+        self.__dict__.pop('session', None)
+
+    def clear(self):
+        self.data = None
+        self.changed = True
+        self.__dict__.pop('session', None)
+        self.__dict__.pop('cart_uuid', None)
+
+    def update_response(self, response):
+        """send the cart cookie with the response if the cart has changed"""
+        if not self.changed:
+            return response
+        if self.data is None:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+        else:
+            response.set_cookie(settings.CART_COOKIE_NAME,
+                                signing.dumps(self.data, salt=self.cookie_salt, compress=True),
+                                max_age=settings.SESSION_COOKIE_AGE, secure=settings.SESSION_COOKIE_SECURE,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def create(self):
+        """start a new cart in the cookie, nothing is written to the database"""
+        self.data = {'id': str(uuid.uuid4()), 'next': 1, 'items': []}
+        self.changed = True
+        self.cart_uuid = self.data['id']
+        self.__dict__.pop('session', None)
+        return self.session
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+import os
+
+
+@register()
+def cache_shared_by_workers(app_configs, **kwargs):
+    """the cache versions only reach every worker through a shared cache, a local memory cache is per process"""
+    workers = os.environ.get('WEB_CONCURRENCY', '1')
+    backend = settings.CACHES['default']['BACKEND']
+    if backend.endswith('LocMemCache') and workers.isdigit() and int(workers) > 1:
+        return [Warning(
+            f'{workers} workers (WEB_CONCURRENCY) are sharing a local memory cache.',
+            hint='Changes made through one worker won\'t reach the others, set CACHE_BACKEND to a shared cache '
+                 'i.e. FileBasedCache, Redis or Memcached.',
+            id='shop.W001')]
+    return []
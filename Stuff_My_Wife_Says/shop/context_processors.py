@@ -1,7 +1,21 @@
-from .models import Category
+from .caching import get_navbar_categories, aget_navbar_categories
 
 # Context processors are functions that add data to the context dictionary of every template.
 def navbar_context(request):
-    """context for dynamic dropdown menu for Products link"""
-    categories = Category.objects.all()
-    return {'categories': categories}
\ No newline at end of file
+    """context for dynamic dropdown menu for Products link.
+    Categories rarely change so they are cached in process and reloaded when a Category is saved or deleted.
+    Async views can't query the database from a template, they load the categories first with load_navbar()."""
+    categories = getattr(request, 'navbar_categories', None)
+    if categories is None:
+        categories = get_navbar_categories()
+    return {'categories': categories}
+
+
+async def load_navbar(request):
+    """load the navbar categories for navbar_context() before an async view renders its template"""
+    request.navbar_categories = await aget_navbar_categories()
+
+
+def cart_context(request):
+    """context for the customers shopping cart. The cart is only loaded if a template uses it."""
+    return {'cart': getattr(request, 'cart', None)}
@@ -0,0 +1,86 @@
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from .models import OrderItem
+import csv
+import json
+
+
+# (column name, OrderItem lookup) for each column in an order export, one line per item ordered.
+EXPORT_COLUMNS = [
+    ('order_number', 'order__order_number'),
+    ('date_ordered', 'order__date_ordered'),
+    ('status', 'order__status'),
+    ('total_price', 'order__total_price'),
+    ('first_name', 'order__first_name'),
+    ('last_name', 'order__last_name'),
+    ('email', 'order__email'),
+    ('phone', 'order__phone'),
+    ('address', 'order__address'),
+    ('suburb', 'order__suburb'),
+    ('state', 'order__state'),
+    ('post_code', 'order__post_code'),
+    ('product_name', 'product__product_name'),
+    ('product_slug', 'product__slug'),
+    ('category', 'product__category__category_name'),
+    ('tshirt_size', 'tshirt_size'),
+    ('quantity', 'quantity'),
+    ('price', 'price'),
+]
+
+# rows fetched from the database at a time while exporting.
+EXPORT_CHUNK_SIZE = 2000
+
+
+def order_export_items(orders=None, date_from=None, date_to=None, status=None):
+    """OrderItem rows for an export as tuples of EXPORT_COLUMNS, from a single query joining the order, product
+    and category. orders limits the export to an Order queryset i.e. the orders selected in the admin.
+    date_from and date_to are dates (both included) of when the order was placed."""
+    items = OrderItem.objects.all()
+    if orders is not None:
+        items = items.filter(order__in=orders)
+    if date_from is not None:
+        items = items.filter(order__date_ordered__gte=start_of_day(date_from))
+    if date_to is not None:
+        items = items.filter(order__date_ordered__lt=start_of_day(date_to + timedelta(days=1)))
+    if status is not None:
+        items = items.filter(order__status=status)
+
+    # values_list() skips building model instances, iterator() streams the rows from the database cursor
+    # instead of loading the whole export into memory.
+    return (items.order_by('order__date_ordered', 'order_id', 'pk')
+            .values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def export_value(value):
+    """convert a value from the database to text for the export"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class Echo:
+    """file like object that returns what is written to it, lets csv.writer produce one line at a time"""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(items, export_format='csv'):
+    """generator of lines of text (each ending in a newline) for exporting the order items in CSV or JSONL format"""
+    columns = [column for column, _ in EXPORT_COLUMNS]
+    if export_format == 'jsonl':
+        for item in items:
+            yield json.dumps(dict(zip(columns, map(export_value, item)))) + '\n'
+        return
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for item in items:
+        yield writer.writerow(map(export_value, item))
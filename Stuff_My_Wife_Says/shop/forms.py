@@ -1,4 +1,5 @@
 from django import forms
+from .bulk import REPRICE_MODES
 from .models import Order
 
 
@@ -38,6 +39,19 @@ class CustomerDetailsForm(forms.ModelForm):
         model = Order
         fields = ['first_name', 'last_name', 'email', 'phone', 'address', 'suburb', 'state', 'post_code']
 
+    def clean_email(self):
+        # emails are saved in lowercase so the order status page can find them with an exact, indexed match.
+        return self.cleaned_data['email'].lower()
+
+
+class OrderLookupForm(forms.Form):
+    """order number and email the customer ordered with, for looking up the status of their order"""
+    order_number = forms.UUIDField(label='Order Number')
+    email = forms.EmailField(label='Email', max_length=254)
+
+    def clean_email(self):
+        return self.cleaned_data['email'].lower()
+
 
 class ContactForm(forms.Form):
     """form for customers to send questions and feedback"""
@@ -45,4 +59,19 @@ class ContactForm(forms.Form):
     email = forms.EmailField(label='Email', max_length=255)
     subject = forms.CharField(label='Subject', max_length=255)
     order_number = forms.CharField(label='Order Number', max_length=36, required=False)
-    message = forms.CharField(label='Message', widget=forms.Textarea)
\ No newline at end of file
+    message = forms.CharField(label='Message', widget=forms.Textarea)
+
+
+class RepriceForm(forms.Form):
+    """admin form for changing the price of many products at once.
+    amount is a percent (e.g. -10 for 10% off), a dollar amount to add or the new price, depending on mode"""
+    mode = forms.ChoiceField(choices=REPRICE_MODES)
+    amount = forms.DecimalField(max_digits=8, decimal_places=2)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('mode') == 'percent' and cleaned_data.get('amount', 0) <= -100:
+            self.add_error('amount', 'Prices can be lowered by less than 100%.')
+        elif cleaned_data.get('mode') == 'set' and cleaned_data.get('amount', 0) < 0:
+            self.add_error('amount', 'Prices can not be negative.')
+        return cleaned_data
@@ -0,0 +1,73 @@
+from PIL import Image, ImageOps, UnidentifiedImageError
+import os
+import posixpath
+
+# every product image gets a resized copy in its own format plus a WebP copy at each width.
+DERIVATIVE_DIRECTORY = 'derivatives'
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+def derivative_name(name, width, extension=None):
+    """storage name of a resized copy of an image,
+    i.e. product_images/<hash>.jpg at 180px as webp is product_images/derivatives/<hash>-180w.webp"""
+    directory, filename = posixpath.split(name)
+    stem, original_extension = posixpath.splitext(filename)
+    extension = extension or original_extension.lstrip('.').lower()
+    return posixpath.join(directory, DERIVATIVE_DIRECTORY, f'{stem}-{width}w.{extension}')
+
+
+def generate_derivatives(source_path, widths, force=False):
+    """create the resized and WebP copies of the image at source_path next to it in the derivatives directory.
+    Only works with file system paths (no Django storage or settings) so it can run in a worker process.
+    Images are never scaled up, widths wider than the original are skipped and the original is used instead.
+    Returns (number of files created, width of the original, list of the widths that have both copies), the
+    widths are None and [] if the image can't be read. Pages build their srcset from these."""
+    directory, filename = os.path.split(source_path)
+    stem, extension = os.path.splitext(filename)
+    extension = extension.lstrip('.').lower()
+    derivative_directory = os.path.join(directory, DERIVATIVE_DIRECTORY)
+    created = 0
+    image_width = None
+    derivative_widths = []
+
+    try:
+        with Image.open(source_path) as image:
+            # apply camera rotation before resizing as the derivatives don't keep the EXIF data.
+            image = ImageOps.exif_transpose(image)
+            image_width = image.width
+            os.makedirs(derivative_directory, exist_ok=True)
+
+            for width in widths:
+                if width >= image.width:
+                    continue
+                resized = None
+                for derivative_extension in (extension, 'webp'):
+                    path = os.path.join(derivative_directory, f'{stem}-{width}w.{derivative_extension}')
+                    if not force and os.path.exists(path):
+                        continue
+                    if resized is None:
+                        height = round(image.height * width / image.width)
+                        resized = image.resize((width, height), Image.LANCZOS)
+                    save_image(resized, path, derivative_extension)
+                    created += 1
+                derivative_widths.append(width)
+    except (OSError, UnidentifiedImageError, ValueError):
+        # not an image Pillow can read, pages fall back to the original file.
+        pass
+    return created, image_width, derivative_widths
+
+
+def save_image(image, path, extension):
+    """save image to a temporary file and move it into place, so a page never links to a half written file"""
+    if extension in ('jpg', 'jpeg') and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    options = {'quality': WEBP_QUALITY} if extension == 'webp' else {}
+    if extension in ('jpg', 'jpeg'):
+        options = {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    image_format = Image.registered_extensions().get(f'.{extension}')
+    image.save(temporary_path, format=image_format, **options)
+    os.replace(temporary_path, path)
@@ -0,0 +1,193 @@
+from django.conf import settings
+from django.core import signing
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from importlib import import_module
+from shop.cart import CookieCart
+from shop.models import Category, Product, ShoppingCartSession, ShoppingCartItem
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import time
+
+# a single process of each server, WSGI under gunicorn with a thread for each request being handled and ASGI
+# under uvicorn. {port} and {threads} are filled in when the server is started.
+SERVERS = [
+    ('wsgi', ['gunicorn', 'Stuff_My_Wife_Says.wsgi:application', '--bind', '127.0.0.1:{port}',
+              '--worker-class', 'gthread', '--workers', '1', '--threads', '{threads}', '--log-level', 'warning']),
+    ('asgi', ['uvicorn', 'Stuff_My_Wife_Says.asgi:application', '--port', '{port}',
+              '--log-level', 'warning', '--no-access-log']),
+]
+
+
+class Command(BaseCommand):
+    help = '''Benchmark the catalog and cart pages served through WSGI (gunicorn) and ASGI (uvicorn, async views).
+    Each server is started in turn and --connections keep-alive connections request the pages as fast as they can.
+    Every connection has its own session and a cart of --cart-items products, and the catalog page cache is off
+    unless --page-cache is given, so the pages are rendered from the database on every request.
+    Needs gunicorn and uvicorn installed and uses the database in settings, import products first to have pages
+    to load. The benchmark carts and sessions are deleted afterwards.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=50, help='number of concurrent connections')
+        parser.add_argument('--threads', type=int, default=8, help='number of request threads for the WSGI server')
+        parser.add_argument('--seconds', type=float, default=10, help='how long each server is benchmarked for')
+        parser.add_argument('--cart-items', type=int, default=5, help='number of products in each connections cart')
+        parser.add_argument('--page-cache', action='store_true',
+                            help='keep the catalog page cache on, the pages are then mostly served from the cache')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='page to request, can be given more than once. Defaults to the first category '
+                                 'and product pages and the shopping cart')
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1 or options['seconds'] <= 0:
+            raise CommandError('--connections must be at least 1 and --seconds more than 0')
+        for module in ['gunicorn', 'uvicorn']:
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'the benchmark needs {module}, pip install {module}')
+
+        paths = options['paths'] or self.default_paths()
+        env = dict(os.environ)
+        if not options['page_cache']:
+            env['CATALOG_PAGE_CACHE_TIMEOUT'] = '0'
+        self.stdout.write(f"{options['connections']} connections with {options['cart_items']} items in their carts "
+                          f"requesting {', '.join(paths)}, page cache {'on' if options['page_cache'] else 'off'}")
+
+        carts, sessions, cookies = self.create_carts(options['connections'], options['cart_items'])
+        try:
+            for name, server_args in SERVERS:
+                port = free_port()
+                server = subprocess.Popen([sys.executable, '-m'] + [arg.format(port=port, threads=options['threads'])
+                                                                    for arg in server_args], env=env)
+                try:
+                    wait_for_server(port)
+                    results = asyncio.run(run_load(port, paths, cookies, options['seconds']))
+                finally:
+                    server.terminate()
+                    server.wait()
+                self.report(name, results, options['seconds'])
+        finally:
+            ShoppingCartSession.objects.filter(pk__in=carts).delete()
+            for session in sessions:
+                session.delete()
+
+    def create_carts(self, connections, cart_items):
+        """a session with a cart of cart_items products for each connection, returns the cart uuids, the sessions
+        and the Cookie header each connection sends"""
+        products = list(Product.objects.order_by('pk')[:cart_items])
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        carts = ShoppingCartSession.objects.bulk_create([ShoppingCartSession() for _ in range(connections)])
+        ShoppingCartItem.objects.bulk_create([ShoppingCartItem(cart=cart, product=product, quantity=1)
+                                              for cart in carts for product in products])
+
+        sessions = []
+        cookies = []
+        for cart in carts:
+            session = session_store()
+            session['cart_uuid'] = str(cart.cart_uuid)
+            session.create()
+            sessions.append(session)
+            cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+            if settings.CART_STORAGE == 'cookie':
+                # a cookie cart that has been moved to the database, so it is loaded the same way.
+                cart_cookie = signing.dumps({'id': str(cart.cart_uuid), 'database': True},
+                                            salt=CookieCart.cookie_salt, compress=True)
+                cookie += f'; {settings.CART_COOKIE_NAME}={cart_cookie}'
+            cookies.append(cookie)
+        return [cart.cart_uuid for cart in carts], sessions, cookies
+
+    def default_paths(self):
+        category = Category.objects.order_by('pk').first()
+        product = Product.objects.order_by('pk').first()
+        if category is None or product is None:
+            raise CommandError('there are no products to request, run import_products or use --path')
+        return [reverse('products', args=[category.slug]), reverse('product_details', args=[product.slug]),
+                reverse('shopping_cart')]
+
+    def report(self, name, results, seconds):
+        latencies = sorted(latency for result in results for latency in result['latencies'])
+        errors = sum(result['errors'] for result in results)
+        if not latencies:
+            self.stdout.write(f'{name}: no successful requests, {errors} errors')
+            return
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        self.stdout.write(f'{name}: {len(latencies) / seconds:8.1f} requests/s, p50 {p50:7.1f}ms, '
+                          f'p99 {p99:7.1f}ms, {errors} errors')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f'the server on port {port} did not start')
+
+
+async def run_load(port, paths, cookies, seconds):
+    """one connection for each of cookies"""
+    end = time.monotonic() + seconds
+    return await asyncio.gather(*[request_pages(port, paths, end, cookie) for cookie in cookies])
+
+
+async def request_pages(port, paths, end, cookie):
+    """request the paths in turn over one keep-alive connection until end, reconnecting after errors.
+    cookie is sent with every request so the pages load the connections own session and cart."""
+    latencies = []
+    errors = 0
+    request_number = 0
+    while time.monotonic() < end:
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            errors += 1
+            await asyncio.sleep(0.1)
+            continue
+        try:
+            while time.monotonic() < end:
+                path = paths[request_number % len(paths)]
+                request_number += 1
+                began = time.monotonic()
+                writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n'.encode())
+                status = await read_response(reader)
+                if status == 200:
+                    latencies.append(time.monotonic() - began)
+                else:
+                    errors += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            errors += 1
+        finally:
+            writer.close()
+    return {'latencies': latencies, 'errors': errors}
+
+
+async def read_response(reader):
+    """read one HTTP/1.1 response, returns its status code"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('the server closed the connection')
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while size := int((await reader.readline()).strip(), 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    return status
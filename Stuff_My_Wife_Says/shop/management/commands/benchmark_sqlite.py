@@ -0,0 +1,132 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+from shop.models import Category, Product, ShoppingCartSession, ShoppingCartItem
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+# the OPTIONS of Django's stock SQLite setup (rollback journal, plain BEGIN) to compare the settings against.
+STOCK_OPTIONS = {'init_command': 'PRAGMA journal_mode=delete', 'transaction_mode': None}
+
+# carts and products in the benchmark database.
+CARTS = 200
+PRODUCTS = 50
+
+
+class Command(BaseCommand):
+    help = '''Benchmark concurrent writes to SQLite with Django's stock setup against the SQLITE_* settings.
+    Several processes add items to carts (read the cart then upsert an item, in a transaction, like the add to cart
+    view) while others read the catalog. Runs on a throwaway copy of the database, the real one isn't touched.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='number of processes adding to carts')
+        parser.add_argument('--readers', type=int, default=2, help='number of processes reading products')
+        parser.add_argument('--seconds', type=float, default=5, help='how long each setup is run for')
+
+    def handle(self, *args, **options):
+        if options['writers'] < 1 or options['seconds'] <= 0:
+            raise CommandError('--writers must be at least 1 and --seconds more than 0')
+        if connection.vendor != 'sqlite':
+            raise CommandError('the benchmark is for SQLite databases')
+
+        # the connection's settings are settings.DATABASES['default'] itself, which use_database() changes.
+        database, db_options = connection.settings_dict['NAME'], dict(connection.settings_dict['OPTIONS'])
+        setups = [('stock', STOCK_OPTIONS), ('settings', db_options)]
+        directory = tempfile.mkdtemp()
+        try:
+            template = os.path.join(directory, 'template.sqlite3')
+            self.create_database(template)
+            for name, setup_options in setups:
+                path = os.path.join(directory, f'{name}.sqlite3')
+                shutil.copy(template, path)
+                results = self.run(path, setup_options, options)
+                self.report(name, results, options['seconds'])
+        finally:
+            self.use_database(database, db_options)
+            shutil.rmtree(directory)
+
+    def use_database(self, path, db_options):
+        """point this process's connection at the benchmark database"""
+        connection.close()
+        connection.settings_dict['NAME'] = path
+        connection.settings_dict['OPTIONS'] = db_options
+
+    def create_database(self, path):
+        self.use_database(path, STOCK_OPTIONS)
+        call_command('migrate', verbosity=0)
+        category = Category.objects.create(category_name='Mugs')
+        Product.objects.bulk_create([Product(category=category, product_name=f'Mug {n}', price=20, slug=f'mug-{n}')
+                                     for n in range(PRODUCTS)])
+        ShoppingCartSession.objects.bulk_create([ShoppingCartSession() for _ in range(CARTS)])
+        connection.close()
+
+    def run(self, path, db_options, options):
+        """start the writer and reader processes, returns each process's results"""
+        # fork so the workers start with Django already set up, the connection is closed so none share it.
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        start = context.Event()
+        workers = ([context.Process(target=write_carts, args=(path, db_options, start, options['seconds'], results))
+                    for _ in range(options['writers'])]
+                   + [context.Process(target=read_products, args=(path, db_options, start, options['seconds'], results))
+                      for _ in range(options['readers'])])
+        for worker in workers:
+            worker.start()
+        start.set()
+        finished = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        return finished
+
+    def report(self, name, results, seconds):
+        writes = [result for result in results if result['kind'] == 'write']
+        reads = [result for result in results if result['kind'] == 'read']
+        latencies = sorted(latency for result in writes for latency in result['latencies'])
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+        self.stdout.write(
+            f"{name:>8}: {sum(r['done'] for r in writes) / seconds:8.1f} writes/s, "
+            f"{sum(r['locked'] for r in writes):5d} 'database is locked' errors, p95 write {p95:7.1f}ms, "
+            f"{sum(r['done'] for r in reads) / seconds:8.1f} reads/s")
+
+
+def worker_setup(path, db_options, start):
+    Command().use_database(path, db_options)
+    random.seed(os.getpid())
+    carts = list(ShoppingCartSession.objects.values_list('pk', flat=True))
+    products = list(Product.objects.all())
+    start.wait()
+    return carts, products
+
+
+def write_carts(path, db_options, start, seconds, results):
+    carts, products = worker_setup(path, db_options, start)
+    done = locked = 0
+    latencies = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        began = time.monotonic()
+        try:
+            with transaction.atomic():
+                cart = ShoppingCartSession.objects.get(pk=random.choice(carts))
+                ShoppingCartItem.add_quantity(cart, random.choice(products), 1)
+            done += 1
+            latencies.append(time.monotonic() - began)
+        except OperationalError:
+            locked += 1
+    connection.close()
+    results.put({'kind': 'write', 'done': done, 'locked': locked, 'latencies': latencies})
+
+
+def read_products(path, db_options, start, seconds, results):
+    _, products = worker_setup(path, db_options, start)
+    done = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        list(Product.objects.filter(pk__in=[product.pk for product in random.sample(products, 10)]))
+        done += 1
+    connection.close()
+    results.put({'kind': 'read', 'done': done, 'locked': 0, 'latencies': []})
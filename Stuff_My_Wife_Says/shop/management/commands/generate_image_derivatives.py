@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.images import generate_derivatives
+from shop.models import Product
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = '''Create the resized and WebP copies of product images uploaded before they were generated automatically.
+    Images are resized in a pool of worker processes, and the widths found are recorded on the products so
+    pages can list the copies in their srcset.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+        parser.add_argument('--force', action='store_true', help='re-create copies that already exist')
+
+    def handle(self, *args, **options):
+        storage = Product._meta.get_field('image').storage
+        names = Product.objects.exclude(image='').values_list('image', flat=True).distinct().iterator()
+        names = [name for name in names if storage.exists(name)]
+        paths = [storage.path(name) for name in names]
+        widths = settings.PRODUCT_IMAGE_WIDTHS
+
+        start = time.monotonic()
+        created = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            results = executor.map(generate_derivatives, paths, [widths] * len(paths), [options['force']] * len(paths))
+            for name, (count, width, derivative_widths) in zip(names, results):
+                created += count
+                Product.objects.filter(image=name).update(image_width=width,
+                                                          image_derivative_widths=derivative_widths)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} image copies for {len(paths)} images in {elapsed:.2f}s'))
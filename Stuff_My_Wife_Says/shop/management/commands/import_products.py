@@ -0,0 +1,215 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, IntegrityError
+from django.template.defaultfilters import slugify
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from shop.caching import invalidate_product_pages
+from shop.images import generate_derivatives
+from shop.models import Category, Product, DEFAULT_PRODUCT_IMAGE
+from shop.storage import content_hash, product_image_storage
+import csv
+import json
+import os
+import sys
+import time
+
+
+class Command(BaseCommand):
+    help = '''Bulk import products from a CSV or JSONL file.
+    Each row needs product_name, category (name or slug) and price, with optional image (a filename in --images)
+    and slug columns. Rows are streamed and inserted with bulk_create so files of any size can be imported.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file to import, '-' reads from stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='file format, guessed from the file extension by default')
+        parser.add_argument('--images', help='directory containing the image files named in the image column')
+        parser.add_argument('--batch-size', type=int, default=1000, help='number of products inserted per query')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or self.guess_format(options['path'])
+        self.images_dir = options['images']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        # categories are a tiny table so look them all up once by both name and slug.
+        self.categories = {}
+        for category in Category.objects.all():
+            self.categories[category.category_name.lower()] = category
+            self.categories[category.slug] = category
+
+        # next incremental number for each base slug used so far in this import.
+        self.slug_numbers = {}
+        # (image name, image hash, image width, derivative widths) for each image file stored so far in this import.
+        self.images = {}
+        self.imported = 0
+        self.skipped = 0
+        self.category_slugs = set()
+
+        start = time.monotonic()
+        with self.open_input(options['path']) as input_file:
+            rows = self.read_rows(input_file, file_format)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch)
+
+                elapsed = time.monotonic() - start
+                self.stdout.write(f'{self.imported} products imported, {self.skipped} skipped '
+                                  f'({self.rows_per_second(elapsed):.0f} rows/sec)')
+
+        # bulk_create skips the post_save signals, so expire the cached pages of every category imported into.
+        invalidate_product_pages(category_slugs=self.category_slugs)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {self.imported} products in {elapsed:.2f}s ({self.rows_per_second(elapsed):.0f} rows/sec), '
+            f'skipped {self.skipped} rows'))
+
+    def rows_per_second(self, elapsed):
+        return (self.imported + self.skipped) / elapsed if elapsed else 0
+
+    def guess_format(self, path):
+        """guess the file format from the file extension"""
+        if path.endswith('.jsonl') or path.endswith('.ndjson'):
+            return 'jsonl'
+        if path.endswith('.csv'):
+            return 'csv'
+        raise CommandError(f'Cannot tell the format of {path}, use --format')
+
+    def open_input(self, path):
+        if path == '-':
+            return open(sys.stdin.fileno(), encoding='utf-8', newline='', closefd=False)
+        try:
+            return open(path, encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
+
+    def read_rows(self, input_file, file_format):
+        """yields (line number, row dictionary) one row at a time so the whole file is never held in memory"""
+        if file_format == 'csv':
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(input_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, e
+
+    def import_batch(self, batch):
+        """build products for a batch of rows and insert them with a single query"""
+        products = []
+        for line_number, row in batch:
+            try:
+                products.append((line_number, self.build_product(row)))
+            except (ValueError, KeyError, TypeError, AttributeError, InvalidOperation) as e:
+                self.skip(line_number, repr(e))
+        products = self.skip_taken_slugs(products)
+
+        self.allocate_slugs(products)
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+        except IntegrityError:
+            # another admin user or importer took one of the slugs, allocate this batch again.
+            for product in products:
+                if product.generated_slug:
+                    self.slug_numbers.pop(product.get_base_slug(), None)
+                    product.slug = ''
+            self.allocate_slugs(products)
+            try:
+                with transaction.atomic():
+                    Product.objects.bulk_create(products)
+            except IntegrityError as e:
+                raise CommandError(f'Batch ending on line {batch[-1][0]} could not be inserted: {e}')
+
+        self.imported += len(products)
+        self.category_slugs.update(product.category.slug for product in products)
+
+    def skip(self, line_number, reason):
+        self.skipped += 1
+        self.stderr.write(f'line {line_number}: skipped, {reason}')
+
+    def skip_taken_slugs(self, products):
+        """drop the (line number, product) pairs whose slug column is already taken by a saved product or an
+        earlier row of the batch, returns the products to insert. Looked up in chunks like the generated slugs."""
+        slugs = [product.slug for _, product in products if product.slug]
+        taken = set()
+        for start in range(0, len(slugs), Product.SLUG_LOOKUP_CHUNK_SIZE):
+            chunk = slugs[start:start + Product.SLUG_LOOKUP_CHUNK_SIZE]
+            taken.update(Product.objects.filter(slug__in=chunk).values_list('slug', flat=True))
+
+        kept = []
+        for line_number, product in products:
+            if product.slug:
+                if product.slug in taken:
+                    self.skip(line_number, f'slug {product.slug!r} is already taken')
+                    continue
+                taken.add(product.slug)
+            kept.append(product)
+        return kept
+
+    def build_product(self, row):
+        """create an unsaved Product from an imported row"""
+        if isinstance(row, Exception):
+            raise ValueError(str(row))
+
+        product_name = row['product_name'].strip()
+        if not product_name:
+            raise ValueError('product_name is empty')
+
+        category_key = str(row['category']).strip()
+        category = self.categories.get(category_key.lower()) or self.categories.get(slugify(category_key))
+        if category is None:
+            raise ValueError(f'unknown category {category_key!r}')
+
+        product = Product(category=category, product_name=product_name, price=Decimal(str(row['price'])),
+                          slug=(row.get('slug') or '').strip())
+        product.generated_slug = not product.slug
+        product.image, product.image_hash, product.image_width, product.image_derivative_widths = self.get_image(
+            row.get('image'))
+        return product
+
+    def get_image(self, filename):
+        """store an image from the images directory, returns its (name, hash, width, derivative widths).
+        Storage is content addressed so an image used by many rows is only written once."""
+        if not filename or not self.images_dir:
+            return DEFAULT_PRODUCT_IMAGE, '', None, []
+
+        if filename not in self.images:
+            path = os.path.join(self.images_dir, filename)
+            if not os.path.isfile(path):
+                raise ValueError(f'image {filename!r} not found in {self.images_dir}')
+            with open(path, 'rb') as f:
+                image_file = File(f, name=filename)
+                image_hash = content_hash(image_file)
+                name = product_image_storage.save(f'product_images/{filename}', image_file)
+            _, width, derivative_widths = generate_derivatives(product_image_storage.path(name),
+                                                               settings.PRODUCT_IMAGE_WIDTHS)
+            self.images[filename] = (name, image_hash, width, derivative_widths)
+        return self.images[filename]
+
+    def allocate_slugs(self, products):
+        """give every product without a slug a unique one.
+        The next free numbers of the new base slugs are looked up together by Product.next_slug_numbers().
+        Slugs from the slug column of the batch are skipped over."""
+        explicit_slugs = {product.slug for product in products if product.slug}
+        # slugifying the names is most of the work here, so each base slug is only worked out once.
+        unallocated = [(product, product.get_base_slug()) for product in products if not product.slug]
+        new_bases = {base_slug for _, base_slug in unallocated} - set(self.slug_numbers)
+        self.slug_numbers.update(Product.next_slug_numbers(new_bases))
+
+        for product, base_slug in unallocated:
+            number = self.slug_numbers[base_slug]
+            product.slug = f'{base_slug}-{number}' if number else base_slug
+            while product.slug in explicit_slugs:
+                number += 1
+                product.slug = f'{base_slug}-{number}'
+            self.slug_numbers[base_slug] = number + 1
@@ -0,0 +1,81 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from shop.models import ShoppingCartSession, ShoppingCartItem
+import time
+
+
+class Command(BaseCommand):
+    help = '''Mark open carts that haven't changed in CART_ABANDONED_AFTER_DAYS as abandoned, and delete abandoned
+    carts (with their items) after another CART_PURGE_AFTER_DAYS. Meant to be run regularly i.e. daily from cron.
+    Carts are handled in small batches, each in its own short transaction, so the site can keep writing to the
+    database (SQLite only allows one writer at a time) while the command runs.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--abandoned-after', type=int, default=settings.CART_ABANDONED_AFTER_DAYS,
+                            help='days without changes before an open cart is marked as abandoned')
+        parser.add_argument('--purge-after', type=int, default=settings.CART_PURGE_AFTER_DAYS,
+                            help='days an abandoned cart is kept before it is deleted')
+        parser.add_argument('--batch-size', type=int, default=500, help='number of carts changed per transaction')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='seconds to wait between batches, giving other writers a turn at the database')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.pause = options['pause']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        now = timezone.now()
+        start = time.monotonic()
+        abandoned = self.mark_abandoned(now - timedelta(days=options['abandoned_after']))
+        carts_deleted, items_deleted = self.purge_abandoned(now - timedelta(days=options['purge_after']))
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Marked {abandoned} carts as abandoned, deleted {carts_deleted} abandoned carts '
+            f'and {items_deleted} cart items in {elapsed:.2f}s'))
+
+    def batches(self, queryset):
+        """yields lists of up to batch_size cart uuids from the queryset until it is empty.
+        Each batch is read before the write transaction starts so the write lock is only held for the update."""
+        while True:
+            batch = list(queryset.values_list('pk', flat=True)[:self.batch_size])
+            if not batch:
+                return
+            yield batch
+            if len(batch) < self.batch_size:
+                return
+            time.sleep(self.pause)
+
+    def mark_abandoned(self, idle_since):
+        """set the status of open carts with no changes since idle_since to 'abandoned'.
+        Adding to the cart or changing a quantity only updates the item, so carts with a recently changed item are skipped."""
+        recent_items = ShoppingCartItem.objects.filter(cart=OuterRef('pk'), modified_at__gte=idle_since)
+        idle_carts = (ShoppingCartSession.objects.filter(status='open', modified__lt=idle_since)
+                      .exclude(Exists(recent_items)))
+
+        marked = 0
+        for batch in self.batches(idle_carts):
+            with transaction.atomic():
+                # modified is set so abandoned carts are kept for --purge-after days from now.
+                marked += ShoppingCartSession.objects.filter(pk__in=batch, status='open').update(
+                    status='abandoned', modified=timezone.now())
+            self.stdout.write(f'{marked} carts marked as abandoned')
+        return marked
+
+    def purge_abandoned(self, abandoned_before):
+        """delete carts that were marked as abandoned before abandoned_before, along with their items"""
+        old_carts = ShoppingCartSession.objects.filter(status='abandoned', modified__lt=abandoned_before)
+
+        carts_deleted = items_deleted = 0
+        for batch in self.batches(old_carts):
+            with transaction.atomic():
+                _, deleted = ShoppingCartSession.objects.filter(pk__in=batch, status='abandoned').delete()
+            carts_deleted += deleted.get(ShoppingCartSession._meta.label, 0)
+            items_deleted += deleted.get(ShoppingCartItem._meta.label, 0)
+            self.stdout.write(f'{carts_deleted} abandoned carts and {items_deleted} cart items deleted')
+        return carts_deleted, items_deleted
@@ -0,0 +1,66 @@
+from datetime import date, datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Min, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from shop.models import DailySales, OrderItem
+import time
+
+
+class Command(BaseCommand):
+    help = '''Rebuild the DailySales rollup used by the sales dashboard from the order history.
+    Checkout keeps the rollup up to date, run this to fill in orders placed before the rollup existed or after
+    changing orders by hand. Days are rebuilt in chunks, each in its own transaction.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help='first day to rebuild (YYYY-MM-DD), defaults to the first order')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='last day to rebuild (YYYY-MM-DD), defaults to the latest order')
+        parser.add_argument('--chunk-days', type=int, default=31, help='number of days rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be at least 1')
+
+        first_order, last_order = OrderItem.objects.aggregate(
+            first=Min('order__date_ordered'), last=Max('order__date_ordered')).values()
+        if first_order is None:
+            self.stdout.write('No orders to roll up')
+            return
+        date_from = options['date_from'] or timezone.localdate(first_order)
+        date_to = options['date_to'] or timezone.localdate(last_order)
+
+        start = time.monotonic()
+        rows = 0
+        chunk_start = date_from
+        while chunk_start <= date_to:
+            chunk_end = min(chunk_start + timedelta(days=options['chunk_days'] - 1), date_to)
+            rows += self.rebuild_days(chunk_start, chunk_end)
+            self.stdout.write(f'Rebuilt {chunk_start} to {chunk_end}, {rows} rows so far')
+            chunk_start = chunk_end + timedelta(days=1)
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt daily sales from {date_from} to {date_to} ({rows} rows) in {elapsed:.2f}s'))
+
+    def rebuild_days(self, first_day, last_day):
+        """replace the rollup rows for the days from first_day to last_day with totals from the order items"""
+        start = timezone.make_aware(datetime.combine(first_day, datetime.min.time()))
+        end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), datetime.min.time()))
+        # the database adds up the order items for each day, product and size.
+        totals = (OrderItem.objects.filter(order__date_ordered__gte=start, order__date_ordered__lt=end)
+                  .annotate(date=TruncDate('order__date_ordered'))
+                  .values('date', 'product_id', 'product__category_id', 'tshirt_size')
+                  .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+                  .order_by())
+
+        with transaction.atomic():
+            DailySales.objects.filter(date__gte=first_day, date__lte=last_day).delete()
+            created = DailySales.objects.bulk_create(
+                [DailySales(date=row['date'], product_id=row['product_id'], category_id=row['product__category_id'],
+                            tshirt_size=row['tshirt_size'], units=row['units'], revenue=row['revenue'])
+                 for row in totals.iterator()],
+                batch_size=1000)
+        return len(created)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from shop.outbox import send_pending_emails
+import time
+
+
+class Command(BaseCommand):
+    help = '''Send the emails queued in the outbox by the contact form and checkout.
+    Runs until stopped, sending due emails in batches over one connection to the email server and checking
+    for new ones every --interval seconds. Failed emails are retried with a growing delay.
+    Run a single worker, or use --once from cron to send everything that is due and exit.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+                            help='number of emails sent over each connection to the email server')
+        parser.add_argument('--interval', type=float, default=5, help='seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='send the emails that are due then exit')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        total_sent = total_failed = 0
+        start = time.monotonic()
+        try:
+            while True:
+                sent, failed = send_pending_emails(options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f'{sent} emails sent, {failed} failed')
+
+                # a full batch probably means more emails are waiting, otherwise wait for new ones.
+                # failed emails aren't due again until their retry delay has passed.
+                if sent + failed < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {total_sent} emails in {elapsed:.2f}s, {total_failed} failed attempts'))
@@ -0,0 +1,36 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .cart import Cart, CookieCart
+
+
+class CartMiddleware:
+    """attach the customers shopping cart to every request as request.cart.
+    The cart is lazy so requests that never use it don't touch the database.
+    CART_STORAGE = 'cookie' keeps anonymous carts in a cookie, which is sent back with the response when it changes.
+    Works under both WSGI and ASGI, so async views aren't pushed back through a thread by this middleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        cart = self.attach_cart(request)
+        response = self.get_response(request)
+        return cart.update_response(response)
+
+    async def __acall__(self, request):
+        # creating the cart and sending the cookie back don't touch the database.
+        cart = self.attach_cart(request)
+        response = await self.get_response(request)
+        return cart.update_response(response)
+
+    def attach_cart(self, request):
+        cart = CookieCart(request) if settings.CART_STORAGE == 'cookie' else Cart(request)
+        request.cart = cart
+        return cart
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.2 on 2026-10-18 08:29
+
+from django.db import migrations, models
+import shop.storage
+
+
+def backfill_image_hash(apps, schema_editor):
+    """record the content hash of images uploaded before image_hash existed"""
+    Product = apps.get_model('shop', 'Product')
+    storage = shop.storage.product_image_storage
+    image_hashes = {}
+
+    for product in Product.objects.exclude(image='').only('pk', 'image').iterator():
+        name = product.image.name
+        if name not in image_hashes:
+            if not storage.exists(name):
+                continue
+            with storage.open(name) as image_file:
+                image_hashes[name] = shop.storage.content_hash(image_file)
+        Product.objects.filter(pk=product.pk).update(image_hash=image_hashes[name])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_product_category_price_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(default='product_images/Image_not_available.png', storage=shop.storage.ContentHashStorage(), upload_to='product_images/'),
+        ),
+        migrations.RunPython(backfill_image_hash, migrations.RunPython.noop),
+    ]
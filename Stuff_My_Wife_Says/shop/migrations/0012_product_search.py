@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# Full text search index over product and category names. SQLite only, other databases fall back to
+# a plain LIKE search in shop.search. Triggers keep the index in sync with every write, including
+# bulk_create and queryset.update() which skip Django's signals.
+CREATE_SEARCH_INDEX = [
+    '''CREATE VIRTUAL TABLE shop_product_search USING fts5(
+        product_name, category_name, category_id UNINDEXED, prefix='2 3', tokenize='unicode61'
+    )''',
+    '''CREATE TRIGGER shop_product_search_insert AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category_id)
+        SELECT new.id, new.product_name, c.category_name, c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER shop_product_search_update AFTER UPDATE OF product_name, category_id ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category_id)
+        SELECT new.id, new.product_name, c.category_name, c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER shop_product_search_delete AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER shop_category_search_update AFTER UPDATE OF category_name ON shop_category BEGIN
+        UPDATE shop_product_search SET category_name = new.category_name WHERE category_id = new.id;
+    END''',
+    # index the products that already exist.
+    '''INSERT INTO shop_product_search(rowid, product_name, category_name, category_id)
+        SELECT p.id, p.product_name, c.category_name, c.id FROM shop_product p JOIN shop_category c ON c.id = p.category_id''',
+]
+
+DROP_SEARCH_INDEX = [
+    'DROP TRIGGER IF EXISTS shop_category_search_update',
+    'DROP TRIGGER IF EXISTS shop_product_search_delete',
+    'DROP TRIGGER IF EXISTS shop_product_search_update',
+    'DROP TRIGGER IF EXISTS shop_product_search_insert',
+    'DROP TABLE IF EXISTS shop_product_search',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SEARCH_INDEX:
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in DROP_SEARCH_INDEX:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_product_image_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.2 on 2026-10-18 08:42
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """merge items added to the same cart more than once into a single item, adding up their quantities"""
+    ShoppingCartItem = apps.get_model('shop', 'ShoppingCartItem')
+    duplicates = (ShoppingCartItem.objects.values('cart', 'product', 'tshirt_size')
+                  .annotate(items=Count('id'), first_id=Min('id'), total_quantity=Sum('quantity'))
+                  .filter(items__gt=1))
+
+    for duplicate in duplicates.iterator():
+        ShoppingCartItem.objects.filter(pk=duplicate['first_id']).update(quantity=duplicate['total_quantity'])
+        (ShoppingCartItem.objects.filter(cart=duplicate['cart'], product=duplicate['product'],
+                                         tshirt_size=duplicate['tshirt_size'])
+         .exclude(pk=duplicate['first_id']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_product_modified'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product', 'tshirt_size'), name='unique_cart_product_size'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_unique_cart_product_size'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shoppingcartsession',
+            index=models.Index(fields=['status', 'modified'], name='cart_status_modified_idx'),
+        ),
+    ]
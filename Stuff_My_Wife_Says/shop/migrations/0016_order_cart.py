@@ -0,0 +1,19 @@
+# Generated by Django 4.2.2 on 2026-10-18 08:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_cart_status_modified_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='cart',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order', to='shop.shoppingcartsession'),
+        ),
+    ]
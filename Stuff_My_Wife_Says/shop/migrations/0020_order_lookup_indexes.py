@@ -0,0 +1,29 @@
+# Generated by Django 4.2.2 on 2026-10-18 08:54
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def lowercase_order_emails(apps, schema_editor):
+    """order emails are looked up with an exact match, save the existing ones in lowercase like new orders"""
+    Order = apps.get_model('shop', 'Order')
+    Order.objects.exclude(email=Lower('email')).update(email=Lower('email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_productstock'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_order_emails, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['email', 'date_ordered'], name='order_email_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'date_ordered'], name='order_status_date_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from django.db import migrations
+
+# Rebuilds the full text search index from 0012 so category filters run inside the MATCH:
+# the category column holds a 'category<id>' token, where the old UNINDEXED category_id column
+# had to be checked row by row. Prefixes up to 6 characters are indexed so search as you type
+# stays fast for longer words, the index is about 3 times larger.
+CREATE_SEARCH_INDEX = [
+    'DROP TRIGGER IF EXISTS shop_category_search_update',
+    'DROP TRIGGER IF EXISTS shop_product_search_delete',
+    'DROP TRIGGER IF EXISTS shop_product_search_update',
+    'DROP TRIGGER IF EXISTS shop_product_search_insert',
+    'DROP TABLE IF EXISTS shop_product_search',
+    '''CREATE VIRTUAL TABLE shop_product_search USING fts5(
+        product_name, category_name, category, prefix='1 2 3 4 5 6', tokenize='unicode61'
+    )''',
+    '''CREATE TRIGGER shop_product_search_insert AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category)
+        SELECT new.id, new.product_name, c.category_name, 'category' || c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER shop_product_search_update AFTER UPDATE OF product_name, category_id ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category)
+        SELECT new.id, new.product_name, c.category_name, 'category' || c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER shop_product_search_delete AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER shop_category_search_update AFTER UPDATE OF category_name ON shop_category BEGIN
+        UPDATE shop_product_search SET category_name = new.category_name
+        WHERE shop_product_search MATCH '{category} : category' || new.id;
+    END''',
+    # index the products that already exist.
+    '''INSERT INTO shop_product_search(rowid, product_name, category_name, category)
+        SELECT p.id, p.product_name, c.category_name, 'category' || c.id FROM shop_product p JOIN shop_category c ON c.id = p.category_id''',
+]
+
+# back to the index created in 0012.
+RESTORE_SEARCH_INDEX = [
+    'DROP TRIGGER IF EXISTS shop_category_search_update',
+    'DROP TRIGGER IF EXISTS shop_product_search_delete',
+    'DROP TRIGGER IF EXISTS shop_product_search_update',
+    'DROP TRIGGER IF EXISTS shop_product_search_insert',
+    'DROP TABLE IF EXISTS shop_product_search',
+    '''CREATE VIRTUAL TABLE shop_product_search USING fts5(
+        product_name, category_name, category_id UNINDEXED, prefix='2 3', tokenize='unicode61'
+    )''',
+    '''CREATE TRIGGER shop_product_search_insert AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category_id)
+        SELECT new.id, new.product_name, c.category_name, c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER shop_product_search_update AFTER UPDATE OF product_name, category_id ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category_id)
+        SELECT new.id, new.product_name, c.category_name, c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER shop_product_search_delete AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER shop_category_search_update AFTER UPDATE OF category_name ON shop_category BEGIN
+        UPDATE shop_product_search SET category_name = new.category_name WHERE category_id = new.id;
+    END''',
+    '''INSERT INTO shop_product_search(rowid, product_name, category_name, category_id)
+        SELECT p.id, p.product_name, c.category_name, c.id FROM shop_product p JOIN shop_category c ON c.id = p.category_id''',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in CREATE_SEARCH_INDEX:
+            schema_editor.execute(sql)
+
+
+def restore_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in RESTORE_SEARCH_INDEX:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_product_image_widths'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, restore_search_index),
+    ]
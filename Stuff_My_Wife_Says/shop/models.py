@@ -1,11 +1,18 @@
-from django.db import models
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import F, Sum, ExpressionWrapper
 from django.template.defaultfilters import slugify
-import os
-from django.conf import settings
-from django.core.files import File
+from django.utils import timezone
 import uuid
+from decimal import Decimal
 from phonenumber_field.modelfields import PhoneNumberField
 import re
+from .storage import content_hash, product_image_storage
+from .images import generate_derivatives
+from django.conf import settings
+
+# image used for products that don't have their own image.
+DEFAULT_PRODUCT_IMAGE = 'product_images/Image_not_available.png'
+
 
 class Category(models.Model):
     """Category model stores information on the categories of products that are sold"""
@@ -32,14 +39,33 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     product_name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=8, decimal_places=2)
-    image = models.ImageField(upload_to='product_images/', default='product_images/Image_not_available.png')
+    image = models.ImageField(upload_to='product_images/', default=DEFAULT_PRODUCT_IMAGE, storage=product_image_storage)
+    # sha256 of the image content, used to find products that already have the same image.
+    image_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    # width of the image and the widths of its resized copies, recorded when the copies are made so pages can
+    # build the srcset without checking which files exist.
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_derivative_widths = models.JSONField(default=list, blank=True, editable=False)
     slug = models.SlugField(unique=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    # number of times save() allocates a new slug after losing a race for the same slug.
+    SLUG_ALLOCATION_ATTEMPTS = 5
+    # base slugs looked up per query by next_slug_numbers(), each adds a range to the WHERE clause.
+    SLUG_LOOKUP_CHUNK_SIZE = 250
+
+    class Meta:
+        indexes = [
+            # products page lists a category ordered by (price, id), lets cursor pagination seek straight to a page.
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         """Auto-populate slug field and set image field if no image.
         Allow multiple products to have the same image file."""
 
         # auto-populate slug field if it doesn't exist
+        slug_generated = not self.slug
         self.auto_populate_slug()
 
         # sets the image to the default image when no image is selected during model creation.
@@ -51,27 +77,85 @@ class Product(models.Model):
         # rather then duplicate images with different file names.
         self.reuse_existing_image()
 
-        super().save(*args, **kwargs)
+        # a new image file will be stored, make its resized copies once it is saved.
+        image_uploaded = not self.image._committed
+
+        if slug_generated:
+            self.save_with_unique_slug(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+        if image_uploaded:
+            _, self.image_width, self.image_derivative_widths = generate_derivatives(
+                self.image.path, settings.PRODUCT_IMAGE_WIDTHS)
+            Product.objects.filter(pk=self.pk).update(image_width=self.image_width,
+                                                      image_derivative_widths=self.image_derivative_widths)
+
+    def save_with_unique_slug(self, *args, **kwargs):
+        """save a product whose slug was auto-populated.
+        Another admin user or importer can take the same slug between allocating it and saving.
+        The unique constraint on slug catches that, so allocate the next free slug and try again."""
+        for attempt in range(self.SLUG_ALLOCATION_ATTEMPTS):
+            try:
+                # savepoint so a failed insert doesn't break any surrounding transaction.
+                with transaction.atomic(using=kwargs.get('using')):
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if attempt == self.SLUG_ALLOCATION_ATTEMPTS - 1 or not Product.objects.filter(slug=self.slug).exists():
+                    raise
+                self.slug = self.next_free_slug(self.get_base_slug())
     
     def auto_populate_slug(self):
         """auto-populate slug field if it doesn't exist"""
         if not self.slug:
-            # slugify product name
-            base_slug = self.custom_slugify(self.product_name)
-
-            category_slug = self.custom_slugify(self.category.category_name)
+            self.slug = self.next_free_slug(self.get_base_slug())
+
+    def get_base_slug(self):
+        """slugified product name followed by the slugified category name"""
+        # slugify product name
+        base_slug = self.custom_slugify(self.product_name)
+
+        category_slug = self.custom_slugify(self.category.category_name)
+
+        # add category name to slug field
+        return f'{base_slug}-{category_slug}'
+
+    @staticmethod
+    def next_free_slug(base_slug):
+        """returns base_slug if it is free, otherwise base_slug with the next incremental number on the end.
+        Uses a single query no matter how many products already share the base slug."""
+        number = Product.next_slug_numbers([base_slug])[base_slug]
+        return f'{base_slug}-{number}' if number else base_slug
+
+    @staticmethod
+    def next_slug_numbers(base_slugs):
+        """number to put on the end of the next slug for each of base_slugs, 0 means the base slug itself is free.
+        Once any 'base_slug-<number>' exists the numbers carry on from the highest one, even if the base slug is
+        free again, so numbers of deleted products are never reused.
+        Base slugs are looked up SLUG_LOOKUP_CHUNK_SIZE at a time, one query each, so the query never grows past
+        SQLite's limits on expression depth and query parameters however many base slugs are passed."""
+        base_slugs = list(dict.fromkeys(base_slugs))
+        numbers = dict.fromkeys(base_slugs, 0)
+        for start in range(0, len(base_slugs), Product.SLUG_LOOKUP_CHUNK_SIZE):
+            chunk = base_slugs[start:start + Product.SLUG_LOOKUP_CHUNK_SIZE]
+            # taken slugs sort between 'base_slug' and 'base_slug.' ('.' comes after '-'), so each is a range scan
+            # of the slug index. Only the 'base_slug' and 'base_slug-<number>' slugs in the ranges count.
+            # Written as SQL because building the same filter with Q objects took longer than running it.
+            table = connection.ops.quote_name(Product._meta.db_table)
+            in_range = ' OR '.join(['(slug >= %s AND slug < %s)'] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT slug FROM {table} WHERE {in_range}',
+                               [bound for base_slug in chunk for bound in (base_slug, f'{base_slug}.')])
+                slugs = [slug for slug, in cursor.fetchall()]
+            for slug in slugs:
+                if slug in numbers:
+                    numbers[slug] = max(numbers[slug], 1)
+                base_slug, _, number = slug.rpartition('-')
+                if base_slug in numbers and number.isdigit():
+                    numbers[base_slug] = max(numbers[base_slug], int(number) + 1)
+        return numbers
 
-            # add category name to slug field
-            unique_slug = f'{base_slug}-{category_slug}'
-            num = 1
-
-            # if slug already exists then add incremental number to the end
-            while Product.objects.filter(slug=unique_slug).exists():
-                unique_slug = f'{base_slug}-{category_slug}-{num}'
-                num += 1
-            
-            self.slug = unique_slug
-    
     def custom_slugify(self, name):
         """remove invalid characters from name before slugify"""
         cleaned_name = re.sub(r'[\'!#]', '', name)   # replaces occurences of ', '!', and '#' with empty string
@@ -79,38 +163,55 @@ class Product(models.Model):
     
     def set_default_image(self):
         """sets the image to the default image when no image is selected during model creation.
-        Avoids multiple copies of the default image with different names."""
+        Points at the existing default image file rather than saving another copy of it."""
         if not self.image:
-            default_image_path = os.path.join(settings.MEDIA_ROOT, 'product_images/Images_not_available.png')
-            # 'with' statement ensures file is closed properly after block of code is executed.
-            # open image at given file path in binary as 'f' object.
-            with open(default_image_path, 'rb') as f:
-                # wrap binary data into Django 'File' object and assign to image field of current instance.
-                self.image.save('Image_not_available.png', File(f), save=False)
+            self.image = DEFAULT_PRODUCT_IMAGE
     
     def reuse_existing_image(self):
         """reuse an existing image if available"""
+        # image is unchanged (or is an existing file) so there is nothing to look up or store.
+        if self.image._committed:
+            return
+
+        # record the hash of the new image so later uploads of the same image can find it.
+        self.image_hash = content_hash(self.image.file)
         existing_image = self.get_existing_image()
 
         if existing_image:
             # assign the existing database image to this new instance
             self.image = existing_image.image
+            self.image_width = existing_image.image_width
+            self.image_derivative_widths = existing_image.image_derivative_widths
 
     def get_existing_image(self):
-        """gets the existing image from the Product model if it exists already"""
-        # extract the filename from the image field
-        # basename extracts the base filename "self.image.name" from the relative path of uploaded image.
-        # i.e self.image.name = "products_images/Lorem_Ipsum_Mug.jpg"
-        filename = os.path.basename(self.image.name)
-
-        # searches for an existing image in the Product model. Case-insensitive search.
-        existing_image = Product.objects.filter(image__iendswith=filename).first()
-        return existing_image
+        """gets the existing product with the same image content if it exists already"""
+        # indexed lookup on the hash of the images content.
+        return Product.objects.filter(image_hash=self.image_hash).exclude(pk=self.pk).only(
+            'image', 'image_width', 'image_derivative_widths').first()
     
     def __str__(self):
         return f'{self.category}: {self.product_name}'
     
 
+class ProductStock(models.Model):
+    """number of a product (and t-shirt size) left to sell. Products without a ProductStock row aren't limited.
+    Checkout takes ordered items out of stock with shop.stock.reserve_stock()."""
+
+    SHIRT_SIZE_CHOICES = [('small', 'Small'), ('medium', 'Medium'), ('large', 'Large'), ('xlarge', 'XLarge')]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock')
+    tshirt_size = models.CharField(max_length=15, choices=SHIRT_SIZE_CHOICES, blank=True)
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'tshirt_size'], name='unique_product_stock_size'),
+        ]
+
+    def __str__(self):
+        return f'{self.product} {self.tshirt_size}'.strip()
+
+
 class ShoppingCartSession(models.Model):
     """Store users shopping cart session that is created when the user adds an item to the shopping cart"""
 
@@ -122,12 +223,17 @@ class ShoppingCartSession(models.Model):
     status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='open')
     modified = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # lets the reap_carts command find idle and old abandoned carts without scanning every cart.
+            models.Index(fields=['status', 'modified'], name='cart_status_modified_idx'),
+        ]
+
     def order_total_price(self):
         """Calculates the total price of the order. It uses the cart_items related name from ShoppingCartItem
-        to get the query_set of cart items. It than iterate over each item and calculate the specific
-        items total price based on it's quantity and price."""
-        total_price = sum(item.calculate_cart_item_price() for item in self.cart_items.all())
-        return total_price
+        to sum each items quantity x price in the database with a single query."""
+        total_price = self.cart_items.aggregate(total_price=Sum(cart_item_line_total()))['total_price']
+        return to_cents(total_price or 0)
 
 class ShoppingCartItem(models.Model):
     """stores product details such as size and quantity for each item in the shopping cart"""
@@ -141,11 +247,62 @@ class ShoppingCartItem(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     modified_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # adding the same product and size again increases the quantity instead of adding another row.
+            models.UniqueConstraint(fields=['cart', 'product', 'tshirt_size'], name='unique_cart_product_size'),
+        ]
+
+    @classmethod
+    def add_quantity(cls, cart, product, quantity, tshirt_size=''):
+        """add quantity of a product to the cart, increasing the quantity of the item if it is already in the cart.
+        Uses a single INSERT .. ON CONFLICT DO UPDATE statement where the database supports it, so concurrent
+        double-clicks can't create duplicate items or lose an increment. Returns the (item id, new quantity)."""
+        now = timezone.now()
+        if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+            table = connection.ops.quote_name(cls._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f'''
+                    INSERT INTO {table} (cart_id, product_id, quantity, tshirt_size, created_at, modified_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (cart_id, product_id, tshirt_size)
+                    DO UPDATE SET quantity = {table}.quantity + excluded.quantity, modified_at = excluded.modified_at
+                    RETURNING id, quantity
+                ''', [cls._meta.get_field('cart').get_db_prep_value(cart.pk, connection), product.pk, quantity,
+                      tshirt_size, connection.ops.adapt_datetimefield_value(now),
+                      connection.ops.adapt_datetimefield_value(now)])
+                return cursor.fetchone()
+
+        # other databases: try to insert the item, if it already exists increase its quantity with F().
+        try:
+            with transaction.atomic():
+                item = cls.objects.create(cart=cart, product=product, quantity=quantity, tshirt_size=tshirt_size)
+            return item.pk, item.quantity
+        except IntegrityError:
+            items = cls.objects.filter(cart=cart, product=product, tshirt_size=tshirt_size)
+            items.update(quantity=F('quantity') + quantity, modified_at=now)
+            return items.values_list('pk', 'quantity').get()
+
     def calculate_cart_item_price(self):
-        """calculate the total price of the cart item based on the quantity ordered"""
+        """calculate the total price of the cart item based on the quantity ordered.
+        Uses the line_total calculated by the database when the item was loaded with it."""
+        if hasattr(self, 'line_total'):
+            return to_cents(self.line_total)
         return self.quantity * self.product.price
 
 
+def cart_item_line_total():
+    """database expression for a cart items quantity x product price"""
+    return ExpressionWrapper(F('quantity') * F('product__price'),
+                             output_field=models.DecimalField(max_digits=10, decimal_places=2))
+
+
+def to_cents(value):
+    """round a price calculated by the database to 2 decimal places.
+    SQLite returns calculated prices as plain numbers, i.e. 105 rather than 105.00."""
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
 class Order(models.Model):
     """stores customers order details and address"""
 
@@ -156,6 +313,9 @@ class Order(models.Model):
     total_price = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
     status = models.CharField(choices=STATUS_CHOICES, max_length=15, default='pending')
     date_ordered = models.DateTimeField(auto_now_add=True)
+    # the cart the order was placed from. Unique so a cart can only ever be turned into one order.
+    cart = models.OneToOneField(ShoppingCartSession, on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='order', editable=False)
 
     # customer information
     email = models.EmailField()
@@ -167,16 +327,24 @@ class Order(models.Model):
     state = models.CharField(max_length=20)
     post_code = models.CharField(max_length=20)
 
+    class Meta:
+        indexes = [
+            # a customers orders, newest first, for the order status page.
+            models.Index(fields=['email', 'date_ordered'], name='order_email_date_idx'),
+            # orders with a status in a date range for fulfilment, the admin and the order export.
+            models.Index(fields=['status', 'date_ordered'], name='order_status_date_idx'),
+            # newest orders first and date range filters in the admin.
+            models.Index(fields=['date_ordered'], name='order_date_idx'),
+        ]
+
     def __str__(self):
         return f'Order No.# {self.order_number}'
     
     def calculate_total_price(self):
         """calculate total price of the order from relationship with OrderItem model"""
-        self.total_price = 0
-
-        # using related_name 'order_items' from OrderItem order field.
-        for order_item in self.order_items.all():
-            self.total_price += order_item.quantity * order_item.price
+        # using related_name 'order_items' from OrderItem order field, summed by the database in one query.
+        total_price = self.order_items.aggregate(total_price=Sum(F('quantity') * F('price')))['total_price']
+        self.total_price = to_cents(total_price or 0)
         return self.total_price
 
 
@@ -200,4 +368,94 @@ class OrderItem(models.Model):
         # use related_name to access product model and 
         current_price = self.product.price
         self.price = current_price
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class OutboxEmail(models.Model):
+    """email waiting to be sent by the run_outbox worker.
+    Views queue emails here instead of talking to the SMTP server during the request, and because the email is saved
+    in the same transaction as the order it can't be sent for an order that failed or lost for one that was placed."""
+
+    STATUS_CHOICES = [('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField()
+    reply_to = models.JSONField(default=list, blank=True)
+
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # emails that failed to send are tried again after this time, waiting longer after each failure.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # lets the worker find the emails that are due without scanning the ones already sent.
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_attempt_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.recipients)}'
+
+
+class DailySales(models.Model):
+    """units sold and revenue for each day, product and t-shirt size, kept up to date by checkout.
+    Sales reports read this small table instead of adding up every OrderItem. Rebuild it from the order
+    history with the rebuild_sales_rollup command."""
+
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    tshirt_size = models.CharField(max_length=15, blank=True)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name_plural = 'daily sales'
+        constraints = [
+            # one row per day, product and size. Starts with date so reports can read a range of days from it.
+            models.UniqueConstraint(fields=['date', 'category', 'product', 'tshirt_size'], name='daily_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.product_id} {self.tshirt_size}'
+
+    @classmethod
+    def record_sales(cls, date, lines):
+        """add sales to the rollup for the given date. lines is a list of (product, tshirt size, quantity, price).
+        Uses a single INSERT .. ON CONFLICT DO UPDATE statement where the database supports it, so the query count
+        doesn't grow with the number of items ordered and orders placed at the same time can't lose sales."""
+        totals = {}
+        for product, tshirt_size, quantity, price in lines:
+            key = (product.category_id, product.pk, tshirt_size or '')
+            units, revenue = totals.get(key, (0, Decimal(0)))
+            totals[key] = (units + quantity, revenue + quantity * price)
+        if not totals:
+            return
+
+        if connection.vendor in ('sqlite', 'postgresql'):
+            table = connection.ops.quote_name(cls._meta.db_table)
+            date_value = connection.ops.adapt_datefield_value(date)
+            params = []
+            for (category_id, product_id, tshirt_size), (units, revenue) in totals.items():
+                params += [date_value, category_id, product_id, tshirt_size, units,
+                           connection.ops.adapt_decimalfield_value(revenue, 12, 2)]
+            values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(totals))
+            with connection.cursor() as cursor:
+                cursor.execute(f'''
+                    INSERT INTO {table} (date, category_id, product_id, tshirt_size, units, revenue)
+                    VALUES {values}
+                    ON CONFLICT (date, category_id, product_id, tshirt_size)
+                    DO UPDATE SET units = {table}.units + excluded.units, revenue = {table}.revenue + excluded.revenue
+                ''', params)
+            return
+
+        # other databases: add to each existing row with F(), creating the rows that don't exist yet.
+        for (category_id, product_id, tshirt_size), (units, revenue) in totals.items():
+            rows = cls.objects.filter(date=date, category_id=category_id, product_id=product_id, tshirt_size=tshirt_size)
+            if not rows.update(units=F('units') + units, revenue=F('revenue') + revenue):
+                cls.objects.create(date=date, category_id=category_id, product_id=product_id,
+                                   tshirt_size=tshirt_size, units=units, revenue=revenue)
@@ -0,0 +1,73 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from .models import OutboxEmail
+
+
+def queue_email(subject, body, recipients, from_email=None, reply_to=None):
+    """save an email to the outbox for the run_outbox worker to send.
+    When called inside a transaction the email is only queued if the transaction commits."""
+    return OutboxEmail.objects.create(subject=subject, body=body, recipients=list(recipients),
+                                      from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+                                      reply_to=list(reply_to or []))
+
+
+def retry_delay(attempts):
+    """seconds to wait before trying an email again, doubling after every failed attempt up to an hour"""
+    return min(settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), 60 * 60)
+
+
+def send_pending_emails(batch_size=None, connection=None):
+    """send up to batch_size emails that are due, all over one connection to the email server.
+    Emails that fail are tried again later and marked as failed after OUTBOX_MAX_ATTEMPTS attempts.
+    Returns the number of (sent, failed) emails, failed includes emails that will be retried."""
+    now = timezone.now()
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    emails = list(OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=now)
+                  .order_by('next_attempt_at', 'pk')[:batch_size])
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    connection = connection or get_connection()
+    try:
+        # opening the connection once saves an SMTP handshake and login for every email.
+        connection.open()
+    except Exception as error:
+        # the email server is down, try the whole batch again later.
+        for email in emails:
+            record_failure(email, error, now)
+        OutboxEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            message = EmailMessage(subject=email.subject, body=email.body, from_email=email.from_email,
+                                   to=email.recipients, reply_to=email.reply_to, connection=connection)
+            try:
+                message.send()
+            except Exception as error:
+                record_failure(email, error, now)
+                failed += 1
+            else:
+                email.status = 'sent'
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                sent += 1
+    finally:
+        connection.close()
+
+    OutboxEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    return sent, failed
+
+
+def record_failure(email, error, now):
+    """schedule a failed email to be tried again, or give up on it after OUTBOX_MAX_ATTEMPTS"""
+    email.attempts += 1
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.next_attempt_at = now + timedelta(seconds=retry_delay(email.attempts))
@@ -0,0 +1,145 @@
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from decimal import Decimal
+
+
+class KeysetPaginator:
+    """Cursor based paginator for product listings ordered by (price, id).
+    Unlike Django's Paginator it never runs COUNT(*) or an OFFSET scan, each page is
+    a range query starting from the last row of the previous page.
+    The cursors handed to the template are signed so customers can't tamper with them."""
+
+    # salt keeps product cursors from being valid signatures anywhere else on the site.
+    cursor_salt = 'shop.pagination.cursor'
+
+    def __init__(self, queryset, per_page, count_cache_key=None, count_cache_timeout=300):
+        self.queryset = queryset.order_by('price', 'pk')
+        self.per_page = per_page
+        self.count_cache_key = count_cache_key
+        self.count_cache_timeout = count_cache_timeout
+
+    def get_page(self, cursor=None):
+        """return the page after (or before) the position stored in the cursor.
+        Returns the first page if the cursor is missing or invalid, similar to Paginator.get_page()."""
+        rows_query, direction = self.page_query(cursor)
+        return self.make_page(list(rows_query), direction)
+
+    async def aget_page(self, cursor=None):
+        """get_page() for async views, the rows are loaded with the async ORM"""
+        rows_query, direction = self.page_query(cursor)
+        return self.make_page([row async for row in rows_query], direction)
+
+    def page_query(self, cursor):
+        """returns the query for the rows of the page (plus one to tell if there is another page) and the
+        direction from the cursor, None for the first page"""
+        position = self.decode_cursor(cursor)
+        if position is None:
+            return self.queryset[:self.per_page + 1], None
+
+        direction, price, pk = position
+        if direction == 'next':
+            # rows that sort after the cursor row i.e. (price, id) > (cursor price, cursor id)
+            after = Q(price__gt=price) | Q(price=price, pk__gt=pk)
+            return self.queryset.filter(after)[:self.per_page + 1], direction
+
+        # walk backwards from the cursor row, make_page() flips the rows back into ascending order.
+        before = Q(price__lt=price) | Q(price=price, pk__lt=pk)
+        return self.queryset.filter(before).order_by('-price', '-pk')[:self.per_page + 1], direction
+
+    def make_page(self, rows, direction):
+        if direction is None:
+            return KeysetPage(self, rows[:self.per_page], has_next=len(rows) > self.per_page, has_previous=False)
+        if direction == 'next':
+            return KeysetPage(self, rows[:self.per_page], has_next=len(rows) > self.per_page, has_previous=True)
+
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return KeysetPage(self, rows, has_next=True, has_previous=has_previous)
+
+    def encode_cursor(self, direction, product):
+        """create an opaque, signed token pointing at a products position in the listing"""
+        return signing.dumps([direction, str(product.price), product.pk], salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        """returns (direction, price, pk) from a cursor token, or None if the token isn't valid."""
+        if not cursor:
+            return None
+        try:
+            direction, price, pk = signing.loads(cursor, salt=self.cursor_salt)
+            if direction not in ('next', 'prev'):
+                return None
+            return direction, Decimal(price), int(pk)
+        except (signing.BadSignature, ValueError, TypeError, ArithmeticError):
+            return None
+
+    @cached_property
+    def approximate_count(self):
+        """total number of products in the listing. The COUNT(*) is only run when a template asks for it
+        and the result is cached, so the figure may be a few minutes out of date."""
+        if self.count_cache_key is None:
+            return self.queryset.count()
+        return cache.get_or_set(self.count_cache_key, self.queryset.count, self.count_cache_timeout)
+
+    async def aload_approximate_count(self):
+        """load approximate_count with the async ORM, for async views whose template shows it"""
+        if 'approximate_count' in self.__dict__:
+            return
+        count = await cache.aget(self.count_cache_key) if self.count_cache_key is not None else None
+        if count is None:
+            count = await self.queryset.acount()
+            if self.count_cache_key is not None:
+                await cache.aset(self.count_cache_key, count, self.count_cache_timeout)
+        self.approximate_count = count
+
+
+class KeysetPage:
+    """single page of results returned by KeysetPaginator.get_page()"""
+
+    def __init__(self, paginator, object_list, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_cursor(self):
+        """cursor for the page after this one, None on the last page"""
+        if self.has_next():
+            return self.paginator.encode_cursor('next', self.object_list[-1])
+        return None
+
+    def previous_cursor(self):
+        """cursor for the page before this one, None on the first page"""
+        if self.has_previous():
+            return self.paginator.encode_cursor('prev', self.object_list[0])
+        return None
+
+
+class CappedCountPaginator(Paginator):
+    """Paginator for admin change lists of tables that can have millions of rows.
+    Counting every row on each page load is slow on big tables, so at most max_count rows are counted with
+    COUNT(*) over a LIMIT subquery. Pages past max_count rows aren't offered, use the filters to narrow the list."""
+
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.max_count].count()
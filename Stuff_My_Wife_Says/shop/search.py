@@ -0,0 +1,106 @@
+from django.db import connection
+from .caching import get_navbar_categories
+from .models import Product
+import re
+
+# searches rank the newest this many matching products, finding them without scoring them is cheap.
+# FTS5's bm25 ranking counts every row matching each term first, too slow for common words in a big catalog.
+RANK_CANDIDATES_LIMIT = 200
+
+CANDIDATES_SQL = '''
+    SELECT rowid, product_name FROM shop_product_search
+    WHERE shop_product_search MATCH %s
+    ORDER BY rowid DESC
+    LIMIT %s
+'''
+
+# triggers keeping shop_product_search (created in migration 0012, rebuilt in 0023) in sync with every write.
+# SQLite drops a tables triggers when a migration rebuilds the table, so they are re-created after every migrate.
+SEARCH_TRIGGERS_SQL = [
+    '''CREATE TRIGGER IF NOT EXISTS shop_product_search_insert AFTER INSERT ON shop_product BEGIN
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category)
+        SELECT new.id, new.product_name, c.category_name, 'category' || c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS shop_product_search_update AFTER UPDATE OF product_name, category_id ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+        INSERT INTO shop_product_search(rowid, product_name, category_name, category)
+        SELECT new.id, new.product_name, c.category_name, 'category' || c.id FROM shop_category c WHERE c.id = new.category_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS shop_product_search_delete AFTER DELETE ON shop_product BEGIN
+        DELETE FROM shop_product_search WHERE rowid = old.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS shop_category_search_update AFTER UPDATE OF category_name ON shop_category BEGIN
+        UPDATE shop_product_search SET category_name = new.category_name
+        WHERE shop_product_search MATCH '{category} : category' || new.id;
+    END''',
+]
+
+
+def search_terms(query):
+    """split a customers search into words, i.e. "I didn't do it" -> ['i', 'didn', 't', 'do', 'it']"""
+    return re.findall(r'\w+', query.lower())
+
+
+def match_expression(terms):
+    """FTS5 MATCH expression requiring every term, the last term is a prefix so results update as the customer types"""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' AND '.join(quoted)
+
+
+def search_products(query, category_slug=None, limit=20):
+    """returns up to limit products matching the search query, best matches first.
+    Uses the shop_product_search full text index on SQLite, other databases fall back to a LIKE search."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    if connection.vendor != 'sqlite':
+        products = Product.objects.select_related('category')
+        for term in terms:
+            products = products.filter(product_name__icontains=term)
+        if category_slug:
+            products = products.filter(category__slug=category_slug)
+        return list(products.order_by('product_name')[:limit])
+
+    product_ids = search_index(terms, category_slug, limit)
+
+    # keep the ranked order from the search index.
+    products = Product.objects.select_related('category').in_bulk(product_ids)
+    return [products[product_id] for product_id in product_ids if product_id in products]
+
+
+def search_index(terms, category_slug, limit):
+    """returns the ids of up to limit products matching every search term, product name matches first"""
+    match = f'{{product_name category_name}} : ({match_expression(terms)})'
+    if category_slug:
+        # the category filter is part of the MATCH, using the cached navbar categories to find its id.
+        category = next((category for category in get_navbar_categories() if category.slug == category_slug), None)
+        if category is None:
+            return []
+        match += f' AND category : category{category.pk}'
+
+    with connection.cursor() as cursor:
+        cursor.execute(CANDIDATES_SQL, [match, RANK_CANDIDATES_LIMIT])
+        candidates = cursor.fetchall()
+
+    # newest products first, then the ones matching on their product name move to the top.
+    name_match = name_pattern(terms).match
+    candidates.sort(key=lambda candidate: not name_match(candidate[1]))
+    return [product_id for product_id, product_name in candidates[:limit]]
+
+
+def name_pattern(terms):
+    """regex matching product names containing every term, the last term as a prefix like match_expression"""
+    *whole_terms, prefix = terms
+    lookaheads = [rf'(?=.*\b{re.escape(term)}\b)' for term in whole_terms] + [rf'(?=.*\b{re.escape(prefix)})']
+    return re.compile(''.join(lookaheads), re.IGNORECASE)
+
+
+def create_search_triggers(connection):
+    """create any missing search index triggers, only once the search index table exists"""
+    if connection.vendor != 'sqlite' or 'shop_product_search' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for sql in SEARCH_TRIGGERS_SQL:
+            cursor.execute(sql)
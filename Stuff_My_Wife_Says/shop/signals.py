@@ -0,0 +1,44 @@
+from django.db import connections
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import Category, Product
+from .caching import invalidate_navbar_categories, invalidate_product_pages
+from .search import create_search_triggers
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    """categories are cached for the navbar, reload them whenever one is added, edited or removed.
+    Every cached catalog page includes the navbar so this also expires all of them."""
+    invalidate_navbar_categories()
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_location(sender, instance, **kwargs):
+    """remember the slugs a product had before saving, a product moved to another category
+    must also expire the pages it used to appear on."""
+    instance._previous_slugs = None
+    if instance.pk is not None:
+        instance._previous_slugs = Product.objects.filter(pk=instance.pk).values_list('slug', 'category__slug').first()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    """expire the cached product details page and the products pages of the products category"""
+    product_slugs = {instance.slug}
+    category_slugs = {instance.category.slug}
+
+    previous_slugs = getattr(instance, '_previous_slugs', None)
+    if previous_slugs is not None:
+        product_slugs.add(previous_slugs[0])
+        category_slugs.add(previous_slugs[1])
+
+    invalidate_product_pages(product_slugs, category_slugs)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    """migrations that alter shop_product or shop_category rebuild the table on SQLite, which drops the
+    search index triggers. Re-create them after every migrate."""
+    if sender.name == 'shop':
+        create_search_triggers(connections[using])
@@ -0,0 +1,52 @@
+from django.db.models import Case, F, Q, When
+from .models import ProductStock
+
+
+class OutOfStock(Exception):
+    """raised by reserve_stock() when there isn't enough stock for the order.
+    shortages is a list of (ProductStock, quantity ordered) for each item that ran out."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(', '.join(f'{stock} ({stock.quantity} left)' for stock, _ in shortages))
+
+
+def reserve_stock(lines):
+    """take the ordered quantities out of stock. lines is a list of (product, tshirt size, quantity).
+    Must be called in the transaction that saves the order so the stock is given back if the order fails.
+
+    Only the stock rows being bought are locked, never the whole table. All of them are decremented by a
+    single UPDATE that only changes rows with enough stock left (quantity >= ordered), so two customers
+    buying the last shirt at the same time can't both get it. Raises OutOfStock if any item doesn't have
+    enough stock, the caller's transaction then rolls back the order."""
+    ordered = {}
+    for product, tshirt_size, quantity in lines:
+        key = (product.pk, tshirt_size or '')
+        ordered[key] = ordered.get(key, 0) + quantity
+    if not ordered:
+        return
+
+    lookup = Q()
+    for product_id, tshirt_size in ordered:
+        lookup |= Q(product_id=product_id, tshirt_size=tshirt_size)
+    # lock the rows (on databases with row locks, SQLite already holds the write lock) so the quantities read
+    # here can't change before the update.
+    stock = list(ProductStock.objects.filter(lookup).select_related('product').select_for_update(of=('self',)))
+    # products without stock rows aren't limited.
+    if not stock:
+        return
+
+    shortages = [(row, ordered[row.product_id, row.tshirt_size]) for row in stock
+                 if row.quantity < ordered[row.product_id, row.tshirt_size]]
+    if shortages:
+        raise OutOfStock(shortages)
+
+    enough_stock = Q()
+    for row in stock:
+        enough_stock |= Q(pk=row.pk, quantity__gte=ordered[row.product_id, row.tshirt_size])
+    reserved = ProductStock.objects.filter(enough_stock).update(
+        quantity=F('quantity') - Case(*[When(pk=row.pk, then=ordered[row.product_id, row.tshirt_size])
+                                        for row in stock]))
+    if reserved < len(stock):
+        # only possible if the rows weren't locked, i.e. the caller isn't holding a write lock on SQLite.
+        raise OutOfStock([(row, ordered[row.product_id, row.tshirt_size]) for row in stock])
@@ -0,0 +1,62 @@
+from django.core.files.storage import FileSystemStorage
+import hashlib
+import os
+import threading
+
+
+def content_hash(content):
+    """sha256 hex digest of a file's content. The digest is kept on the file object so the
+    model and the storage backend only read the file once between them."""
+    digest = getattr(content, 'content_hash', None)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        # chunks() rewinds the file before reading so the whole file is hashed.
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        content.seek(0)
+        digest = sha256.hexdigest()
+        content.content_hash = digest
+    return digest
+
+
+class ContentAlreadyStored(FileExistsError):
+    """raised by ContentHashStorage.get_available_name() to stop FileSystemStorage._save() retrying a hash name"""
+
+
+class ContentHashStorage(FileSystemStorage):
+    """File system storage that names each file after the hash of its content,
+    i.e. product_images/Exactly_Mug.jpg is stored as product_images/<sha256>.jpg.
+    Uploading the same image twice stores it once, both names point at the same file."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # hash name being written by _save() in this thread.
+        self._saving = threading.local()
+
+    def get_available_name(self, name, max_length=None):
+        # FileSystemStorage._save() asks for another name when the file was created after the exists() check,
+        # i.e. the same image uploaded twice at once. Any other name would give the same bytes a second file.
+        if getattr(self._saving, 'name', None) == name:
+            raise ContentAlreadyStored(name)
+        # the name is replaced by the content hash in _save() so it never clashes with a different file.
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, f'{content_hash(content)}{extension}')
+
+        # identical bytes are already stored under this name.
+        if self.exists(name):
+            return name
+        self._saving.name = name
+        try:
+            return super()._save(name, content)
+        except ContentAlreadyStored:
+            return name
+        finally:
+            self._saving.name = None
+
+
+# storage for Product.image, files are stored in MEDIA_ROOT like the default storage.
+product_image_storage = ContentHashStorage()
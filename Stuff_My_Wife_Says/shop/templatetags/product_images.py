@@ -0,0 +1,22 @@
+from django import template
+from shop.images import derivative_name
+
+register = template.Library()
+
+
+@register.inclusion_tag('product_picture.html')
+def product_picture(product, alt, css_class='', sizes='100vw'):
+    """<picture> element for a product image with srcset for the resized and WebP copies.
+    Only the widths recorded on the product when its copies were made are listed, so no files are checked while
+    rendering, and the original is listed at its own width so the browser can still pick it for wide slots."""
+    image = product.image
+    storage = image.storage
+    webp_srcset = [f'{storage.url(derivative_name(image.name, width, "webp"))} {width}w'
+                   for width in product.image_derivative_widths]
+    srcset = [f'{storage.url(derivative_name(image.name, width))} {width}w'
+              for width in product.image_derivative_widths]
+    if srcset and product.image_width:
+        srcset.append(f'{image.url} {product.image_width}w')
+
+    return {'image': image, 'alt': alt, 'css_class': css_class, 'sizes': sizes,
+            'webp_srcset': ', '.join(webp_srcset), 'srcset': ', '.join(srcset)}
@@ -1,8 +1,42 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
 from django.urls import reverse, resolve
 from shop.views import HomePageView, AboutView
-from .models import Category, Product
+from .models import (Category, Product, ShoppingCartSession, ShoppingCartItem, Order, OrderItem, OutboxEmail,
+                     DailySales, ProductStock, DEFAULT_PRODUCT_IMAGE)
+from .cart import Cart
+from .checks import cache_shared_by_workers
+from .caching import CSRF_TOKEN_PLACEHOLDER, get_version, product_page_version_key, category_page_version_key
+from .context_processors import navbar_context
+from .images import derivative_name
+from .outbox import queue_email
+from .pagination import CappedCountPaginator
+from .search import search_products
+from PIL import Image
 from django.core.paginator import Paginator
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+from smtplib import SMTPException
+from unittest import mock
 
 class HomeTests(TestCase):
     """Testing the home view"""
@@ -54,11 +88,12 @@ class ProductsTest(TestCase):
         # objects in 'mug_products'.
         self.mug_products.sort(key=lambda product: product.price) 
 
+    @override_settings(PRODUCTS_PER_PAGE=2)
     def test_products_pagination(self):
         """testing pagination in products page"""
 
-        url = reverse('products', args=[self.category_mug.pk])
-        response = self.client.get(url)
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url + '?page=1')
 
         # assert response status is 200
         self.assertEqual(response.status_code, 200)
@@ -81,3 +116,1525 @@ class ProductsTest(TestCase):
         response = self.client.get(url + '?page=2')    # get 2nd page
         self.assertEqual(response.status_code, 200)    # assert status OK
         self.assertIn(self.mug_products[2], [product for product in response.context['products']])
+
+    @override_settings(PRODUCTS_PER_PAGE=2)
+    def test_products_cursor_pagination(self):
+        """testing cursor pagination in products page"""
+
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['cursor_pagination'])
+
+        # assert first page holds the two cheapest mugs and only has a next cursor
+        page1 = response.context['products']
+        self.assertEqual(list(page1), self.mug_products[:2])
+        self.assertFalse(page1.has_previous())
+        self.assertTrue(page1.has_next())
+
+        # follow the next cursor to the last page
+        response = self.client.get(url, {'cursor': page1.next_cursor()})
+        page2 = response.context['products']
+        self.assertEqual(list(page2), self.mug_products[2:])
+        self.assertFalse(page2.has_next())
+
+        # follow the prev cursor back to the first page
+        response = self.client.get(url, {'cursor': page2.previous_cursor()})
+        self.assertEqual(list(response.context['products']), self.mug_products[:2])
+        self.assertFalse(response.context['products'].has_previous())
+
+    def test_products_cursor_tampered(self):
+        """testing an invalid cursor falls back to the first page"""
+
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url, {'cursor': 'not-a-real-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['products']), self.mug_products)
+
+
+class NavbarCategoriesTest(TestCase):
+    """cached navbar categories tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+
+    def test_navbar_categories_cached(self):
+        """testing categories are only queried once until a Category changes"""
+        request = RequestFactory().get('/')
+        navbar_context(request)
+
+        # the navbar categories are cached so the second call runs no queries
+        with self.assertNumQueries(0):
+            context = navbar_context(request)
+        self.assertEqual(list(context['categories']), [self.category_mug])
+
+    def test_navbar_categories_invalidated(self):
+        """testing saving a Category reloads the navbar categories"""
+        request = RequestFactory().get('/')
+        navbar_context(request)
+
+        category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.assertIn(category_tshirt, navbar_context(request)['categories'])
+
+        category_tshirt.delete()
+        self.assertNotIn(category_tshirt, navbar_context(request)['categories'])
+
+
+class CacheSharedByWorkersTest(TestCase):
+    """cache backend system check tests"""
+
+    def test_local_memory_cache_with_workers(self):
+        """testing a local memory cache is only reported when several workers would use it"""
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+            self.assertEqual([warning.id for warning in cache_shared_by_workers(None)], ['shop.W001'])
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            self.assertEqual(cache_shared_by_workers(None), [])
+
+
+class CatalogPageCacheTest(TestCase):
+    """cached catalog page tests"""
+
+    def setUp(self):
+        cache.clear()
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.product = Product.objects.create(category=self.category_mug, product_name='This is a mug', price=20.55)
+
+    def test_products_page_cached(self):
+        """testing the second request for a products page is served from the cache"""
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url)
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(url)
+        self.assertEqual(cached_response.content, response.content)
+
+    def test_products_page_invalidated(self):
+        """testing saving a Product expires the cached products page of its category"""
+        url = reverse('products', args=[self.category_mug.slug])
+        self.client.get(url)
+
+        self.product.product_name = 'This is a renamed mug'
+        self.product.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'This is a renamed mug')
+
+    @override_settings(CATALOG_PAGE_CACHE_TIMEOUT=0)
+    def test_page_cache_off(self):
+        """testing a CATALOG_PAGE_CACHE_TIMEOUT of 0 renders every request"""
+        url = reverse('products', args=[self.category_mug.slug])
+        self.client.get(url)
+
+        Product.objects.filter(pk=self.product.pk).update(product_name='This is a renamed mug')
+        self.assertContains(self.client.get(url), 'This is a renamed mug')
+
+    def test_unknown_query_parameters_not_cached(self):
+        """testing query parameters the products page doesn't read skip the cache instead of adding entries"""
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url, {'utm_source': 'newsletter'})
+
+        # update() doesn't expire the cached page, a cached copy would still show the old name
+        Product.objects.filter(pk=self.product.pk).update(product_name='This is a renamed mug')
+        self.assertContains(self.client.get(url, {'utm_source': 'newsletter'}), 'This is a renamed mug')
+
+        # the page is the same, so it keeps the ETag of the plain url
+        self.assertEqual(self.client.get(url)['ETag'], response['ETag'])
+
+    def test_product_details_cart_bucket(self):
+        """testing cached product details page still shows whether the product is in the cart"""
+        url = reverse('product_details', args=[self.product.slug])
+        self.assertContains(self.client.get(url), 'Add to Cart')
+
+        # put the product in the customers cart
+        cart = ShoppingCartSession.objects.create()
+        ShoppingCartItem.objects.create(cart=cart, product=self.product)
+        session = self.client.session
+        session['cart_uuid'] = str(cart.cart_uuid)
+        session.save()
+
+        self.assertContains(self.client.get(url), 'Already in Cart')
+
+    def test_product_details_csrf_token(self):
+        """testing a cached page gets the visitors own csrf token"""
+        url = reverse('product_details', args=[self.product.slug])
+        self.client.get(url)
+
+        client = Client(enforce_csrf_checks=True)
+        response = client.get(url)
+        self.assertNotContains(response, CSRF_TOKEN_PLACEHOLDER.decode())
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', response.content.decode()).group(1)
+
+        # the token from the cached page is accepted when adding the product to the cart
+        response = client.post(url, {'quantity': 1, 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+
+class ProductSlugTest(TestCase):
+    """Product slug allocation tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+
+    def test_incremental_slugs(self):
+        """testing products with the same name get incremental numbers on the end of their slug"""
+        slugs = [Product.objects.create(category=self.category_mug, product_name="It's the tits", price=20).slug
+                 for _ in range(3)]
+        self.assertEqual(slugs, ['its-the-tits-mugs', 'its-the-tits-mugs-1', 'its-the-tits-mugs-2'])
+
+    def test_slug_allocated_in_single_query(self):
+        """testing finding the next free slug is a single query however many products share the name"""
+        for _ in range(5):
+            Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Product.next_free_slug('exactly-mugs'), 'exactly-mugs-5')
+
+    def test_next_slug_numbers_for_many_bases(self):
+        """testing many base slugs are looked up in fixed size chunks instead of one query that grows with them"""
+        Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        base_slugs = ['exactly-mugs'] + [f'mug-{number}-mugs' for number in range(1200)]
+
+        with self.assertNumQueries(math.ceil(len(base_slugs) / Product.SLUG_LOOKUP_CHUNK_SIZE)):
+            numbers = Product.next_slug_numbers(base_slugs)
+        self.assertEqual(numbers['exactly-mugs'], 1)
+        self.assertEqual(set(numbers.values()) - {1}, {0})
+
+    def test_slug_race(self):
+        """testing a slug taken between allocating and saving is re-allocated instead of failing"""
+        Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+
+        # pretend another admin user saved 'exactly-mugs' after this product was allocated its slug
+        with mock.patch.object(Product, 'next_free_slug', side_effect=['exactly-mugs', 'exactly-mugs-1']):
+            product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.assertEqual(product.slug, 'exactly-mugs-1')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductImageTest(TestCase):
+    """content addressed product image tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def test_identical_images_stored_once(self):
+        """testing uploading the same image twice stores a single file"""
+        product1 = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                          image=SimpleUploadedFile('Exactly_Mug.jpg', b'mug image'))
+        product2 = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                          image=SimpleUploadedFile('Another_Mug.jpg', b'mug image'))
+
+        self.assertEqual(product1.image.name, product2.image.name)
+        self.assertEqual(product1.image_hash, product2.image_hash)
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'product_images')),
+                         [f'{product1.image_hash}.jpg'])
+
+    def test_identical_images_saved_at_once(self):
+        """testing an upload finding its file created by another upload after the exists() check"""
+        storage = Product._meta.get_field('image').storage
+        exists = storage.exists
+
+        def created_by_another_upload(name):
+            if not exists(name):
+                os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+                with open(storage.path(name), 'wb') as other_upload:
+                    other_upload.write(b'mug image')
+            return False
+
+        with mock.patch.object(storage, 'exists', side_effect=created_by_another_upload):
+            product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                             image=SimpleUploadedFile('Exactly_Mug.jpg', b'mug image'))
+        self.assertEqual(product.image.name, f'product_images/{product.image_hash}.jpg')
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'product_images')),
+                         [f'{product.image_hash}.jpg'])
+
+    def test_default_image(self):
+        """testing a product without an image points at the default image"""
+        product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20, image='')
+        self.assertEqual(product.image.name, DEFAULT_PRODUCT_IMAGE)
+
+    def test_image_derivatives(self):
+        """testing resized and WebP copies are made on upload and used in the products page srcset"""
+        image_bytes = BytesIO()
+        Image.new('RGB', (720, 600)).save(image_bytes, 'JPEG')
+        product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                         image=SimpleUploadedFile('Exactly_Mug.jpg', image_bytes.getvalue()))
+
+        for width in settings.PRODUCT_IMAGE_WIDTHS:
+            self.assertTrue(product.image.storage.exists(derivative_name(product.image.name, width, 'webp')))
+            self.assertTrue(product.image.storage.exists(derivative_name(product.image.name, width)))
+
+        self.assertEqual(product.image_width, 720)
+        self.assertEqual(product.image_derivative_widths, settings.PRODUCT_IMAGE_WIDTHS)
+        product.refresh_from_db()
+        self.assertEqual(product.image_derivative_widths, settings.PRODUCT_IMAGE_WIDTHS)
+
+        # the srcset comes from the recorded widths, no files are checked while rendering
+        with mock.patch.object(product.image.storage, 'exists') as exists:
+            response = self.client.get(reverse('products', args=[self.category_mug.slug]))
+        exists.assert_not_called()
+        self.assertContains(response, derivative_name(product.image.url, 180, 'webp') + ' 180w')
+        self.assertContains(response, f'{product.image.url} 720w')
+
+    def test_reused_image_keeps_derivative_widths(self):
+        """testing a product reusing an identical image gets its recorded widths too"""
+        image_bytes = BytesIO()
+        Image.new('RGB', (400, 300)).save(image_bytes, 'JPEG')
+        Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                               image=SimpleUploadedFile('Exactly_Mug.jpg', image_bytes.getvalue()))
+        product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                         image=SimpleUploadedFile('Another_Mug.jpg', image_bytes.getvalue()))
+
+        product.refresh_from_db()
+        self.assertEqual(product.image_width, 400)
+        self.assertEqual(product.image_derivative_widths, [180, 360])
+
+    def test_missing_derivatives_fall_back(self):
+        """testing images without resized copies use the original image only"""
+        product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                         image=SimpleUploadedFile('Exactly_Mug.jpg', b'mug image'))
+
+        response = self.client.get(reverse('products', args=[self.category_mug.slug]))
+        self.assertContains(response, f'src="{product.image.url}"')
+        self.assertNotContains(response, 'srcset')
+
+    def test_unchanged_image_skips_lookup(self):
+        """testing saving a product without changing its image doesn't look up or store the image"""
+        product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20,
+                                         image=SimpleUploadedFile('Exactly_Mug.jpg', b'mug image'))
+        product.price = 25
+
+        with mock.patch.object(Product, 'get_existing_image') as get_existing_image:
+            product.save()
+        get_existing_image.assert_not_called()
+
+
+class ImportProductsTest(TestCase):
+    """import_products management command tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write_file(self, filename, content):
+        path = os.path.join(self.tmp_dir, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_import_csv(self):
+        """testing products are imported from csv in batches with unique slugs"""
+        path = self.write_file('products.csv', 'product_name,category,price\n'
+                                               'Exactly,Mugs,20.00\n'
+                                               'Exactly,mugs,21.00\n'
+                                               'Exactly,T-Shirts,35.95\n'
+                                               'Exactly,Hats,10.00\n')
+        call_command('import_products', path, batch_size=2, stdout=StringIO(), stderr=StringIO())
+
+        slugs = sorted(Product.objects.values_list('slug', flat=True))
+        self.assertEqual(slugs, ['exactly-mugs', 'exactly-mugs-1', 'exactly-mugs-2', 'exactly-t-shirts'])
+
+    def test_import_after_base_slug_deleted(self):
+        """testing numbered slugs carry on after the highest existing number when the base slug is free"""
+        Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        Product.objects.get(slug='exactly-mugs').delete()
+        path = self.write_file('products.csv', 'product_name,category,price\n'
+                                               'Exactly,Mugs,20.00\n'
+                                               'Exactly,Mugs,21.00\n')
+        with mock.patch.object(Product, 'next_slug_numbers', wraps=Product.next_slug_numbers) as next_slug_numbers:
+            call_command('import_products', path, stdout=StringIO(), stderr=StringIO())
+        # one lookup for the batch.
+        self.assertEqual(next_slug_numbers.call_count, 1)
+
+        slugs = sorted(Product.objects.values_list('slug', flat=True))
+        self.assertEqual(slugs, ['exactly-mugs-1', 'exactly-mugs-2', 'exactly-mugs-3'])
+
+    def test_import_many_names_in_one_batch(self):
+        """testing a batch with more distinct names than SQLite allows ranges in one query is imported"""
+        rows = ''.join(f'Mug {number},Mugs,20.00\n' for number in range(1200))
+        path = self.write_file('products.csv', 'product_name,category,price\n' + rows + 'Exactly,Mugs,20.00\n')
+        call_command('import_products', path, batch_size=2000, stdout=StringIO(), stderr=StringIO())
+
+        self.assertEqual(Product.objects.count(), 1202)
+        self.assertTrue(Product.objects.filter(slug='mug-1199-mugs').exists())
+        self.assertTrue(Product.objects.filter(slug='exactly-mugs-1').exists())
+
+    def test_import_duplicate_slug(self):
+        """testing rows with a slug that is already taken are reported and skipped, the rest are imported"""
+        path = self.write_file('products.csv', 'product_name,category,price,slug\n'
+                                               'Exactly,Mugs,20.00,exactly-mugs\n'
+                                               'Whatever,Mugs,20.00,whatever\n'
+                                               'Whatever,Mugs,21.00,whatever\n'
+                                               'Exactly,Mugs,22.00,\n'
+                                               'Exactly,Mugs,23.00,exactly-mugs-1\n')
+        stderr = StringIO()
+        call_command('import_products', path, stdout=StringIO(), stderr=stderr)
+
+        self.assertIn("line 2: skipped, slug 'exactly-mugs' is already taken", stderr.getvalue())
+        self.assertIn("line 4: skipped, slug 'whatever' is already taken", stderr.getvalue())
+        slugs = sorted(Product.objects.values_list('slug', flat=True))
+        self.assertEqual(slugs, ['exactly-mugs', 'exactly-mugs-1', 'exactly-mugs-2', 'whatever'])
+
+    def test_import_jsonl_with_images(self):
+        """testing products are imported from jsonl and share a single stored copy of the same image"""
+        self.write_file('Exactly_Mug.jpg', 'mug image')
+        path = self.write_file('products.jsonl', '{"product_name": "Exactly", "category": "Mugs", "price": "20", "image": "Exactly_Mug.jpg"}\n'
+                                                 '{"product_name": "Whatever", "category": "Mugs", "price": "20", "image": "Exactly_Mug.jpg"}\n')
+        with override_settings(MEDIA_ROOT=self.tmp_dir):
+            call_command('import_products', path, images=self.tmp_dir, stdout=StringIO(), stderr=StringIO())
+
+        images = set(Product.objects.filter(product_name__in=['Exactly', 'Whatever'], image_hash__gt='')
+                     .values_list('image', flat=True))
+        self.assertEqual(len(images), 1)
+
+
+class SearchTest(TestCase):
+    """product search tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.mug = Product.objects.create(category=self.category_mug, product_name="I didn't do anything", price=20)
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name="I didn't do anything", price=35)
+        self.other_mug = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+
+    def test_search_prefix(self):
+        """testing the last word of a search matches as a prefix"""
+        self.assertEqual(set(search_products('didn do any')), {self.mug, self.tshirt})
+        self.assertEqual(search_products('exac'), [self.other_mug])
+
+    def test_search_category_filter(self):
+        """testing search results can be limited to a category"""
+        self.assertEqual(search_products('anything', category_slug=self.category_tshirt.slug), [self.tshirt])
+        self.assertEqual(search_products('anything', category_slug='no-such-category'), [])
+
+    def test_search_ranking(self):
+        """testing product name matches rank above category name matches"""
+        mug_slogan = Product.objects.create(category=self.category_tshirt, product_name='Mug life', price=35)
+        self.assertEqual(search_products('mug')[0], mug_slogan)
+
+    def test_search_index_kept_in_sync(self):
+        """testing renamed, bulk created and deleted products are kept in the search index"""
+        self.other_mug.product_name = 'Whatever'
+        self.other_mug.save()
+        self.assertEqual(search_products('exactly'), [])
+        self.assertEqual(search_products('whatever'), [self.other_mug])
+
+        Product.objects.bulk_create([Product(category=self.category_mug, product_name='Bulk slogan', price=20, slug='bulk')])
+        self.assertEqual(len(search_products('bulk')), 1)
+
+        self.other_mug.delete()
+        self.assertEqual(search_products('whatever'), [])
+
+        self.category_tshirt.category_name = 'Hoodies'
+        self.category_tshirt.save()
+        self.assertEqual(search_products('hoodies'), [self.tshirt])
+        self.assertEqual(search_products('hoodies', category_slug=self.category_tshirt.slug), [self.tshirt])
+
+    def test_search_json(self):
+        """testing the JSON search endpoint"""
+        response = self.client.get(reverse('search_json'), {'q': 'exactly'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['url'] for result in response.json()['results']],
+                         [reverse('product_details', args=[self.other_mug.slug])])
+
+    def test_search_page(self):
+        """testing the search page lists matching products"""
+        response = self.client.get(reverse('search'), {'q': 'exactly'})
+        self.assertContains(response, reverse('product_details', args=[self.other_mug.slug]))
+
+
+class CartTest(TestCase):
+    """request scoped shopping cart tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.mug = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name='Exactly', price=35)
+
+    def add_to_cart(self, product, **data):
+        data.setdefault('quantity', 1)
+        return self.client.post(reverse('product_details', args=[product.slug]), data)
+
+    def test_add_to_cart(self):
+        """testing adding products creates one cart and reuses it"""
+        self.add_to_cart(self.mug)
+        self.add_to_cart(self.tshirt, size='large', quantity=2)
+
+        cart = ShoppingCartSession.objects.get()
+        self.assertEqual(self.client.session['cart_uuid'], str(cart.cart_uuid))
+        self.assertEqual(sorted(cart.cart_items.values_list('product__product_name', 'tshirt_size', 'quantity')),
+                         [('Exactly', '', 1), ('Exactly', 'large', 2)])
+
+    def test_shopping_cart_loads_cart_once(self):
+        """testing the shopping cart page loads the cart and its items once, however many items there are"""
+        for number in range(10):
+            self.add_to_cart(Product.objects.create(category=self.category_mug, product_name=f'Mug {number}', price=20))
+
+        # load the cached navbar categories
+        self.client.get(reverse('shopping_cart'))
+
+        # session, then the cart items with their cart, product, category and totals
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('shopping_cart'))
+        self.assertEqual(len(response.context['shopping_cart_items']), 10)
+
+    def test_cart_pages_query_count(self):
+        """testing the shopping cart and checkout pages run the same number of queries for 1 or 20 items"""
+        self.add_to_cart(self.tshirt, size='small', quantity=3)
+        cart = ShoppingCartSession.objects.get()
+        checkout_url = reverse('checkout', args=[cart.cart_uuid])
+
+        # load the cached navbar categories
+        self.client.get(reverse('shopping_cart'))
+
+        for number in range(19):
+            mug = Product.objects.create(category=self.category_mug, product_name=f'Mug {number}', price=20)
+            self.add_to_cart(mug, quantity=2)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('shopping_cart'))
+        self.assertContains(response, '$865.00')   # 3 x $35 + 19 x 2 x $20
+        self.assertContains(response, '$105.00')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(checkout_url)
+        self.assertContains(response, '$865.00')
+
+    def test_order_total_price_single_query(self):
+        """testing ShoppingCartSession.order_total_price is a single aggregate query"""
+        cart = ShoppingCartSession.objects.create()
+        for size in ['small', 'medium', 'large', 'xlarge']:
+            ShoppingCartItem.objects.create(cart=cart, product=self.tshirt, quantity=2, tshirt_size=size)
+        ShoppingCartItem.objects.create(cart=cart, product=self.mug, quantity=2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.order_total_price(), 320)
+
+    def test_remove_item_from_other_cart(self):
+        """testing items can only be removed from the customers own cart"""
+        other_cart = ShoppingCartSession.objects.create()
+        other_item = ShoppingCartItem.objects.create(cart=other_cart, product=self.mug)
+        self.add_to_cart(self.mug)
+
+        response = self.client.get(reverse('remove_item', args=[other_item.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(ShoppingCartItem.objects.filter(pk=other_item.pk).exists())
+
+
+class ConditionalGetTest(TestCase):
+    """ETag conditional GET tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.product = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+
+    def test_products_not_modified(self):
+        """testing an unchanged products page is answered with 304 without touching the database"""
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('ETag'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_products_modified(self):
+        """testing saving a product changes the products page validators"""
+        url = reverse('products', args=[self.category_mug.slug])
+        etag = self.client.get(url)['ETag']
+
+        self.product.price = 25
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_products_deleted(self):
+        """testing deleting a product changes the products page even though no product was modified"""
+        url = reverse('products', args=[self.category_mug.slug])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        self.product.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                   HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2050 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Exactly')
+
+    def test_product_details_etag_follows_cart(self):
+        """testing adding the product to the cart changes the product details page ETag"""
+        url = reverse('product_details', args=[self.product.slug])
+        response = self.client.get(url)
+        self.assertIn('Cookie', response['Vary'])
+
+        self.client.post(url, {'quantity': 1})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, 'Already in Cart')
+
+
+class AddToCartTest(TestCase):
+    """add to cart upsert tests"""
+
+    def setUp(self):
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name='Exactly', price=35)
+        self.cart = ShoppingCartSession.objects.create()
+
+    def test_same_product_and_size_merged(self):
+        """testing adding the same product and size twice increases the quantity of one item"""
+        first_id, quantity = ShoppingCartItem.add_quantity(self.cart, self.tshirt, 2, 'large')
+        self.assertEqual(quantity, 2)
+
+        with self.assertNumQueries(1):
+            item_id, quantity = ShoppingCartItem.add_quantity(self.cart, self.tshirt, 3, 'large')
+        self.assertEqual((item_id, quantity), (first_id, 5))
+        self.assertEqual(self.cart.cart_items.get().quantity, 5)
+
+    def test_different_sizes_kept_apart(self):
+        """testing the same product in different sizes are separate items"""
+        ShoppingCartItem.add_quantity(self.cart, self.tshirt, 1, 'large')
+        ShoppingCartItem.add_quantity(self.cart, self.tshirt, 1, 'small')
+        self.assertEqual(self.cart.cart_items.count(), 2)
+
+    def test_add_to_cart_view_merges(self):
+        """testing the add to cart form increases the quantity of an item already in the cart"""
+        url = reverse('product_details', args=[self.tshirt.slug])
+        self.client.post(url, {'size': 'medium', 'quantity': 1})
+        self.client.post(url, {'size': 'medium', 'quantity': 4})
+
+        item = ShoppingCartItem.objects.get()
+        self.assertEqual(item.quantity, 5)
+
+
+class UpdateQuantitiesTest(TestCase):
+    """batched cart quantity update tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.mugs = [Product.objects.create(category=self.category_mug, product_name=f'Mug {number}', price=20)
+                     for number in range(5)]
+        for mug in self.mugs:
+            self.client.post(reverse('product_details', args=[mug.slug]), {'quantity': 1})
+        self.items = list(ShoppingCartItem.objects.order_by('pk'))
+
+    def update_quantities(self, items):
+        return self.client.post(reverse('update_quantities'), {'items': items}, content_type='application/json')
+
+    def test_update_several_items(self):
+        """testing several quantity changes are saved in one request with a constant number of queries"""
+        changes = [{'item_id': item.pk, 'quantity': 3} for item in self.items]
+
+        # session, cart items, bulk update
+        with self.assertNumQueries(3):
+            response = self.update_quantities(changes)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['order_total_price'], '300.00')   # 5 x 3 x $20
+        self.assertEqual([item['line_total'] for item in data['items']], ['60.00'] * 5)
+        self.assertEqual(set(ShoppingCartItem.objects.values_list('quantity', flat=True)), {3})
+
+    def test_item_from_other_cart(self):
+        """testing items in someone else's cart can't be updated"""
+        other_cart = ShoppingCartSession.objects.create()
+        other_item = ShoppingCartItem.objects.create(cart=other_cart, product=self.mugs[0])
+
+        response = self.update_quantities([{'item_id': self.items[0].pk, 'quantity': 2},
+                                           {'item_id': other_item.pk, 'quantity': 50}])
+        self.assertEqual(response.status_code, 404)
+        other_item.refresh_from_db()
+        self.assertEqual(other_item.quantity, 1)
+        # nothing is saved when part of the batch is rejected
+        self.assertEqual(ShoppingCartItem.objects.get(pk=self.items[0].pk).quantity, 1)
+
+    def test_invalid_quantity(self):
+        """testing quantities outside the allowed range or a malformed body are rejected"""
+        for quantity in [0, -1, 1000, 'many']:
+            response = self.update_quantities([{'item_id': self.items[0].pk, 'quantity': quantity}])
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('update_quantities'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ShoppingCartItem.objects.get(pk=self.items[0].pk).quantity, 1)
+
+
+@override_settings(CART_STORAGE='cookie')
+class CookieCartTest(TestCase):
+    """cookie backed shopping cart tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.mug = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name='Exactly', price=35)
+
+    def add_to_cart(self, product, **data):
+        data.setdefault('quantity', 1)
+        return self.client.post(reverse('product_details', args=[product.slug]), data)
+
+    def checkout(self):
+        cart_uuid = self.client.get(reverse('shopping_cart')).context['shopping_cart'].cart_uuid
+        return self.client.post(reverse('checkout', args=[cart_uuid]), {
+            'name_on_card': 'Jane Citizen', 'card_number': '4111111111111111', 'expiry': '01/30', 'cvc': '123',
+            'first_name': 'Jane', 'last_name': 'Citizen', 'email': 'jane@example.com', 'phone': '0412 345 678',
+            'address': '1 Test Street', 'suburb': 'Sydney', 'state': 'NSW', 'post_code': '2000'})
+
+    def test_add_to_cart_writes_nothing(self):
+        """testing adding to the cart only updates the cookie, no carts or sessions are written to the database"""
+        # only the product itself is loaded.
+        with self.assertNumQueries(1):
+            self.add_to_cart(self.tshirt, size='large', quantity=2)
+        self.add_to_cart(self.tshirt, size='large', quantity=1)
+        self.add_to_cart(self.mug)
+
+        self.assertFalse(ShoppingCartSession.objects.exists())
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+        self.assertIn(settings.CART_COOKIE_NAME, self.client.cookies)
+
+        response = self.client.get(reverse('shopping_cart'))
+        items = response.context['shopping_cart_items']
+        self.assertEqual([(item.product, item.tshirt_size, item.quantity) for item in items],
+                         [(self.tshirt, 'large', 3), (self.mug, '', 1)])
+        self.assertContains(response, '$125.00')
+
+    def test_update_and_remove(self):
+        """testing cart items in the cookie can be updated and removed"""
+        self.add_to_cart(self.mug)
+        self.add_to_cart(self.tshirt, size='small')
+        mug_item, tshirt_item = self.client.get(reverse('shopping_cart')).context['shopping_cart_items']
+
+        response = self.client.post(reverse('update_quantities'), {'items': [{'item_id': mug_item.pk, 'quantity': 4}]},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['order_total_price'], '115.00')
+
+        self.client.get(reverse('remove_item', args=[tshirt_item.pk]))
+        items = self.client.get(reverse('shopping_cart')).context['shopping_cart_items']
+        self.assertEqual([(item.product, item.quantity) for item in items], [(self.mug, 4)])
+
+        response = self.client.get(reverse('remove_item', args=[tshirt_item.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cookie(self):
+        """testing a cart cookie that has been changed by the customer is ignored"""
+        self.add_to_cart(self.mug)
+        self.client.cookies[settings.CART_COOKIE_NAME] = self.client.cookies[settings.CART_COOKIE_NAME].value + 'x'
+        response = self.client.get(reverse('shopping_cart'))
+        self.assertTemplateUsed(response, 'no_shopping_cart.html')
+
+    def test_checkout_writes_cart(self):
+        """testing the cart is written to the database when the order is placed"""
+        self.add_to_cart(self.tshirt, size='medium', quantity=2)
+        self.add_to_cart(self.mug)
+
+        response = self.checkout()
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('purchase_confirmed', args=[order.order_number]))
+        self.assertEqual(order.total_price, 90)
+
+        cart = ShoppingCartSession.objects.get()
+        self.assertEqual(cart.status, 'closed')
+        self.assertEqual(sorted(cart.cart_items.values_list('tshirt_size', 'quantity')), [('', 1), ('medium', 2)])
+
+        # the cart is emptied once the order is confirmed.
+        self.assertEqual(self.client.cookies[settings.CART_COOKIE_NAME].value, '')
+        self.assertTemplateUsed(self.client.get(reverse('shopping_cart')), 'no_shopping_cart.html')
+
+    def test_out_of_stock_keeps_cookie(self):
+        """testing the cart stays in the cookie when checkout is rolled back"""
+        ProductStock.objects.create(product=self.tshirt, tshirt_size='large', quantity=1)
+        self.add_to_cart(self.tshirt, size='large', quantity=2)
+
+        self.assertRedirects(self.checkout(), reverse('shopping_cart'))
+        self.assertFalse(ShoppingCartSession.objects.exists())
+        response = self.client.get(reverse('shopping_cart'))
+        self.assertEqual([(item.product, item.quantity) for item in response.context['shopping_cart_items']],
+                         [(self.tshirt, 2)])
+
+    @override_settings(CART_COOKIE_MAX_ITEMS=2)
+    def test_large_cart_moved_to_database(self):
+        """testing carts with more than CART_COOKIE_MAX_ITEMS items are moved to the database"""
+        self.add_to_cart(self.mug)
+        self.add_to_cart(self.tshirt, size='small')
+        self.assertFalse(ShoppingCartSession.objects.exists())
+
+        self.add_to_cart(self.tshirt, size='large')
+        cart = ShoppingCartSession.objects.get()
+        self.assertEqual(cart.cart_items.count(), 3)
+
+        response = self.client.get(reverse('shopping_cart'))
+        self.assertEqual(response.context['shopping_cart'].cart_uuid, str(cart.cart_uuid))
+        self.assertEqual(len(response.context['shopping_cart_items']), 3)
+
+
+class ReapCartsTest(TestCase):
+    """abandoned cart reaper command tests"""
+
+    def setUp(self):
+        category = Category.objects.create(category_name='Mugs')
+        self.mug = Product.objects.create(category=category, product_name='Exactly', price=20)
+
+    def make_cart(self, days_old, status='open', item_days_old=None):
+        cart = ShoppingCartSession.objects.create(status=status)
+        item = ShoppingCartItem.objects.create(cart=cart, product=self.mug)
+        # update() skips auto_now so the times can be set in the past.
+        ShoppingCartSession.objects.filter(pk=cart.pk).update(modified=timezone.now() - timedelta(days=days_old))
+        item_age = days_old if item_days_old is None else item_days_old
+        ShoppingCartItem.objects.filter(pk=item.pk).update(modified_at=timezone.now() - timedelta(days=item_age))
+        return cart
+
+    def reap_carts(self, *args):
+        output = StringIO()
+        call_command('reap_carts', *args, stdout=output)
+        return output.getvalue()
+
+    def test_idle_carts_marked_abandoned(self):
+        """testing open carts idle past the threshold are marked as abandoned in batches"""
+        idle_carts = [self.make_cart(days_old=40) for _ in range(5)]
+        active_cart = self.make_cart(days_old=1)
+        # the cart row is old but an item was changed recently
+        recent_item_cart = self.make_cart(days_old=40, item_days_old=1)
+        closed_cart = self.make_cart(days_old=40, status='closed')
+
+        output = self.reap_carts('--abandoned-after', '30', '--batch-size', '2', '--pause', '0')
+
+        self.assertEqual(set(ShoppingCartSession.objects.filter(status='abandoned').values_list('pk', flat=True)),
+                         {cart.pk for cart in idle_carts})
+        for cart in [active_cart, recent_item_cart, closed_cart]:
+            self.assertNotEqual(ShoppingCartSession.objects.get(pk=cart.pk).status, 'abandoned')
+        self.assertIn('Marked 5 carts as abandoned', output)
+
+    def test_old_abandoned_carts_purged(self):
+        """testing abandoned carts are deleted with their items once they are past the purge threshold"""
+        old_carts = [self.make_cart(days_old=40, status='abandoned') for _ in range(3)]
+        recent_cart = self.make_cart(days_old=5, status='abandoned')
+
+        output = self.reap_carts('--purge-after', '30', '--batch-size', '2', '--pause', '0')
+
+        self.assertFalse(ShoppingCartSession.objects.filter(pk__in=[cart.pk for cart in old_carts]).exists())
+        self.assertEqual(ShoppingCartItem.objects.filter(cart__in=old_carts).count(), 0)
+        self.assertTrue(ShoppingCartSession.objects.filter(pk=recent_cart.pk).exists())
+        self.assertIn('deleted 3 abandoned carts and 3 cart items', output)
+
+    def test_abandoned_cart_reopened(self):
+        """testing adding to an abandoned cart before it is purged opens it again"""
+        self.client.post(reverse('product_details', args=[self.mug.slug]), {'quantity': 1})
+        ShoppingCartSession.objects.update(status='abandoned')
+
+        self.client.post(reverse('product_details', args=[self.mug.slug]), {'quantity': 1})
+        cart = ShoppingCartSession.objects.get()
+        self.assertEqual(cart.status, 'open')
+        self.assertEqual(cart.cart_items.get().quantity, 2)
+
+
+class CheckoutTest(TestCase):
+    """checkout order pipeline tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+
+    def add_mugs(self, count):
+        for number in range(count):
+            mug = Product.objects.create(category=self.category_mug, product_name=f'Mug {number}', price=20)
+            self.client.post(reverse('product_details', args=[mug.slug]), {'quantity': 2})
+
+    def checkout(self):
+        cart = ShoppingCartSession.objects.get()
+        return self.client.post(reverse('checkout', args=[cart.cart_uuid]), {
+            'name_on_card': 'Jane Citizen', 'card_number': '4111111111111111', 'expiry': '01/30', 'cvc': '123',
+            'first_name': 'Jane', 'last_name': 'Citizen', 'email': 'jane@example.com', 'phone': '0412 345 678',
+            'address': '1 Test Street', 'suburb': 'Sydney', 'state': 'NSW', 'post_code': '2000'})
+
+    def checkout_queries(self, item_count):
+        self.add_mugs(item_count)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.checkout()
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_order_created(self):
+        """testing the order, its items and prices are saved and the cart is closed"""
+        self.add_mugs(3)
+        self.checkout()
+
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, 120)
+        self.assertEqual(order.calculate_total_price(), 120)
+        self.assertEqual(list(order.order_items.values_list('price', 'quantity')), [(20, 2)] * 3)
+        self.assertEqual(ShoppingCartSession.objects.get().status, 'closed')
+
+    def test_query_count_flat(self):
+        """testing placing an order runs the same number of queries for 1 or 25 items"""
+        small_order_queries = self.checkout_queries(1)
+
+        self.client = Client()
+        ShoppingCartSession.objects.all().delete()
+        self.assertEqual(self.checkout_queries(25), small_order_queries)
+        self.assertEqual(Order.objects.order_by('date_ordered').last().order_items.count(), 25)
+
+    def test_order_uses_current_prices(self):
+        """testing the order is written from the cart loaded again once claimed, not the one shown at checkout"""
+        self.add_mugs(2)
+        mug = Product.objects.get(product_name='Mug 0')
+        save_to_database = Cart.save_to_database
+
+        def price_changed(cart):
+            # the price changes after the checkout page loaded the cart, before the order is placed.
+            Product.objects.filter(pk=mug.pk).update(price=25)
+            return save_to_database(cart)
+
+        with mock.patch.object(Cart, 'save_to_database', price_changed):
+            self.checkout()
+
+        order = Order.objects.get()
+        self.assertEqual(order.total_price, 90)
+        self.assertEqual(sorted(order.order_items.values_list('price', flat=True)), [20, 25])
+
+    def test_failed_checkout_rolled_back(self):
+        """testing nothing is saved if writing the order items fails"""
+        self.add_mugs(2)
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.checkout()
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ShoppingCartSession.objects.get().status, 'open')
+
+
+class DuplicateCheckoutTest(TransactionTestCase):
+    """repeated and parallel checkout submits of the same cart tests"""
+
+    def setUp(self):
+        category = Category.objects.create(category_name='Mugs')
+        self.mug = Product.objects.create(category=category, product_name='Exactly', price=20)
+        self.client.post(reverse('product_details', args=[self.mug.slug]), {'quantity': 2})
+        self.cart = ShoppingCartSession.objects.get()
+        self.checkout_data = {
+            'name_on_card': 'Jane Citizen', 'card_number': '4111111111111111', 'expiry': '01/30', 'cvc': '123',
+            'first_name': 'Jane', 'last_name': 'Citizen', 'email': 'jane@example.com', 'phone': '0412 345 678',
+            'address': '1 Test Street', 'suburb': 'Sydney', 'state': 'NSW', 'post_code': '2000'}
+
+    def checkout(self, client):
+        return client.post(reverse('checkout', args=[self.cart.cart_uuid]), self.checkout_data)
+
+    def test_repeated_submit(self):
+        """testing submitting checkout again redirects to the order already placed"""
+        first = self.checkout(self.client)
+        second = self.checkout(self.client)
+
+        order = Order.objects.get()
+        self.assertRedirects(first, reverse('purchase_confirmed', args=[order.order_number]))
+        self.assertRedirects(second, reverse('purchase_confirmed', args=[order.order_number]))
+        self.assertEqual(OrderItem.objects.count(), 1)
+
+    def test_add_after_checkout(self):
+        """testing items added before purchase_confirmed is shown go in a new cart instead of the checked out one"""
+        self.checkout(self.client)
+        self.client.get(reverse('shopping_cart'))
+        self.client.post(reverse('product_details', args=[self.mug.slug]), {'quantity': 1})
+
+        new_cart = ShoppingCartSession.objects.exclude(pk=self.cart.pk).get()
+        response = self.client.get(reverse('shopping_cart'))
+        self.assertEqual([(item.cart_id, item.quantity) for item in response.context['shopping_cart_items']],
+                         [(new_cart.pk, 1)])
+
+        self.cart = new_cart
+        self.checkout(self.client)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_parallel_submits(self):
+        """testing submits of the same cart at the same time only create one order"""
+        submits = 4
+        barrier = threading.Barrier(submits)
+        cookies = self.client.cookies
+
+        def submit():
+            client = Client()
+            client.cookies = cookies
+            barrier.wait()
+            try:
+                return self.checkout(client).url
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=submits) as executor:
+            redirects = list(executor.map(lambda _: submit(), range(submits)))
+
+        order = Order.objects.get()
+        self.assertEqual(redirects, [reverse('purchase_confirmed', args=[order.order_number])] * submits)
+        self.assertEqual(OrderItem.objects.count(), 1)
+        self.assertEqual(ShoppingCartSession.objects.get().status, 'closed')
+
+
+class OutboxTest(TestCase):
+    """queued email outbox and run_outbox worker tests"""
+
+    def run_outbox(self, *args):
+        output = StringIO()
+        call_command('run_outbox', '--once', *args, stdout=output)
+        return output.getvalue()
+
+    def test_contact_email_queued(self):
+        """testing the contact form queues the email instead of sending it during the request"""
+        response = self.client.post(reverse('contact'), {'name': 'Jane', 'email': 'jane@example.com',
+                                                         'subject': 'Hello', 'message': 'Nice mugs'})
+        self.assertRedirects(response, reverse('home'))
+        self.assertEqual(len(mail.outbox), 0)
+
+        output = self.run_outbox()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Hello')
+        self.assertEqual(mail.outbox[0].to, [settings.CONTACT_EMAIL])
+        self.assertEqual(mail.outbox[0].reply_to, ['jane@example.com'])
+        self.assertIn('Sent 1 emails', output)
+        self.assertEqual(OutboxEmail.objects.get().status, 'sent')
+
+    def test_order_confirmation_email(self):
+        """testing checkout queues an order confirmation email to the customer"""
+        category = Category.objects.create(category_name='Mugs')
+        mug = Product.objects.create(category=category, product_name='Exactly', price=20)
+        self.client.post(reverse('product_details', args=[mug.slug]), {'quantity': 2})
+        cart = ShoppingCartSession.objects.get()
+        self.client.post(reverse('checkout', args=[cart.cart_uuid]), {
+            'name_on_card': 'Jane Citizen', 'card_number': '4111111111111111', 'expiry': '01/30', 'cvc': '123',
+            'first_name': 'Jane', 'last_name': 'Citizen', 'email': 'jane@example.com', 'phone': '0412 345 678',
+            'address': '1 Test Street', 'suburb': 'Sydney', 'state': 'NSW', 'post_code': '2000'})
+
+        self.run_outbox()
+        order = Order.objects.get()
+        self.assertEqual(mail.outbox[0].to, ['jane@example.com'])
+        self.assertIn(str(order.order_number), mail.outbox[0].subject)
+        self.assertIn('2 x Exactly - $40.00', mail.outbox[0].body)
+
+    def test_batch_uses_one_connection(self):
+        """testing a batch of emails is sent over a single connection"""
+        for number in range(5):
+            queue_email(f'Email {number}', 'body', ['someone@example.com'])
+
+        with mock.patch('shop.outbox.get_connection', wraps=get_connection) as connection:
+            self.run_outbox('--batch-size', '10')
+        connection.assert_called_once()
+        self.assertEqual([message.subject for message in mail.outbox], [f'Email {number}' for number in range(5)])
+
+    @override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_DELAY=60)
+    def test_failed_email_retried(self):
+        """testing an email that fails is tried again after a delay then given up on"""
+        email = queue_email('Hello', 'body', ['someone@example.com'])
+
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=SMTPException('server busy')):
+            self.run_outbox()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), ('pending', 1))
+            self.assertIn('server busy', email.last_error)
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+            # not due again until the retry delay has passed
+            self.run_outbox()
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, 1)
+
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+            self.run_outbox()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), ('failed', 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class ExportOrdersTest(TestCase):
+    """streaming order export tests"""
+
+    def setUp(self):
+        category = Category.objects.create(category_name='Mugs')
+        self.mug = Product.objects.create(category=category, product_name='Exactly', price=20)
+        self.orders = []
+        for days_ago, status in [(10, 'pending'), (5, 'shipped'), (1, 'pending')]:
+            order = Order.objects.create(first_name='Jane', last_name='Citizen', email='jane@example.com',
+                                         phone='0412 345 678', address='1 Test Street', suburb='Sydney',
+                                         state='NSW', post_code='2000', status=status, total_price=60)
+            Order.objects.filter(pk=order.pk).update(date_ordered=timezone.now() - timedelta(days=days_ago))
+            OrderItem.objects.create(order=order, product=self.mug, quantity=1)
+            OrderItem.objects.create(order=order, product=self.mug, quantity=2)
+            self.orders.append(order)
+
+    def export(self, *args):
+        output = StringIO()
+        call_command('export_orders', *args, stdout=output, stderr=StringIO())
+        return output.getvalue()
+
+    def test_csv_export(self):
+        """testing every order item is exported with its order and product details"""
+        rows = list(csv.DictReader(StringIO(self.export())))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([row['order_number'] for row in rows[::2]], [str(order.pk) for order in self.orders])
+        self.assertEqual((rows[1]['product_name'], rows[1]['category'], rows[1]['quantity'], rows[1]['price']),
+                         ('Exactly', 'Mugs', '2', '20.00'))
+        self.assertEqual(rows[0]['phone'], '+61412345678')
+
+    def test_filters(self):
+        """testing exports can be limited to a date range and status"""
+        week_ago = (timezone.now() - timedelta(days=7)).date().isoformat()
+        lines = self.export('--format', 'jsonl', '--from', week_ago, '--status', 'pending').splitlines()
+        self.assertEqual({json.loads(line)['order_number'] for line in lines}, {str(self.orders[2].pk)})
+
+        yesterday = (timezone.now() - timedelta(days=2)).date().isoformat()
+        rows = list(csv.DictReader(StringIO(self.export('--to', yesterday))))
+        self.assertEqual({row['order_number'] for row in rows}, {str(self.orders[0].pk), str(self.orders[1].pk)})
+
+    def test_single_query(self):
+        """testing the export is read with one joined query"""
+        with self.assertNumQueries(1):
+            self.export()
+
+    def test_admin_action_streams(self):
+        """testing the admin export action streams the selected orders"""
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.orders[0].pk, self.orders[1].pk]})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 4)
+
+
+class SalesRollupTest(TestCase):
+    """daily sales rollup and dashboard tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.mug = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name='Exactly', price=35)
+
+    def place_order(self, *items):
+        client = Client()
+        for product, data in items:
+            client.post(reverse('product_details', args=[product.slug]), data)
+        cart_uuid = client.session['cart_uuid']
+        client.post(reverse('checkout', args=[cart_uuid]), {
+            'name_on_card': 'Jane Citizen', 'card_number': '4111111111111111', 'expiry': '01/30', 'cvc': '123',
+            'first_name': 'Jane', 'last_name': 'Citizen', 'email': 'jane@example.com', 'phone': '0412 345 678',
+            'address': '1 Test Street', 'suburb': 'Sydney', 'state': 'NSW', 'post_code': '2000'})
+
+    def rollup(self):
+        return sorted(DailySales.objects.values_list('date', 'product_id', 'tshirt_size', 'units', 'revenue'))
+
+    def test_checkout_updates_rollup(self):
+        """testing each order adds its items to the days sales"""
+        self.place_order((self.mug, {'quantity': 2}), (self.tshirt, {'quantity': 1, 'size': 'large'}))
+        self.place_order((self.mug, {'quantity': 3}))
+
+        today = timezone.localdate()
+        self.assertEqual(self.rollup(), [(today, self.mug.pk, '', 5, 100), (today, self.tshirt.pk, 'large', 1, 35)])
+
+    def test_rebuild_matches_checkout(self):
+        """testing the rebuild command produces the same rollup as checkout, in chunks of days"""
+        self.place_order((self.mug, {'quantity': 2}), (self.tshirt, {'quantity': 1, 'size': 'small'}))
+        self.place_order((self.tshirt, {'quantity': 4, 'size': 'small'}))
+        # move the first order back a few days
+        first_order = Order.objects.order_by('date_ordered').first()
+        Order.objects.filter(pk=first_order.pk).update(date_ordered=timezone.now() - timedelta(days=3))
+
+        DailySales.objects.all().delete()
+        DailySales.objects.create(date=timezone.localdate() - timedelta(days=1), category=self.category_mug,
+                                  product=self.mug, units=99, revenue=1)  # stale row
+        call_command('rebuild_sales_rollup', '--chunk-days', '2', stdout=StringIO())
+
+        today = timezone.localdate()
+        self.assertEqual(self.rollup(), [(today - timedelta(days=3), self.mug.pk, '', 2, 40),
+                                         (today - timedelta(days=3), self.tshirt.pk, 'small', 1, 35),
+                                         (today, self.tshirt.pk, 'small', 4, 140)])
+
+    def test_dashboard(self):
+        """testing the admin dashboard shows totals from the rollup"""
+        self.place_order((self.mug, {'quantity': 2}), (self.tshirt, {'quantity': 1, 'size': 'large'}))
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(reverse('admin:shop_dailysales_changelist'))
+        self.assertContains(response, '$75.00')
+        self.assertContains(response, 'T-Shirts')
+
+        # only the rollup is read, not the orders
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('admin:shop_dailysales_changelist'), {'from': '2000-01-01'})
+        self.assertFalse(any('shop_orderitem' in query['sql'] for query in queries))
+
+
+CHECKOUT_FORM_DATA = {
+    'name_on_card': 'Jane Citizen', 'card_number': '4111111111111111', 'expiry': '01/30', 'cvc': '123',
+    'first_name': 'Jane', 'last_name': 'Citizen', 'email': 'jane@example.com', 'phone': '0412 345 678',
+    'address': '1 Test Street', 'suburb': 'Sydney', 'state': 'NSW', 'post_code': '2000'}
+
+
+class StockTest(TestCase):
+    """stock reservation at checkout tests"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.mug = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name='Limited', price=35)
+        self.large = ProductStock.objects.create(product=self.tshirt, tshirt_size='large', quantity=3)
+        self.small = ProductStock.objects.create(product=self.tshirt, tshirt_size='small', quantity=1)
+
+    def checkout(self, *items):
+        client = Client()
+        for product, data in items:
+            client.post(reverse('product_details', args=[product.slug]), data)
+        return client.post(reverse('checkout', args=[client.session['cart_uuid']]), CHECKOUT_FORM_DATA, follow=True)
+
+    def test_checkout_reserves_stock(self):
+        """testing ordered items are taken out of stock and products without stock aren't limited"""
+        self.checkout((self.tshirt, {'quantity': 2, 'size': 'large'}), (self.mug, {'quantity': 50}))
+
+        self.large.refresh_from_db()
+        self.assertEqual(self.large.quantity, 1)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_out_of_stock(self):
+        """testing an order with too little stock is refused without saving anything"""
+        response = self.checkout((self.tshirt, {'quantity': 2, 'size': 'large'}),
+                                 (self.tshirt, {'quantity': 2, 'size': 'small'}))
+
+        self.assertRedirects(response, reverse('shopping_cart'))
+        self.assertContains(response, 'Sorry, we only have 1 of Limited (Small) left.')
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(ShoppingCartSession.objects.get().status, 'open')
+        # the large shirts that were in stock weren't taken either
+        self.assertEqual(sorted(ProductStock.objects.values_list('quantity', flat=True)), [1, 3])
+
+    def test_sold_out(self):
+        """testing a sold out item is reported"""
+        ProductStock.objects.filter(pk=self.small.pk).update(quantity=0)
+        response = self.checkout((self.tshirt, {'quantity': 1, 'size': 'small'}))
+        self.assertContains(response, 'Sorry, Limited (Small) is sold out.')
+
+
+class StockStressTest(TransactionTestCase):
+    """parallel checkouts of the same limited product tests"""
+
+    def test_parallel_checkouts_never_oversell(self):
+        """testing many customers buying the last few shirts at once never sells more than are in stock"""
+        category = Category.objects.create(category_name='T-Shirts')
+        tshirt = Product.objects.create(category=category, product_name='Limited', price=35)
+        ProductStock.objects.create(product=tshirt, tshirt_size='medium', quantity=5)
+
+        buyers = 12
+        clients = []
+        for _ in range(buyers):
+            client = Client()
+            client.post(reverse('product_details', args=[tshirt.slug]), {'quantity': 1, 'size': 'medium'})
+            clients.append(client)
+        barrier = threading.Barrier(buyers)
+
+        def buy(client):
+            barrier.wait()
+            try:
+                response = client.post(reverse('checkout', args=[client.session['cart_uuid']]), CHECKOUT_FORM_DATA)
+                return response.url
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=buyers) as executor:
+            redirects = list(executor.map(buy, clients))
+
+        self.assertEqual(Order.objects.count(), 5)
+        self.assertEqual(ProductStock.objects.get().quantity, 0)
+        self.assertEqual(redirects.count(reverse('shopping_cart')), buyers - 5)
+        self.assertEqual(ShoppingCartSession.objects.filter(status='closed').count(), 5)
+
+
+class OrderStatusTest(TestCase):
+    """order status lookup page tests"""
+
+    def setUp(self):
+        category = Category.objects.create(category_name='Mugs')
+        self.mug = Product.objects.create(category=category, product_name='Exactly', price=20)
+        self.orders = []
+        for days_ago in [3, 2, 1]:
+            order = Order.objects.create(first_name='Jane', last_name='Citizen', email='jane@example.com',
+                                         phone='0412 345 678', address='1 Test Street', suburb='Sydney',
+                                         state='NSW', post_code='2000', total_price=40)
+            Order.objects.filter(pk=order.pk).update(date_ordered=timezone.now() - timedelta(days=days_ago))
+            for quantity in [1, 3]:
+                OrderItem.objects.create(order=order, product=self.mug, quantity=quantity)
+            self.orders.append(order)
+        self.other_customer = Order.objects.create(first_name='John', email='john@example.com', phone='0412 345 678',
+                                                   address='2 Test Street', suburb='Sydney', state='NSW',
+                                                   post_code='2000')
+
+    def lookup(self, order_number, email):
+        return self.client.post(reverse('order_status'), {'order_number': order_number, 'email': email})
+
+    def test_lookup(self):
+        """testing an order is found by order number and email, with the customers other orders newest first"""
+        response = self.lookup(self.orders[0].pk, 'Jane@Example.com')
+        self.assertEqual(response.context['order'], self.orders[0])
+        self.assertEqual(list(response.context['previous_orders']), [self.orders[2], self.orders[1]])
+        self.assertContains(response, '3 x Exactly')
+        self.assertNotContains(response, str(self.other_customer.pk))
+
+    def test_wrong_email(self):
+        """testing an order number with someone else's email finds nothing"""
+        response = self.lookup(self.orders[0].pk, 'john@example.com')
+        self.assertNotIn('order', response.context)
+        self.assertContains(response, "couldn&#x27;t find an order")
+
+    def test_query_count(self):
+        """testing the lookup runs the same queries however many orders and items the customer has"""
+        self.lookup(self.orders[0].pk, 'jane@example.com')
+
+        # the order, its items, the previous orders and their items
+        with self.assertNumQueries(4):
+            self.lookup(self.orders[0].pk, 'jane@example.com')
+
+    def test_history_uses_index(self):
+        """testing the order history is read from the (email, date_ordered) index"""
+        history = Order.objects.filter(email='jane@example.com').order_by('-date_ordered')[:20]
+        self.assertIn('order_email_date_idx', history.explain())
+
+    def test_checkout_saves_lowercase_email(self):
+        """testing checkout saves the email in lowercase so the order can be looked up"""
+        self.client.post(reverse('product_details', args=[self.mug.slug]), {'quantity': 1})
+        self.client.post(reverse('checkout', args=[self.client.session['cart_uuid']]),
+                         {**CHECKOUT_FORM_DATA, 'email': 'Jane.Citizen@Example.COM'})
+        self.assertTrue(Order.objects.filter(email='jane.citizen@example.com').exists())
+
+
+class AdminChangelistTest(TestCase):
+    """admin change list query tests"""
+
+    CHANGELISTS = ['admin:shop_product_changelist', 'admin:shop_shoppingcartsession_changelist',
+                   'admin:shop_shoppingcartitem_changelist', 'admin:shop_order_changelist',
+                   'admin:shop_orderitem_changelist', 'admin:shop_outboxemail_changelist']
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.category = Category.objects.create(category_name='Mugs')
+
+    def add_rows(self, count):
+        """add count products, carts, cart items, orders, order items and emails"""
+        for _ in range(count):
+            product = Product.objects.create(category=self.category, product_name='Exactly', price=20)
+            cart = ShoppingCartSession.objects.create()
+            ShoppingCartItem.objects.create(cart=cart, product=product)
+            order = Order.objects.create(email='jane@example.com', phone='0412 345 678', total_price=20)
+            OrderItem.objects.create(order=order, product=product)
+            queue_email('Hello', 'body', ['someone@example.com'])
+
+    def changelist_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_queries_bounded(self):
+        """testing change lists run the same number of queries for 2 or 30 rows"""
+        self.add_rows(2)
+        # load the cached navbar categories
+        self.changelist_queries(self.CHANGELISTS[0])
+        few_rows = {url_name: len(self.changelist_queries(url_name)) for url_name in self.CHANGELISTS}
+
+        self.add_rows(28)
+        for url_name in self.CHANGELISTS:
+            self.assertEqual(len(self.changelist_queries(url_name)), few_rows[url_name], url_name)
+
+    def test_capped_count(self):
+        """testing change lists only count a limited number of rows and skip the full result count"""
+        self.add_rows(3)
+        for url_name in self.CHANGELISTS:
+            counts = [query['sql'] for query in self.changelist_queries(url_name) if 'COUNT(' in query['sql']]
+            self.assertEqual(len(counts), 1, url_name)
+            self.assertIn('LIMIT', counts[0], url_name)
+
+    @mock.patch.object(CappedCountPaginator, 'max_count', 5)
+    def test_rows_past_cap(self):
+        """testing a table with more rows than the cap still lists its first pages"""
+        self.add_rows(8)
+        response = self.client.get(reverse('admin:shop_order_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+
+class BulkAdminActionsTest(TestCase):
+    """admin bulk repricing and order status action tests"""
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.category_tshirt = Category.objects.create(category_name='T-Shirts')
+        self.mug1 = Product.objects.create(category=self.category_mug, product_name='Exactly', price=20)
+        self.mug2 = Product.objects.create(category=self.category_mug, product_name='Whatever', price='19.95')
+        self.tshirt = Product.objects.create(category=self.category_tshirt, product_name='Exactly', price=35)
+
+    def post_action(self, url_name, action, selected, **data):
+        return self.client.post(reverse(url_name), {'action': action, '_selected_action': [obj.pk for obj in selected],
+                                                    **data})
+
+    def prices(self):
+        return {product.pk: product.price for product in Product.objects.all()}
+
+    def test_preview(self):
+        """testing the reprice action shows the number of products and their new prices without changing them"""
+        response = self.post_action('admin:shop_product_changelist', 'reprice', [self.mug1, self.mug2])
+        self.assertContains(response, '2 products selected will be repriced.')
+
+        response = self.post_action('admin:shop_product_changelist', 'reprice', [self.mug1, self.mug2],
+                                    mode='percent', amount='10', preview='Preview')
+        self.assertEqual({product.pk: product.new_price for product in response.context['samples']},
+                         {self.mug1.pk: Decimal('22.00'), self.mug2.pk: Decimal('21.95')})
+        self.assertEqual(self.prices(), {self.mug1.pk: 20, self.mug2.pk: Decimal('19.95'), self.tshirt.pk: 35})
+
+    def test_reprice_selected(self):
+        """testing the selected products are repriced with a single UPDATE and their cached pages expired"""
+        version = get_version(product_page_version_key(self.mug1.slug))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_action('admin:shop_product_changelist', 'reprice', [self.mug1, self.mug2],
+                                        mode='percent', amount='-10', apply='Apply')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "shop_product"')]), 1)
+        self.assertEqual(self.prices(), {self.mug1.pk: 18, self.mug2.pk: Decimal('17.96'), self.tshirt.pk: 35})
+        self.assertNotEqual(get_version(product_page_version_key(self.mug1.slug)), version)
+
+    def test_reprice_modes(self):
+        """testing absolute repricing, setting a price and prices never going below zero"""
+        self.post_action('admin:shop_product_changelist', 'reprice', [self.mug1], mode='amount', amount='2.50',
+                         apply='Apply')
+        self.post_action('admin:shop_product_changelist', 'reprice', [self.mug2], mode='amount', amount='-25',
+                         apply='Apply')
+        self.post_action('admin:shop_product_changelist', 'reprice', [self.tshirt], mode='set', amount='29.95',
+                         apply='Apply')
+        self.assertEqual(self.prices(), {self.mug1.pk: Decimal('22.50'), self.mug2.pk: 0,
+                                         self.tshirt.pk: Decimal('29.95')})
+
+    def test_reprice_invalid(self):
+        """testing an invalid amount shows the form again and leaves the prices alone"""
+        response = self.post_action('admin:shop_product_changelist', 'reprice', [self.mug1], mode='percent',
+                                    amount='-100', apply='Apply')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual(Product.objects.get(pk=self.mug1.pk).price, 20)
+
+    def test_reprice_category(self):
+        """testing repricing a category changes every product in it and expires the category pages"""
+        version = get_version(category_page_version_key(self.category_mug.slug))
+        response = self.post_action('admin:shop_category_changelist', 'reprice', [self.category_mug])
+        self.assertContains(response, '2 products in these categories will be repriced.')
+
+        self.post_action('admin:shop_category_changelist', 'reprice', [self.category_mug], mode='amount',
+                         amount='1', apply='Apply')
+        self.assertEqual(self.prices(), {self.mug1.pk: 21, self.mug2.pk: Decimal('20.95'), self.tshirt.pk: 35})
+        self.assertNotEqual(get_version(category_page_version_key(self.category_mug.slug)), version)
+
+    def test_order_status(self):
+        """testing only the selected orders in the from status are changed"""
+        pending = Order.objects.create(email='jane@example.com', phone='0412 345 678')
+        shipped = Order.objects.create(email='jane@example.com', phone='0412 345 678', status='shipped')
+        delivered = Order.objects.create(email='jane@example.com', phone='0412 345 678', status='delivered')
+        other = Order.objects.create(email='jane@example.com', phone='0412 345 678')
+
+        response = self.post_action('admin:shop_order_changelist', 'mark_shipped', [pending, shipped, delivered])
+        self.assertContains(response, '1 of the 3 selected orders are pending and will be marked as shipped.')
+        self.assertEqual(Order.objects.get(pk=pending.pk).status, 'pending')
+
+        self.post_action('admin:shop_order_changelist', 'mark_shipped', [pending, shipped, delivered], apply='yes')
+        self.assertEqual(dict(Order.objects.values_list('pk', 'status')),
+                         {pending.pk: 'shipped', shipped.pk: 'shipped', delivered.pk: 'delivered',
+                          other.pk: 'pending'})
+
+        self.post_action('admin:shop_order_changelist', 'mark_delivered', [pending], select_across='1', apply='yes')
+        self.assertEqual(Order.objects.filter(status='delivered').count(), 3)
+
+
+class SQLiteConnectionTest(TransactionTestCase):
+    """SQLite connection setup tests"""
+
+    def test_pragmas(self):
+        """testing new connections are set up with the SQLITE_* settings"""
+        with connection.cursor() as cursor:
+            pragmas = {pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                       for pragma in ['journal_mode', 'busy_timeout', 'mmap_size', 'cache_size']}
+        self.assertEqual(pragmas, {'journal_mode': settings.SQLITE_JOURNAL_MODE, 'busy_timeout': settings.SQLITE_BUSY_TIMEOUT,
+                                   'mmap_size': settings.SQLITE_MMAP_SIZE, 'cache_size': settings.SQLITE_CACHE_SIZE})
+
+    def test_transaction_mode(self):
+        """testing transactions take the write lock when they start"""
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Category.objects.count()
+        self.assertEqual(queries[0]['sql'], f'BEGIN {settings.SQLITE_TRANSACTION_MODE}')
+
+
+class AsyncViewsTest(TestCase):
+    """catalog and cart views through the async request handler, as under ASGI"""
+
+    def setUp(self):
+        self.category_mug = Category.objects.create(category_name='Mugs')
+        self.mugs = [Product.objects.create(category=self.category_mug, product_name=f'Mug {number}', price=20)
+                     for number in range(settings.PRODUCTS_PER_PAGE + 1)]
+
+    async def test_products(self):
+        """testing the products page and its navbar load with the async ORM"""
+        response = await self.async_client.get(reverse('products', args=[self.category_mug.slug]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Mug 0')
+        self.assertContains(response, f'About {len(self.mugs)} products')
+        self.assertEqual(list(response.context['categories']), [self.category_mug])
+
+        response = await self.async_client.get(reverse('products', args=[self.category_mug.slug]), {'page': 2})
+        self.assertEqual(len(response.context['products']), 1)
+
+        response = await self.async_client.get(reverse('products', args=['no-such-category']))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cart(self):
+        """testing adding to the cart, viewing it and changing a quantity"""
+        response = await self.async_client.get(reverse('product_details', args=[self.mugs[0].slug]))
+        self.assertFalse(response.context['product_in_cart'])
+
+        response = await self.async_client.post(reverse('product_details', args=[self.mugs[0].slug]), {'quantity': 2})
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.get(reverse('product_details', args=[self.mugs[0].slug]))
+        self.assertTrue(response.context['product_in_cart'])
+
+        response = await self.async_client.get(reverse('shopping_cart'))
+        item, = response.context['shopping_cart_items']
+        self.assertEqual(item.quantity, 2)
+
+        response = await self.async_client.post(reverse('update_quantity'), {'item_id': item.pk, 'quantity': 5})
+        self.assertEqual(response.json(), {'status': 'success'})
+        self.assertEqual((await ShoppingCartItem.objects.aget(pk=item.pk)).quantity, 5)
+
+    async def test_update_quantity_invalid(self):
+        """testing missing or out of range quantities are rejected by update_quantity"""
+        await self.async_client.post(reverse('product_details', args=[self.mugs[0].slug]), {'quantity': 2})
+        response = await self.async_client.get(reverse('shopping_cart'))
+        item, = response.context['shopping_cart_items']
+
+        for data in [{}, {'quantity': ''}, {'quantity': 'many'}, {'quantity': 0}, {'quantity': -1}, {'quantity': 1000}]:
+            response = await self.async_client.post(reverse('update_quantity'), {'item_id': item.pk, **data})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual((await ShoppingCartItem.objects.aget(pk=item.pk)).quantity, 2)
+
+    @override_settings(CART_STORAGE='cookie')
+    async def test_cookie_cart(self):
+        """testing the cookie cart is loaded and saved by the async views"""
+        await self.async_client.post(reverse('product_details', args=[self.mugs[0].slug]), {'quantity': 1})
+        response = await self.async_client.get(reverse('shopping_cart'))
+        item, = response.context['shopping_cart_items']
+
+        response = await self.async_client.post(reverse('update_quantity'), {'item_id': item.pk, 'quantity': 3})
+        self.assertIn(settings.CART_COOKIE_NAME, response.cookies)
+        response = await self.async_client.get(reverse('shopping_cart'))
+        self.assertEqual(response.context['shopping_cart_items'][0].quantity, 3)
+        self.assertFalse(await ShoppingCartItem.objects.aexists())
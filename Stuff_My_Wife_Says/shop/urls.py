@@ -11,8 +11,12 @@ urlpatterns = [
     path('shopping_cart/', views.shopping_cart, name='shopping_cart'),
     path('remove_item/<int:pk>/', views.remove_item, name='remove_item'),
     path('shopping_cart/update_quantity/', views.update_quantity, name='update_quantity'),
+    path('shopping_cart/update_quantities/', views.update_quantities, name='update_quantities'),
     path('checkout/<uuid:cart_uuid>/', views.checkout, name='checkout'),
     path('purchase_confirmed/<uuid:order_number>/', views.purchase_confirmed, name='purchase_confirmed'),
+    path('order_status/', views.order_status, name='order_status'),
+    path('search/', views.search, name='search'),
+    path('search/json/', views.search_json, name='search_json'),
     path('about/', AboutView.as_view(), name='about'),
     path('contact/', views.contact, name='contact'),
 ]
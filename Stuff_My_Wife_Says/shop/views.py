@@ -1,46 +1,139 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import TemplateView
-from .models import Category, Product, ShoppingCartSession, ShoppingCartItem, Order, OrderItem
-from .forms import AddTShirtToCartForm, AddMugToCartForm, PaymentForm, CustomerDetailsForm, ContactForm
+from .models import Category, Product, ShoppingCartSession, ShoppingCartItem, Order, OrderItem, DailySales
+from .forms import AddTShirtToCartForm, AddMugToCartForm, PaymentForm, CustomerDetailsForm, ContactForm, OrderLookupForm
 from django.contrib.sessions.models import Session
 import uuid
+import json
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from .pagination import KeysetPaginator
+from .search import search_products
+from django.urls import reverse
+from django.http import JsonResponse, Http404
+from .cart import Cart
 from django.contrib import messages
-from django.core.mail import send_mail
+from .outbox import queue_email
+from .stock import reserve_stock, OutOfStock
 from django.conf import settings
+from django.utils.decorators import method_decorator
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from .caching import (cache_catalog_page, category_page_version_key, product_page_version_key,
+                      catalog_page_digest, has_pending_messages, async_condition,
+                      async_vary_on_cookie)
+from .context_processors import load_navbar
 
+# maximum number of products shown on the search page and returned by the search endpoint.
+SEARCH_RESULTS_LIMIT = 50
 
+# largest quantity of a single item a customer can set from the shopping cart page.
+MAX_ITEM_QUANTITY = 99
+
+# most previous orders listed with an order on the order status page.
+ORDER_HISTORY_LIMIT = 20
+# the query parameters the products page reads, the page is cached per combination of these only.
+PRODUCTS_QUERY_PARAMS = ('cursor', 'page')
+
+
+@method_decorator(cache_catalog_page(), name='dispatch')
 class HomePageView(TemplateView):
     """home page view"""
     template_name = 'home.html'
 
 
-def products(request, category_slug):
-    """products page to display products available to the customer in card format."""
-    category = get_object_or_404(Category, slug=category_slug)
+def products_etag(request, category_slug):
+    """ETag for a products page, changes when any product in the category or the navbar categories change"""
+    if has_pending_messages(request):
+        return None
+    return catalog_page_digest(request, [category_page_version_key(category_slug)],
+                               query_params=PRODUCTS_QUERY_PARAMS)
+
+
+# condition() answers 'If-None-Match' with 304 before the page is looked up or rendered.
+# There is no Last-Modified, no single date changes with everything on the page (deleted or moved products,
+# the navbar categories, the customers cart) so 'If-Modified-Since' could be answered with a stale page.
+@async_condition(etag_func=products_etag)
+@cache_catalog_page(version_keys=lambda category_slug: [category_page_version_key(category_slug)],
+                    query_params=PRODUCTS_QUERY_PARAMS)
+async def products(request, category_slug):
+    """products page to display products available to the customer in card format.
+    Async so under ASGI the request doesn't hold a thread while it waits for the database."""
+    try:
+        category = await Category.objects.aget(slug=category_slug)
+    except Category.DoesNotExist:
+        raise Http404('No category found')
     products = Product.objects.filter(category=category).order_by('price')
 
-    # create Paginator object and pass query_set and number of items per page
-    paginator = Paginator(products, 8)
+    # old '?page=' links are still answered with the numbered Paginator.
+    if 'page' in request.GET:
+        # create Paginator object and pass query_set and number of items per page
+        paginator = Paginator(products, settings.PRODUCTS_PER_PAGE)
 
-    # get the current page number from the request's query paramaters
-    page_number = request.GET.get('page')
+        # get the current page number from the request's query paramaters
+        page_number = request.GET.get('page')
 
-    # get the page object for the current page
-    # get_page() method will return last page if page_number is outside range or
-    # first page if page_number isn't a valid number.
-    page_obj_products = paginator.get_page(page_number)
+        # get the page object for the current page
+        # get_page() method will return last page if page_number is outside range or
+        # first page if page_number isn't a valid number.
+        # Paginator has no async API, the page and its products are loaded in a thread.
+        page_obj_products = await sync_to_async(get_numbered_page)(paginator, page_number)
+        cursor_pagination = False
+    else:
+        # cursor pagination seeks straight to the next (price, id) position instead of
+        # counting every product and skipping over the earlier pages.
+        paginator = KeysetPaginator(products, settings.PRODUCTS_PER_PAGE,
+                                    count_cache_key=f'products_count_{category.pk}',
+                                    count_cache_timeout=settings.PRODUCTS_COUNT_CACHE_TIMEOUT)
+        page_obj_products = await paginator.aget_page(request.GET.get('cursor'))
+        if page_obj_products.has_other_pages():
+            # the template shows the number of products with the page links.
+            await paginator.aload_approximate_count()
+        cursor_pagination = True
 
     # pass page object into context dictionary
-    context = {'products': page_obj_products, 'category_name': category.category_name}
+    context = {'products': page_obj_products, 'category_name': category.category_name,
+               'cursor_pagination': cursor_pagination}
 
+    # everything the template needs must be loaded before rendering, templates can't use the async ORM.
+    await load_navbar(request)
     return render(request, 'products.html', context)
 
 
-def product_details(request, product_slug):
+def get_numbered_page(paginator, page_number):
+    """Paginator page with its products loaded"""
+    page = paginator.get_page(page_number)
+    page.object_list = list(page.object_list)
+    return page
+
+
+def product_cart_bucket(request, product_slug):
+    """cached product details pages are split on whether the product is already in the customers cart"""
+    if request.cart.contains_slug(product_slug):
+        return 'in-cart'
+    return 'not-in-cart'
+
+
+def product_details_etag(request, product_slug):
+    """ETag for a product details page, changes when the product, the navbar categories or the cart bucket change"""
+    if has_pending_messages(request):
+        return None
+    return catalog_page_digest(request, [product_page_version_key(product_slug)],
+                               product_cart_bucket(request, product_slug))
+
+
+# the page depends on the customers cart so browsers and CDNs must keep a copy per cookie.
+@async_vary_on_cookie
+@async_condition(etag_func=product_details_etag)
+@cache_catalog_page(version_keys=lambda product_slug: [product_page_version_key(product_slug)],
+                    cart_bucket=product_cart_bucket)
+async def product_details(request, product_slug):
     """diplay product information and allow users to add product to cart."""
-    product = get_object_or_404(Product, slug=product_slug)
+    try:
+        product = await Product.objects.select_related('category').aget(slug=product_slug)
+    except Product.DoesNotExist:
+        raise Http404('No product found')
 
     # retrieve the form for the corresponding product.
     # get the tshirt form, otherwise get the mug form.
@@ -51,80 +144,60 @@ def product_details(request, product_slug):
 
     context = {'form': form, 'product': product}
 
-    # check if the product is in the cart already.
-    context['product_in_cart'] = is_product_in_cart(request, product)
-
     # handle form submission data
     if request.method == 'POST' and form.is_valid():
-            cart_uuid = request.session.get('cart_uuid')
-            
-            # if the user has a cart_uuid than get ShoppingCartSession and add item to cart
-            if cart_uuid is not None:
-                try:
-                    # get users shopping cart session, create shopping cart item and add form data
-                    cart = ShoppingCartSession.objects.get(cart_uuid=cart_uuid)
-                    cart_item = ShoppingCartItem(cart=cart)
-                    cart_item.product = product
-                    cart_item.quantity = form.cleaned_data['quantity']
-
-                    # check if form has size field for T-shirts
-                    if 'size' in form.fields:
-                        cart_item.tshirt_size = form.cleaned_data['size']
-                    cart_item.save()
-
-                    return redirect('products', category_slug=product.category.slug)
-                    
-                except ShoppingCartSession.DoesNotExist:
-                    messages.warning('Woops! Something went wrong while adding the item to your cart. Please try again.')
-                    return render(request, 'product_details.html', context)
-            else:
-                # if the user doesn't have a cart session than
-                # create uuid and store it under 'cart_uuid' in 'request.session' dictionary.
-                cart_uuid = uuid.uuid4()
-                request.session['cart_uuid'] = str(cart_uuid)
-
-                # create 'ShoppingCartSession' obj and save session uuid to it.
-                cart = ShoppingCartSession()
-                cart.cart_uuid = cart_uuid
-                cart.save()
-                
-                # create 'ShoppingCartItem' obj and save form details to it.
-                cart_item = ShoppingCartItem(cart=cart)
-                cart_item.product = product
-                cart_item.quantity = form.cleaned_data['quantity']
-
-                # check if form has size field for T-shirts
-                if 'size' in form.fields:
-                    cart_item.tshirt_size = form.cleaned_data['size']
-                cart_item.save()
-                
-                # return back to products page
-                return redirect('products', category_slug=product.category.slug)
-    else:        
+        # add form data to the users cart. A cart is created if the user doesn't have one yet.
+        # check if form has size field for T-shirts
+        tshirt_size = form.cleaned_data['size'] if 'size' in form.fields else ''
+        # adding to the cart writes the users session and upserts the item with raw SQL, neither has an async API.
+        await sync_to_async(request.cart.add)(product, form.cleaned_data['quantity'], tshirt_size)
+
+        # return back to products page
+        return redirect('products', category_slug=product.category.slug)
+    else:
+        # check if the product is in the cart already.
+        await request.cart.aload()
+        context['product_in_cart'] = is_product_in_cart(request, product)
+        await load_navbar(request)
         return render(request, 'product_details.html', context)
 
 def is_product_in_cart(request, product):
     """checking whether the customers cart already has the product in it."""
-    # cart_uuid is 'None' if no session exists.
-    cart_uuid = request.session.get('cart_uuid')
-
-    # if cart does not exist then item is not in the shopping cart yet.
-    if cart_uuid:
-        try:
-            # get shopping cart and use relationship with ShoppingCartItem
-            # to see if product is in cart.
-            cart = ShoppingCartSession.objects.get(cart_uuid=cart_uuid)
-            cart_item = cart.cart_items.filter(product=product).first()
-
-            # if item in cart then return true.
-            if cart_item:
-                return True
-        except ShoppingCartSession.DoesNotExist:
-            pass
-    else:
-        return False
+    # uses the cart loaded for this request, no cart means the item is not in the shopping cart yet.
+    return request.cart.contains(product)
         
 
+def search(request):
+    """search page listing the products whose name or category matches the customers search."""
+    query = request.GET.get('q', '')
+    category_slug = request.GET.get('category') or None
+    results = search_products(query, category_slug, limit=SEARCH_RESULTS_LIMIT)
+
+    context = {'query': query, 'category_slug': category_slug, 'products': results}
+    return render(request, 'search.html', context)
+
+
+def search_json(request):
+    """JSON search endpoint for search as you type. Returns the best matching products first."""
+    query = request.GET.get('q', '')
+    category_slug = request.GET.get('category') or None
+
+    # number of results requested, limited to SEARCH_RESULTS_LIMIT.
+    try:
+        limit = min(max(int(request.GET.get('limit', SEARCH_RESULTS_LIMIT)), 1), SEARCH_RESULTS_LIMIT)
+    except ValueError:
+        limit = SEARCH_RESULTS_LIMIT
+
+    results = [{'product_name': product.product_name,
+                'category_name': product.category.category_name,
+                'price': str(product.price),
+                'url': reverse('product_details', args=[product.slug]),
+                'image_url': product.image.url}
+               for product in search_products(query, category_slug, limit=limit)]
+    return JsonResponse({'status': 'success', 'query': query, 'results': results})
+
+
+@method_decorator(cache_catalog_page(), name='dispatch')
 class AboutView(TemplateView):
     """information about the company"""
     template_name = 'about_us.html'
@@ -159,66 +232,129 @@ def send_contact_email(name, email, subject, order_number, message):
     Order Number: {order_number}
     Message: {message}'''
 
-    # send customer message to the company's dedicated contact email.
-    send_mail(subject=email_subject,
-              message=email_body,
-              from_email=settings.DEFAULT_FROM_EMAIL,
-              recipient_list=[settings.CONTACT_EMAIL],)
+    # queue the customer message for the company's dedicated contact email, run_outbox sends it
+    # so the customer isn't kept waiting on the email server.
+    queue_email(subject=email_subject,
+                body=email_body,
+                recipients=[settings.CONTACT_EMAIL],
+                reply_to=[email])
 
 
-def shopping_cart(request):
+async def shopping_cart(request):
     """displays the users current shopping cart session if it exists."""
-    # if cart_uuid exists in session then look for cart_uuid in ShoppingCartSession object
-    # and then get shopping cart items.
-    # render shopping_html html otherwise render no_cart html if no object exists.
-    cart_uuid = request.session.get('cart_uuid')
-    if cart_uuid is not None:
-        shopping_cart = get_object_or_404(ShoppingCartSession, cart_uuid=cart_uuid)
-        shopping_cart_items = ShoppingCartItem.objects.filter(cart=shopping_cart)
-
-        # if no items in the shopping_cart then render 'no_shopping_cart.html'
-        if not shopping_cart_items:
-            return render(request, 'no_shopping_cart.html', {})
-
-        return render(request, 'shopping_cart.html', {'shopping_cart_items': shopping_cart_items,
-                                                          'shopping_cart': shopping_cart})
-    else:
+    # request.cart loads the users ShoppingCartSession and its items once for the whole request.
+    # render shopping_html html otherwise render no_cart html if no cart or no items exist.
+    cart = request.cart
+    await cart.aload()
+    await load_navbar(request)
+
+    # if no items in the shopping_cart then render 'no_shopping_cart.html'
+    if not cart.items:
         return render(request, 'no_shopping_cart.html', {})
 
+    return render(request, 'shopping_cart.html', {'shopping_cart_items': cart.items,
+                                                  'shopping_cart': cart})
+
 
 def remove_item(request, pk):
     """removes item from shopping cart"""
-    shopping_cart_item = get_object_or_404(ShoppingCartItem, pk=pk)
-    shopping_cart_item.delete()
+    # only items in the users own cart can be removed.
+    if not request.cart.remove(pk):
+        raise Http404('Item not found in your cart')
 
     return redirect('shopping_cart')
 
 
-def update_quantity(request):
+def clean_quantity(value):
+    """quantity for a cart item sent by the browser, None unless it's a whole number from 1 to MAX_ITEM_QUANTITY"""
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if 1 <= quantity <= MAX_ITEM_QUANTITY else None
+
+
+def invalid_quantity_response():
+    """400 response for a quantity clean_quantity() rejected"""
+    return JsonResponse({'status': 'error', 'message': f'Quantity must be between 1 and {MAX_ITEM_QUANTITY}'},
+                        status=400)
+
+
+async def update_quantity(request):
     """updates the ShoppingCartItem model based on the user increasing or reducing
     the quantity of an item"""
     if request.method == 'POST':
         item_id = request.POST.get('item_id')
-        quantity =int(request.POST.get('quantity'))
-        
-        shopping_cart_item = get_object_or_404(ShoppingCartItem, pk=item_id)
+        quantity = clean_quantity(request.POST.get('quantity'))
+        if quantity is None:
+            return invalid_quantity_response()
+
+        # only items in the users own cart can be updated.
+        await request.cart.aload()
+        shopping_cart_item = request.cart.get_item(item_id)
+        if shopping_cart_item is None:
+            raise Http404('Item not found in your cart')
         shopping_cart_item.quantity = quantity
-        shopping_cart_item.save()
+        await request.cart.asave_quantities([shopping_cart_item])
         
         return JsonResponse({'status': 'success'})
     else:
         return JsonResponse({'status': 'error'})
     
 
+def update_quantities(request):
+    """updates the quantity of several items in the users cart at once.
+    Expects a JSON body like {"items": [{"item_id": 1, "quantity": 2}, ...]}, every item must be in the users
+    own cart. All changes are saved together and the new line and cart totals are returned."""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'POST required'}, status=405)
+
+    try:
+        changes = {str(change['item_id']): change['quantity'] for change in json.loads(request.body)['items']}
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
+
+    # the cart and its items are already loaded for this request so checking ownership needs no extra queries.
+    cart = request.cart
+    updated_items = []
+    for item_id, quantity in changes.items():
+        item = cart.get_item(item_id)
+        if item is None:
+            return JsonResponse({'status': 'error', 'message': f'Item {item_id} is not in your cart'}, status=404)
+        quantity = clean_quantity(quantity)
+        if quantity is None:
+            return invalid_quantity_response()
+        item.quantity = quantity
+        updated_items.append(item)
+
+    # all changes are saved with one query (or one cookie for cookie carts).
+    cart.save_quantities(updated_items)
+
+    # every item's product was loaded with the cart, work out the new totals from the saved quantities.
+    line_totals = {item.pk: item.quantity * item.product.price for item in cart.items}
+    return JsonResponse({'status': 'success',
+                         'items': [{'item_id': item.pk, 'quantity': item.quantity,
+                                    'line_total': str(line_totals[item.pk])} for item in updated_items],
+                         'order_total_price': str(sum(line_totals.values()))})
+    
+
 def checkout(request, cart_uuid):
     """checkout for getting user address and payment details"""
     # forms for customer payment and contact information
     payment_form = PaymentForm(request.POST or None)
     customer_details_form = CustomerDetailsForm(request.POST or None)
 
-    # get users shopping cart information for order summary
-    shopping_cart = get_object_or_404(ShoppingCartSession, cart_uuid=cart_uuid)
-    shopping_cart_items = ShoppingCartItem.objects.filter(cart=shopping_cart)
+    # get users shopping cart information for order summary.
+    # reuse the cart already loaded for this request when it is the cart being checked out.
+    shopping_cart = request.cart
+    if str(shopping_cart.cart_uuid) != str(cart_uuid):
+        shopping_cart = Cart(request, cart_uuid=cart_uuid)
+    if not shopping_cart.exists():
+        raise Http404('No shopping cart found')
+    # the cart has already been turned into an order, i.e. the customer pressed the order button twice.
+    if shopping_cart.session.status == 'closed':
+        return redirect_to_cart_order(shopping_cart.cart_uuid)
+    shopping_cart_items = shopping_cart.items
 
     # add forms and shopping cart information to view context
     context = {'payment_form': payment_form, 'customer_details_form': customer_details_form,
@@ -244,30 +380,35 @@ def checkout(request, cart_uuid):
             # create uuid number for order_number field
             order_number = uuid.uuid4()
             order.order_number = order_number
-            order.save()
-
-            # get customers shopping cart and transfer item information to OrderItem model.
-            shopping_cart = get_object_or_404(ShoppingCartSession, cart_uuid=cart_uuid)
-            shopping_cart_items = ShoppingCartItem.objects.filter(cart=shopping_cart)
-            # create OrderItem objects for each item in the order
-            for item in shopping_cart_items:
-                order_item = OrderItem()
-                order_item.order = order
-                order_item.product = item.product
-                order_item.quantity = item.quantity
-                order_item.tshirt_size = item.tshirt_size or ''
-                order_item.save()
-                
-            # get the total price of the order from order items quantity and price
-            order.total_price = order.calculate_total_price()
-            order.save()
-                
-            # NOTE: do nothing with payment details since this is just a mock payment system.
-            # If it went live than I would integrate a payment gateway such as PayPal API.
-
-            # update ShoppingCartSession status from 'open' to 'closed'
-            shopping_cart.status = 'closed'
-            shopping_cart.save()
+
+            # Everything is saved in one transaction so a failure can't leave half an order behind.
+            try:
+                with transaction.atomic():
+                    # carts kept in a cookie are only written to the database now the customer is placing an order.
+                    cart_session = shopping_cart.save_to_database()
+                    # claim the cart by closing it. The update only succeeds for one request, a repeated or parallel
+                    # submit of the same cart waits for the first to finish then finds the cart already closed.
+                    claimed = (ShoppingCartSession.objects.filter(pk=cart_session.pk).exclude(status='closed')
+                               .update(status='closed', modified=timezone.now()))
+                    if claimed:
+                        # load the items, their products and the cart total again with one query now nothing else
+                        # can change the cart, the ones shown on the checkout page may have old prices or quantities.
+                        ordered_cart = Cart(request, cart_uuid=cart_session.cart_uuid)
+                        place_order(order, ordered_cart, cart_session)
+            except OutOfStock as error:
+                # the order wasn't saved and the cart is still open, send the customer back to their cart.
+                shopping_cart.undo_save_to_database()
+                for stock, quantity in error.shortages:
+                    size = f' ({stock.get_tshirt_size_display()})' if stock.tshirt_size else ''
+                    if stock.quantity:
+                        messages.warning(request, f'Sorry, we only have {stock.quantity} of '
+                                                  f'{stock.product.product_name}{size} left.')
+                    else:
+                        messages.warning(request, f'Sorry, {stock.product.product_name}{size} is sold out.')
+                return redirect('shopping_cart')
+
+            if not claimed:
+                return redirect_to_cart_order(cart_session.pk)
 
             return redirect('purchase_confirmed', order_number=order_number)
         else:
@@ -278,13 +419,95 @@ def checkout(request, cart_uuid):
         return render(request, 'checkout.html', context)
 
 
+def place_order(order, shopping_cart, cart_session):
+    """save the order and its items from the customers cart, called in the checkout transaction"""
+    order.cart = cart_session
+    # take the items out of stock first, raises OutOfStock if there isn't enough left.
+    reserve_stock([(item.product, item.tshirt_size, item.quantity) for item in shopping_cart.items])
+
+    # get the total price of the order from the cart, calculated by the database when the cart was loaded.
+    order.total_price = shopping_cart.order_total_price()
+    order.save()
+
+    # transfer the customers shopping cart item information to OrderItem model.
+    # the price is recorded from the product loaded with the cart, bulk_create doesn't call OrderItem.save().
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=item.product, price=item.product.price, quantity=item.quantity,
+                  tshirt_size=item.tshirt_size or '')
+        for item in shopping_cart.items])
+
+    # add the order to the daily sales report with one more query.
+    DailySales.record_sales(timezone.localdate(order.date_ordered),
+                            [(item.product, item.tshirt_size, item.quantity, item.product.price)
+                             for item in shopping_cart.items])
+
+    # NOTE: do nothing with payment details since this is just a mock payment system.
+    # If it went live than I would integrate a payment gateway such as PayPal API.
+
+    # the confirmation email is queued in the same transaction so it is only sent if the order is saved.
+    queue_order_confirmation_email(order, shopping_cart.items)
+    return order
+
+
+def queue_order_confirmation_email(order, items):
+    """queue an email to the customer with their order number and the items ordered"""
+    item_lines = '\n'.join(
+        f'    {item.quantity} x {item.product.product_name}{f" ({item.tshirt_size})" if item.tshirt_size else ""}'
+        f' - ${item.quantity * item.product.price}' for item in items)
+    email_body = f'''Hi {order.first_name},
+
+    Thank you for your order!
+
+    Order Number: {order.order_number}
+{item_lines}
+    Total: ${order.total_price}
+
+    Your order will be sent to {order.address}, {order.suburb} {order.state} {order.post_code}.'''
+
+    queue_email(subject=f'Stuff My Wife Says order confirmation #{order.order_number}',
+                body=email_body,
+                recipients=[order.email])
+
+
+def redirect_to_cart_order(cart_uuid):
+    """redirect to the confirmation page of the order placed from a cart that has already been checked out"""
+    order_number = Order.objects.filter(cart_id=cart_uuid).values_list('order_number', flat=True).first()
+    if order_number is None:
+        raise Http404('This shopping cart has already been checked out')
+    return redirect('purchase_confirmed', order_number=order_number)
+
+
 def purchase_confirmed(request, order_number):
     """purchase confirmation receipt appears on screen with customer's order number"""
 
     # Order has been confirmed, and therfore can delete customer cart session
-    if 'cart_uuid' in request.session:
-        del request.session['cart_uuid']
+    request.cart.clear()
     
     order = get_object_or_404(Order, order_number=order_number)
     context = {'order': order}
     return render(request, 'purchase_confirmed.html', context)
+
+
+def order_status(request):
+    """lets customers check the status of their order with their order number and email,
+    along with the other orders placed with the same email."""
+    lookup_form = OrderLookupForm(request.POST or None)
+    context = {'lookup_form': lookup_form}
+
+    if request.method == 'POST' and lookup_form.is_valid():
+        email = lookup_form.cleaned_data['email']
+        # order items with their product are loaded with one more query for every order on the page.
+        items = Prefetch('order_items', queryset=OrderItem.objects.select_related('product__category').order_by('pk'))
+
+        # found by primary key, the email has to match as well so order numbers alone don't reveal anything.
+        order = (Order.objects.filter(order_number=lookup_form.cleaned_data['order_number'], email=email)
+                 .prefetch_related(items).first())
+        if order is None:
+            messages.warning(request, "Sorry, we couldn't find an order with that order number and email.")
+        else:
+            # the newest orders for the email, read in order from the (email, date_ordered) index.
+            context['order'] = order
+            context['previous_orders'] = (Order.objects.filter(email=email).exclude(order_number=order.order_number)
+                                          .order_by('-date_ordered').prefetch_related(items)[:ORDER_HISTORY_LIMIT])
+
+    return render(request, 'order_status.html', context)